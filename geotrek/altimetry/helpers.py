@@ -1,4 +1,10 @@
+import json
 import logging
+import os
+import struct
+import sys
+import tempfile
+from array import array
 
 from django.contrib.gis.geos import GEOSGeometry
 from django.utils import translation
@@ -7,12 +13,18 @@ from django.contrib.gis.geos import LineString
 from django.conf import settings
 from django.db import connection
 
+import cairosvg
 import pygal
 from pygal.style import LightSolarizedStyle
 
 
 logger = logging.getLogger(__name__)
 
+# Binary format of stored elevation areas:
+# magic, metadata length (uint32), metadata (JSON), altitudes grid (int16, little endian)
+AREA_MAGIC = b'GTDEM\x01'
+AREA_HEADER = struct.Struct('<I')
+
 
 class AltimetryHelper(object):
     @classmethod
@@ -52,6 +64,64 @@ class AltimetryHelper(object):
         dxyz = [pointsm[i] + v for i, v in enumerate(geom3dapi.coords)]
         return dxyz
 
+    @classmethod
+    def elevation_profiles(cls, geometries, precision=None):
+        """Extract elevation profiles of several 3D geometries, by key.
+        Distances of all lines are computed in a single query.
+        """
+        profiles = {}
+        lines = []
+        for key, geometry3d in geometries.items():
+            if geometry3d.geom_type == 'LineString':
+                lines.append((key, geometry3d))
+            else:
+                profiles[key] = cls.elevation_profile(geometry3d, precision)
+        if not lines:
+            return profiles
+
+        sql = """
+        WITH lines AS (SELECT * FROM (VALUES {values}) AS t(rank, geom)),
+             line_measure AS (SELECT rank, ST_Addmeasure(geom, 0, ST_length(geom)) AS geom
+                              FROM (SELECT rank, ST_Force2D(geom) AS geom FROM lines) AS line2d),
+             points2dm AS (SELECT rank, ST_DumpPoints(geom) AS dp FROM line_measure)
+        SELECT rank, ST_M((dp).geom) FROM points2dm ORDER BY rank, (dp).path[1];
+        """.format(values=', '.join(['(%s, %s::geometry)'] * len(lines)))
+        params = []
+        for rank, (key, geometry3d) in enumerate(lines):
+            params += [rank, geometry3d.ewkt]
+        cursor = connection.cursor()
+        cursor.execute(sql, params)
+        distances = [[] for line in lines]
+        for rank, distance in cursor.fetchall():
+            distances[rank].append(distance)
+        for (key, geometry3d), pointsm in zip(lines, distances):
+            geom3dapi = geometry3d.transform(settings.API_SRID, clone=True)
+            assert len(pointsm) == len(geom3dapi.coords), 'Cannot map distance to xyz'
+            profiles[key] = [(pointsm[i], ) + v for i, v in enumerate(geom3dapi.coords)]
+        return profiles
+
+    @classmethod
+    def downsample_profile(cls, profile, max_points):
+        """Keep at most max_points evenly spaced steps of profile, including first and last ones.
+        """
+        if not max_points or len(profile) <= max_points:
+            return profile
+        if max_points == 1:
+            return profile[:1]
+        step = (len(profile) - 1) / (max_points - 1)
+        return [profile[int(round(i * step))] for i in range(max_points)]
+
+    @classmethod
+    def profile_data(cls, profile):
+        """Format profile as distance, elevation, [lng, lat], with its limits.
+        """
+        data = {}
+        for step in profile:
+            formatted = step[0], step[3], step[1:3]
+            data.setdefault('profile', []).append(formatted)
+        data['limits'] = dict(zip(['ceil', 'floor'], cls.altimetry_limits(profile)))
+        return data
+
     @classmethod
     def altimetry_limits(cls, profile):
         elevations = [int(v[3]) for v in profile]
@@ -90,20 +160,36 @@ class AltimetryHelper(object):
         style.colors = (settings.ALTIMETRIC_PROFILE_COLOR,)
         style.font_family = settings.ALTIMETRIC_PROFILE_FONT
         line_chart = pygal.XY(fill=True, style=style, **config)
-        if language:
-            translation.activate(language)
-        line_chart.x_title = _("Distance (m)")
-        line_chart.y_title = _("Altitude (m)")
-        line_chart.show_minor_x_labels = False
-        line_chart.x_labels_major_count = 5
-        line_chart.show_minor_y_labels = False
-        line_chart.truncate_label = 50
-        line_chart.range = [floor_elevation, ceil_elevation]
-        line_chart.no_data_text = _("Altimetry data not available")
-        translation.deactivate()
+        # Restore the previously active language afterwards, charts may be
+        # rendered in-process while another language is active (sync_rando)
+        with translation.override(language or translation.get_language()):
+            line_chart.x_title = _("Distance (m)")
+            line_chart.y_title = _("Altitude (m)")
+            line_chart.show_minor_x_labels = False
+            line_chart.x_labels_major_count = 5
+            line_chart.show_minor_y_labels = False
+            line_chart.truncate_label = 50
+            line_chart.range = [floor_elevation, ceil_elevation]
+            line_chart.no_data_text = _("Altimetry data not available")
         line_chart.add('', [(int(v[0]), int(v[3])) for v in profile])
         return line_chart.render()
 
+    @classmethod
+    def profile_png(cls, profile, language):
+        """
+        Rasterize the altimetric graph in PNG, in-process, without
+        any round trip to the conversion server.
+        """
+        return cairosvg.svg2png(bytestring=cls.profile_svg(profile, language))
+
+    @classmethod
+    def profile_pngs(cls, profile, languages):
+        """
+        Rasterize the altimetric graph of the same profile in several languages.
+        Returns a dict of PNG contents by language.
+        """
+        return {language: cls.profile_png(profile, language) for language in languages}
+
     @classmethod
     def _nice_extent(cls, geom):
         xmin, ymin, xmax, ymax = geom.extent
@@ -126,6 +212,23 @@ class AltimetryHelper(object):
                                   int(ycenter + height / 2.0))
         return (xmin, ymin, xmax, ymax)
 
+    @classmethod
+    def dem_table(cls, precision):
+        """Coarsest DEM overview (see ``loaddem --overviews``) which is still
+        finer than precision, or the DEM itself.
+        """
+        cursor = connection.cursor()
+        cursor.execute("""
+            SELECT o.o_table_name
+            FROM raster_overviews AS o
+            JOIN raster_columns AS r ON (r.r_table_name = o.r_table_name AND r.r_raster_column = o.r_raster_column)
+            WHERE o.r_table_name = 'mnt' AND abs(r.scale_x) * o.overview_factor <= %s
+            ORDER BY o.overview_factor DESC
+            LIMIT 1
+        """, [precision])
+        row = cursor.fetchone()
+        return row[0] if row else 'mnt'
+
     @classmethod
     def elevation_area(cls, geom):
         xmin, ymin, xmax, ymax = cls._nice_extent(geom)
@@ -165,9 +268,9 @@ class AltimetryHelper(object):
                     FROM lines, columns
                 ),
                 draped AS (
-                    SELECT id, ST_Value(mnt.rast, p.geom)::int AS altitude
-                    FROM mnt, points2d AS p
-                    WHERE ST_Intersects(mnt.rast, p.geom)
+                    SELECT id, ST_Value(dem.rast, p.geom)::int AS altitude
+                    FROM {table} AS dem, points2d AS p
+                    WHERE ST_Intersects(dem.rast, p.geom)
                 ),
                 all_draped AS (
                     SELECT geomll, geom, altitude
@@ -191,7 +294,7 @@ class AltimetryHelper(object):
                    altitude
             FROM extent_latlng, resolution, all_draped;
         """.format(xmin=xmin, ymin=ymin, xmax=xmax, ymax=ymax,
-                   srid=settings.SRID, precision=precision)
+                   srid=settings.SRID, precision=precision, table=cls.dem_table(precision))
         cursor.execute(sql)
         result = cursor.fetchall()
         first = result[0]
@@ -253,3 +356,93 @@ class AltimetryHelper(object):
             'altitudes': altitudes
         }
         return area
+
+    @classmethod
+    def dem_version(cls):
+        """Identify the DEM currently loaded, or None if there is no DEM.
+        It changes when the mnt table is (re)created, loaded by loaddem (which stores
+        a version in the comment of the table) or when its overviews are rebuilt.
+        Only catalogs are read, not the DEM itself.
+        """
+        cursor = connection.cursor()
+        cursor.execute("""
+            SELECT c.oid, obj_description(c.oid, 'pg_class'),
+                   (SELECT string_agg(o.overview_factor::text, ',' ORDER BY o.overview_factor)
+                    FROM raster_overviews AS o WHERE o.r_table_name = 'mnt')
+            FROM pg_class AS c
+            WHERE c.relname = 'mnt' AND c.relkind = 'r'
+        """)
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return '%s-%s-%s' % (row[0], row[1] or '', row[2] or '')
+
+    @classmethod
+    def area_version(cls, date_update, dem_version):
+        """Version of a stored elevation area, depending on the object,
+        the DEM and the settings used to compute the grid.
+        """
+        return '%s|%s|%s|%s|%s' % (date_update.isoformat() if date_update else '',
+                                   dem_version,
+                                   settings.ALTIMETRIC_PROFILE_PRECISION,
+                                   settings.ALTIMETRIC_AREA_MAX_RESOLUTION,
+                                   settings.ALTIMETRIC_AREA_MARGIN)
+
+    @classmethod
+    def pack_elevation_area(cls, area, version):
+        """Serialize an elevation area as metadata and an int16 grid of altitudes.
+        """
+        metadata = {key: value for key, value in area.items() if key != 'altitudes'}
+        altitudes = area['altitudes']
+        metadata['version'] = version
+        metadata['shape'] = [len(altitudes), len(altitudes[0]) if altitudes else 0]
+        grid = array('h', [max(-32768, min(32767, int(round(v)))) for row in altitudes for v in row])
+        if sys.byteorder == 'big':
+            grid.byteswap()
+        header = json.dumps(metadata).encode()
+        return AREA_MAGIC + AREA_HEADER.pack(len(header)) + header + grid.tobytes()
+
+    @classmethod
+    def unpack_elevation_area(cls, data):
+        """Deserialize an elevation area. Returns (version, area).
+        """
+        if not data.startswith(AREA_MAGIC):
+            raise ValueError("Not an elevation area")
+        offset = len(AREA_MAGIC)
+        length, = AREA_HEADER.unpack_from(data, offset)
+        offset += AREA_HEADER.size
+        metadata = json.loads(data[offset:offset + length].decode())
+        grid = array('h')
+        grid.frombytes(data[offset + length:])
+        if sys.byteorder == 'big':
+            grid.byteswap()
+        version = metadata.pop('version')
+        rows, columns = metadata.pop('shape')
+        metadata['altitudes'] = [grid[i * columns:(i + 1) * columns].tolist() for i in range(rows)]
+        return version, metadata
+
+    @classmethod
+    def load_elevation_area(cls, path, version):
+        """Read a stored elevation area. Returns None if it is missing or outdated.
+        """
+        try:
+            with open(path, 'rb') as f:
+                stored_version, area = cls.unpack_elevation_area(f.read())
+        except (IOError, ValueError, struct.error):
+            return None
+        if stored_version != version:
+            return None
+        return area
+
+    @classmethod
+    def save_elevation_area(cls, path, area, version):
+        """Store an elevation area. The file is replaced atomically
+        so that concurrent readers and writers never see partial data.
+        """
+        dirname = os.path.dirname(path)
+        if not os.path.exists(dirname):
+            os.makedirs(dirname, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(cls.pack_elevation_area(area, version))
+        os.replace(tmp_path, path)
@@ -1,9 +1,65 @@
 from django.core.management.base import BaseCommand, CommandError
-from django.db import connection
+from django.db import connection, connections, transaction
 from django.conf import settings
+import hashlib
+from multiprocessing import Pool
 import os.path
-from subprocess import call, PIPE
+from subprocess import call, PIPE, Popen
 import tempfile
+import uuid
+
+
+class ChunkLoader(object):
+    """Warp one chunk of the DEM and stream it into the database.
+    The chunk is recorded as loaded in the same transaction as its tiles,
+    so that an interrupted load can be resumed.
+    """
+    def __init__(self, dem_path, table, run, resolution, tile_size, verbose):
+        self.dem_path = dem_path
+        self.table = table
+        self.run = run
+        self.resolution = resolution
+        self.tile_size = tile_size
+        self.verbose = verbose
+
+    def __call__(self, chunk):
+        xmin, ymin, xmax, ymax = chunk
+        new_dem = tempfile.NamedTemporaryFile(suffix='.tif')
+        try:
+            cmd = 'gdalwarp -q -overwrite -t_srs EPSG:%d -te %f %f %f %f -tr %f %f %s %s' % (
+                settings.SRID, xmin, ymin, xmax, ymax, self.resolution, self.resolution,
+                self.dem_path, new_dem.name)
+            ret = self.call_command_system(cmd, shell=True, stdout=PIPE)
+            if ret != 0:
+                raise Exception('gdalwarp failed with exit code %d' % ret)
+            cmd = 'raster2pgsql -a -e -t %dx%d %s %s %s' % (
+                self.tile_size, self.tile_size, new_dem.name, self.table, '' if self.verbose else '2>/dev/null')
+            with transaction.atomic():
+                cur = connection.cursor()
+                process = Popen(cmd, shell=True, stdout=PIPE)
+                for sql_line in process.stdout:
+                    cur.execute(sql_line)
+                ret = process.wait()
+                if ret != 0:
+                    raise Exception('raster2pgsql failed with exit code %d' % ret)
+                cur.execute('INSERT INTO loaddem_progress (run, chunk, target) VALUES (%s, %s, %s)',
+                            [self.run, chunk_key(chunk), self.table])
+                cur.close()
+        finally:
+            new_dem.close()
+        return chunk
+
+    def call_command_system(self, cmd, **kwargs):
+        return call(cmd, **kwargs)
+
+
+def chunk_key(chunk):
+    return '%.2f_%.2f_%.2f_%.2f' % tuple(chunk)
+
+
+def close_connections():
+    # Each worker process must open its own database connection
+    connections.close_all()
 
 
 class Command(BaseCommand):
@@ -15,6 +71,18 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument('dem_path')
         parser.add_argument('--replace', action='store_true', default=False, help='Replace existing DEM if any.')
+        parser.add_argument('--tile-size', type=int, default=100, help='Size of raster tiles in database (pixels).')
+        parser.add_argument('--tiled', action='store_true', default=False,
+                            help='Warp and load the DEM chunk by chunk, allowing parallel and resumable loads.')
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help='Size of warped chunks in tiled mode (pixels).')
+        parser.add_argument('--jobs', '-j', type=int, default=1, help='Number of parallel workers in tiled mode.')
+        parser.add_argument('--resume', action='store_true', default=False,
+                            help='Resume an interrupted tiled load of the same DEM.')
+        parser.add_argument('--shadow', action='store_true', default=False,
+                            help='Load into a shadow table in tiled mode, then swap it with existing DEM.')
+        parser.add_argument('--overviews', default='',
+                            help='Build overviews with these factors (ex: --overviews="4,16").')
 
     def handle(self, *args, **options):
         verbose = options['verbosity'] != 0
@@ -82,6 +150,13 @@ class Command(BaseCommand):
         if not bbox_p.Intersects(bbox_r):
             raise CommandError('DEM file does not match project extent (%s <> %s).' % (bbox_r, bbox_p))
 
+        # Keep what the tiled mode needs: target extent and resolution in project SRID
+        if options['tiled']:
+            extent = bbox_p.Intersection(bbox_r).GetEnvelope()
+            vrt = gdal.AutoCreateWarpedVRT(ds, None, srs_p.ExportToWkt())
+            resolution = abs(vrt.GetGeoTransform()[1])
+            vrt = None
+
         # Allow GDAL objects to be garbage-collected
         ds = None
         srs_p = None
@@ -90,18 +165,19 @@ class Command(BaseCommand):
         bbox_p = None
 
         # Check if DEM table already exists
-        cur = connection.cursor()
-        sql = 'SELECT * FROM raster_columns WHERE r_table_name = \'mnt\''
-        cur.execute(sql)
-        dem_exists = cur.rowcount != 0
-        cur.close()
+        dem_exists = self.table_exists('mnt')
 
         # Obtain replace mode
         replace = options['replace']
 
+        if options['tiled']:
+            self.load_tiled(dem_path, extent, resolution, dem_exists, options)
+            return
+
         # What to do with existing DEM (if any)
         if dem_exists and replace:
             # Drop table
+            self.drop_overviews('mnt')
             cur = connection.cursor()
             sql = 'DROP TABLE mnt'
             cur.execute(sql)
@@ -144,7 +220,8 @@ class Command(BaseCommand):
 
         # Step 2: Convert to PostGISRaster format
         output = tempfile.NamedTemporaryFile()  # SQL code for raster creation
-        cmd = 'raster2pgsql -c -C -I -M -t 100x100 %s mnt %s' % (
+        cmd = 'raster2pgsql -c -C -I -M -t %dx%d %s mnt %s' % (
+            options['tile_size'], options['tile_size'],
             new_dem.name,
             '' if verbose else '2>/dev/null'
         )
@@ -174,10 +251,136 @@ class Command(BaseCommand):
             cur.execute(sql_line)
         cur.close()
         output.close()
+        self.set_version('mnt')
         if verbose:
             self.stdout.write('DEM successfully loaded.\n')
+        self.build_overviews('mnt', options['overviews'], verbose)
         return
 
+    def table_exists(self, table):
+        cur = connection.cursor()
+        cur.execute('SELECT * FROM raster_columns WHERE r_table_name = %s', [table])
+        exists = cur.rowcount != 0
+        cur.close()
+        return exists
+
+    def split_chunks(self, extent, resolution, chunk_size):
+        """Split extent in chunks aligned on the pixel grid.
+        """
+        xmin, xmax, ymin, ymax = extent
+        xmin = resolution * int(xmin // resolution)
+        ymin = resolution * int(ymin // resolution)
+        step = resolution * chunk_size
+        chunks = []
+        x = xmin
+        while x < xmax:
+            y = ymin
+            while y < ymax:
+                chunks.append((x, y, min(x + step, xmax), min(y + step, ymax)))
+                y += step
+            x += step
+        return chunks
+
+    def load_tiled(self, dem_path, extent, resolution, dem_exists, options):
+        verbose = options['verbosity'] != 0
+        chunks = self.split_chunks(extent, resolution, options['chunk_size'])
+        stat = os.stat(dem_path)
+        # Run does not depend on loaded table: DEM may not exist when a load starts, but exist when it is resumed
+        run = hashlib.md5(str((os.path.abspath(dem_path), stat.st_size, stat.st_mtime, settings.SRID,
+                               resolution, options['tile_size'], options['chunk_size'])).encode()).hexdigest()
+
+        cur = connection.cursor()
+        cur.execute('CREATE TABLE IF NOT EXISTS loaddem_progress (run varchar(32), chunk varchar(128), '
+                    'target varchar(64), PRIMARY KEY (run, chunk))')
+        table = None
+        if options['resume']:
+            # Resume in the table chosen by the interrupted load
+            cur.execute('SELECT DISTINCT target FROM loaddem_progress WHERE run = %s', [run])
+            targets = [row[0] for row in cur.fetchall()]
+            if len(targets) == 1 and self.table_exists(targets[0]):
+                table = targets[0]
+        if table is not None:
+            cur.execute('SELECT chunk FROM loaddem_progress WHERE run = %s', [run])
+            loaded = set([row[0] for row in cur.fetchall()])
+            chunks = [chunk for chunk in chunks if chunk_key(chunk) not in loaded]
+            if verbose:
+                self.stdout.write('Resuming load, %d chunks already loaded.\n' % len(loaded))
+        else:
+            if dem_exists and not options['replace']:
+                cur.close()
+                raise CommandError('DEM file exists, use --replace to overwrite')
+            table = 'mnt_shadow' if options['shadow'] and dem_exists else 'mnt'
+            self.drop_overviews(table)
+            cur.execute('DROP TABLE IF EXISTS %s' % table)
+            cur.execute('DELETE FROM loaddem_progress WHERE run = %s', [run])
+            cur.execute('CREATE TABLE %s (rid serial primary key, rast raster)' % table)
+        cur.close()
+
+        if verbose:
+            self.stdout.write('\n-- Loading DEM into database by chunks --\n')
+            self.stdout.write('%d chunks to load.\n' % len(chunks))
+        loader = ChunkLoader(dem_path, table, run, resolution, options['tile_size'], verbose)
+        try:
+            if options['jobs'] > 1:
+                close_connections()
+                with Pool(options['jobs'], initializer=close_connections) as pool:
+                    for i, chunk in enumerate(pool.imap_unordered(loader, chunks)):
+                        if verbose:
+                            self.stdout.write('Chunk %d/%d loaded.\n' % (i + 1, len(chunks)))
+            else:
+                for i, chunk in enumerate(chunks):
+                    loader(chunk)
+                    if verbose:
+                        self.stdout.write('Chunk %d/%d loaded.\n' % (i + 1, len(chunks)))
+        except Exception as e:
+            msg = 'Caught %s: %s' % (e.__class__.__name__, e,)
+            raise CommandError(msg + ' (use --resume to continue loading)')
+
+        cur = connection.cursor()
+        cur.execute('CREATE INDEX ON %s USING gist (ST_ConvexHull(rast))' % table)
+        cur.execute('SELECT AddRasterConstraints(%s::name, \'rast\'::name)', [table])
+        cur.execute('ANALYZE %s' % table)
+        if table != 'mnt':
+            # Swap shadow table with current DEM at once
+            with transaction.atomic():
+                self.drop_overviews('mnt')
+                cur.execute('DROP TABLE mnt')
+                cur.execute('ALTER TABLE mnt_shadow RENAME TO mnt')
+        cur.execute('DELETE FROM loaddem_progress WHERE run = %s', [run])
+        cur.close()
+        self.set_version('mnt')
+        if verbose:
+            self.stdout.write('DEM successfully loaded.\n')
+        self.build_overviews('mnt', options['overviews'], verbose)
+
+    def set_version(self, table):
+        """Store a new version of loaded DEM, read by AltimetryHelper.dem_version
+        (resumed loads add tiles to an existing table).
+        """
+        cur = connection.cursor()
+        cur.execute('COMMENT ON TABLE %s IS %%s' % table, [uuid.uuid4().hex])
+        cur.close()
+
+    def drop_overviews(self, table):
+        cur = connection.cursor()
+        cur.execute('SELECT o_table_name FROM raster_overviews WHERE r_table_name = %s', [table])
+        for overview, in cur.fetchall():
+            cur.execute('DROP TABLE %s' % overview)
+        cur.close()
+
+    def build_overviews(self, table, factors, verbose):
+        """Build overviews, used to compute elevation areas of large objects.
+        """
+        if not factors:
+            return
+        self.drop_overviews(table)
+        cur = connection.cursor()
+        for factor in factors.split(','):
+            cur.execute('SELECT ST_CreateOverview(%s::regclass, \'rast\'::name, %s)', [table, int(factor)])
+            if verbose:
+                self.stdout.write('Overview with factor %s successfully built.\n' % factor)
+        cur.close()
+
     def call_command_system(self, cmd, **kwargs):
         return_code = call(cmd, **kwargs)
         return return_code
@@ -0,0 +1,64 @@
+from multiprocessing import Pool
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from geotrek.altimetry.helpers import AltimetryHelper
+from geotrek.altimetry.models import AltimetryMixin
+
+
+def prewarm_elevation_area(task):
+    """Compute and store the elevation area of one object if it is outdated.
+    Returns True if it was computed, False if it was up-to-date.
+    """
+    model_label, pk, dem_version = task
+    obj = apps.get_model(model_label).objects.get(pk=pk)
+    version = AltimetryHelper.area_version(obj.date_update, dem_version)
+    if AltimetryHelper.load_elevation_area(obj.get_elevation_area_path(), version) is not None:
+        return False
+    obj.get_elevation_area(dem_version)
+    return True
+
+
+def close_connections():
+    # Each worker process must open its own database connection
+    connections.close_all()
+
+
+class Command(BaseCommand):
+    help = 'Compute and store elevation areas (dem.json) of objects which are outdated.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('models', nargs='*', default=['trekking.trek'],
+                            help='Models to process (app_label.model_name), default to trekking.trek')
+        parser.add_argument('--pks', default=None, help='Filter by primary key(s) (ex: --pks="1,2,3")')
+        parser.add_argument('--jobs', '-j', type=int, default=1, help='Number of parallel workers')
+
+    def handle(self, *args, **options):
+        dem_version = AltimetryHelper.dem_version()
+        if dem_version is None:
+            raise CommandError('No DEM present')
+        tasks = []
+        for model_label in options['models']:
+            try:
+                model = apps.get_model(model_label)
+            except (LookupError, ValueError):
+                raise CommandError("Model {} doesn't exist".format(model_label))
+            if not issubclass(model, AltimetryMixin):
+                raise CommandError("Model {} has no altimetry".format(model_label))
+            queryset = model.objects.existing() if hasattr(model.objects, 'existing') else model.objects.all()
+            if options['pks']:
+                queryset = queryset.filter(pk__in=options['pks'].split(','))
+            tasks += [(model._meta.label, pk, dem_version) for pk in queryset.order_by('pk').values_list('pk', flat=True)]
+
+        if options['jobs'] > 1:
+            close_connections()
+            with Pool(options['jobs'], initializer=close_connections) as pool:
+                results = pool.map(prewarm_elevation_area, tasks, chunksize=10)
+        else:
+            results = [prewarm_elevation_area(task) for task in tasks]
+
+        if options['verbosity'] >= 1:
+            self.stdout.write('{computed} elevation areas computed, {uptodate} up-to-date'.format(
+                computed=results.count(True), uptodate=results.count(False)))
@@ -1,7 +1,9 @@
 import os
+import threading
 
 from django.conf import settings
 from django.contrib.gis.db import models
+from django.core.cache import caches
 from django.utils.translation import get_language, ugettext_lazy as _
 from django.urls import reverse
 
@@ -47,8 +49,47 @@ class AltimetryMixin(models.Model):
     def get_elevation_profile(self):
         return AltimetryHelper.elevation_profile(self.geom_3d)
 
-    def get_elevation_area(self):
-        return AltimetryHelper.elevation_area(self.geom)
+    def get_elevation_profile_cache_key(self):
+        return 'altimetry_profile_%s_%s_%s_%s' % (self._meta.model_name, self.pk,
+                                                  self.date_update.strftime('%y%m%d%H%M%S%f'),
+                                                  settings.ALTIMETRIC_PROFILE_PRECISION)
+
+    @classmethod
+    def get_elevation_profiles(cls, objs):
+        """Elevation profiles of several objects, by pk.
+        Cached profiles are reused, others are computed in a single query and cached.
+        """
+        cache = caches['fat']
+        keys = {obj.pk: obj.get_elevation_profile_cache_key() for obj in objs}
+        cached = cache.get_many(keys.values())
+        profiles = {pk: cached[key] for pk, key in keys.items() if key in cached}
+        missing = {obj.pk: obj.geom_3d for obj in objs if obj.pk not in profiles and obj.geom_3d}
+        computed = AltimetryHelper.elevation_profiles(missing)
+        cache.set_many({keys[pk]: profile for pk, profile in computed.items()})
+        profiles.update(computed)
+        return profiles
+
+    def get_elevation_area_path(self):
+        """Path to the stored elevation area grid.
+        """
+        return os.path.join(settings.ALTIMETRIC_AREA_ROOT, '%s-%s.bin' % (self._meta.model_name, self.pk))
+
+    def get_elevation_area(self, dem_version=None):
+        """Elevation area, read from storage if it is up-to-date with the object,
+        the DEM and the altimetric settings. Computed and stored otherwise.
+        """
+        if dem_version is None:
+            dem_version = AltimetryHelper.dem_version()
+            if dem_version is None:
+                return AltimetryHelper.elevation_area(self.geom)
+        version = AltimetryHelper.area_version(self.date_update, dem_version)
+        path = self.get_elevation_area_path()
+        area = AltimetryHelper.load_elevation_area(path, version)
+        if area is None:
+            area = AltimetryHelper.elevation_area(self.geom)
+            if area:
+                AltimetryHelper.save_elevation_area(path, area, version)
+        return area
 
     def get_elevation_limits(self):
         return AltimetryHelper.altimetry_limits(self.get_elevation_profile())
@@ -86,16 +127,53 @@ class AltimetryMixin(models.Model):
     def prepare_elevation_chart(self, language, rooturl):
         """Converts SVG elevation URI to PNG on disk.
         """
-        from .views import HttpSVGResponse
         path = self.get_elevation_chart_path(language)
         # Do nothing if image is up-to-date
         if is_file_uptodate(path, self.date_update):
             return False
+        if settings.ALTIMETRIC_PROFILE_RENDERER == 'local':
+            png = AltimetryHelper.profile_png(self.get_elevation_profile(), language)
+            self._write_elevation_chart(path, png)
+            return True
+        from .views import HttpSVGResponse
         # Download converted chart as png using convertit
         source = smart_urljoin(rooturl, self.get_elevation_chart_url(language))
+        partname = self._elevation_chart_partname(path)
         convertit_download(source,
-                           path,
+                           partname,
                            from_type=HttpSVGResponse.content_type,
                            to_type='image/png',
                            headers={'Accept-Language': language})
+        os.replace(partname, path)
         return True
+
+    def prepare_elevation_charts(self, languages, rooturl):
+        """Converts elevation charts to PNG on disk for several languages at once.
+        With the local renderer, the elevation profile is only computed once.
+        Returns the list of languages whose chart was generated.
+        """
+        outdated = [language for language in languages
+                    if not is_file_uptodate(self.get_elevation_chart_path(language), self.date_update)]
+        if not outdated:
+            return []
+        if settings.ALTIMETRIC_PROFILE_RENDERER != 'local':
+            for language in outdated:
+                self.prepare_elevation_chart(language, rooturl)
+            return outdated
+        pngs = AltimetryHelper.profile_pngs(self.get_elevation_profile(), outdated)
+        for language, png in pngs.items():
+            self._write_elevation_chart(self.get_elevation_chart_path(language), png)
+        return outdated
+
+    @staticmethod
+    def _elevation_chart_partname(path):
+        return '{}.{}.{}.part'.format(path, os.getpid(), threading.get_ident())
+
+    def _write_elevation_chart(self, path, png):
+        """Charts can be prepared by several sync workers at the same time:
+        write them at once, so that no one reads a partially written file.
+        """
+        partname = self._elevation_chart_partname(path)
+        with open(partname, 'wb') as f:
+            f.write(png)
+        os.replace(partname, path)
@@ -0,0 +1,76 @@
+"""
+Benchmarks of altimetry computations on synthetic DEMs and lines.
+
+Run with ``./manage.py test geotrek.altimetry.tests.benchmarks``.
+"""
+import math
+
+from django.conf import settings
+from django.contrib.gis.geos import GEOSGeometry, LineString
+from django.db import connection
+from django.test import TestCase
+
+from geotrek.altimetry.helpers import AltimetryHelper
+from geotrek.common.tests import BenchmarkMixin
+
+# Lower left corner and size (in meters) of the synthetic DEM
+DEM_ORIGIN = (700000, 6600000)
+DEM_SIZE = 10000
+
+
+class AltimetryBenchmark(BenchmarkMixin, TestCase):
+    benchmark_name = 'altimetry'
+    resolutions = (50, 25, 10)  # DEM pixel sizes in meters
+    vertices = (100, 1000, 10000)  # Number of vertices of lines
+
+    def _fill_raster(self, pixel):
+        """Synthetic DEM with hills, tiled like loaddem does."""
+        size = DEM_SIZE // pixel
+        with connection.cursor() as cur:
+            cur.execute('DROP TABLE IF EXISTS mnt')
+            cur.execute('CREATE TABLE mnt (rid serial primary key, rast raster)')
+            cur.execute("""
+                INSERT INTO mnt (rast)
+                SELECT ST_Tile(ST_MapAlgebra(ST_AddBand(ST_MakeEmptyRaster(%(size)s, %(size)s, %(x)s, %(y)s,
+                                                                           %(pixel)s, -%(pixel)s, 0, 0, %(srid)s),
+                                                        '16BSI'),
+                                             1, '16BSI', %(expression)s),
+                               100, 100)
+            """, {'size': size, 'x': DEM_ORIGIN[0], 'y': DEM_ORIGIN[1] + DEM_SIZE, 'pixel': pixel, 'srid': settings.SRID,
+                  'expression': '500 + 300 * sin([rast.x] * {0} / 700.0) * cos([rast.y] * {0} / 1100.0)'.format(pixel)})
+            cur.execute('CREATE INDEX ON mnt USING gist (ST_ConvexHull(rast))')
+            cur.execute('ANALYZE mnt')
+
+    def _line(self, nb_vertices):
+        """Winding line across the DEM."""
+        step = (DEM_SIZE * 0.8) / nb_vertices
+        coords = [(DEM_ORIGIN[0] + DEM_SIZE * 0.1 + i * step,
+                   DEM_ORIGIN[1] + DEM_SIZE * (0.5 + 0.3 * math.sin(i * step / 500)))
+                  for i in range(nb_vertices)]
+        return LineString(coords, srid=settings.SRID)
+
+    def _drape(self, geom):
+        with connection.cursor() as cur:
+            cur.execute('SELECT ST_AsEWKT(ST_MakeLine(geom)) FROM ft_drape_line(%s::geometry, %s) AS geom',
+                        [geom.ewkt, settings.ALTIMETRIC_PROFILE_PRECISION])
+            return GEOSGeometry(cur.fetchone()[0])
+
+    def _smooth(self, geom):
+        with connection.cursor() as cur:
+            cur.execute('SELECT ST_AsEWKT(ST_MakeLine(geom)) FROM ft_smooth_line(%s::geometry, %s) AS geom',
+                        [geom.ewkt, settings.ALTIMETRIC_PROFILE_AVERAGE])
+            return GEOSGeometry(cur.fetchone()[0])
+
+    def test_altimetry(self):
+        for pixel in self.resolutions:
+            self._fill_raster(pixel)
+            for nb_vertices in self.vertices:
+                geom = self._line(nb_vertices)
+                label = 'dem{}m/{}pts'.format(pixel, nb_vertices)
+                draped = self.measure('drape/' + label, lambda: self._drape(geom), nb_vertices)
+                smoothed = self.measure('smooth/' + label, lambda: self._smooth(draped), draped.num_points)
+                profile = self.measure('elevation_profile/' + label,
+                                       lambda: AltimetryHelper.elevation_profile(smoothed), smoothed.num_points)
+                self.measure('elevation_area/' + label, lambda: AltimetryHelper.elevation_area(geom),
+                             lambda area: area['resolution']['x'] * area['resolution']['y'])
+                self.measure('profile_svg/' + label, lambda: AltimetryHelper.profile_svg(profile, 'en'), len(profile))
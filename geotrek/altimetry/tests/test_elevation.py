@@ -6,16 +6,20 @@ from django.db import connections, DEFAULT_DB_ALIAS
 from django.contrib.gis.geos import MultiLineString, LineString, Point
 from django.core.management import call_command
 from django.core.management.base import CommandError
-from django.test.utils import override_settings
+from django.test.utils import CaptureQueriesContext, override_settings
 from django.utils import translation
 
 from geotrek.core.models import Path, Topology
 from geotrek.core.factories import TopologyFactory
 from geotrek.altimetry.helpers import AltimetryHelper
+from geotrek.trekking.factories import TrekFactory
 
 import os
+import shutil
 import sys
+import tempfile
 from io import StringIO
+from subprocess import call
 
 
 class ElevationTest(TestCase):
@@ -142,6 +146,49 @@ class ElevationProfileTest(TestCase):
         self.assertIn(settings.ALTIMETRIC_PROFILE_BACKGROUND.encode(), svg)
         self.assertIn(settings.ALTIMETRIC_PROFILE_COLOR.encode(), svg)
 
+    def test_elevation_png_output(self):
+        geom = LineString((1.5, 2.5, 8), (2.5, 2.5, 10),
+                          srid=settings.SRID)
+        profile = AltimetryHelper.elevation_profile(geom)
+        png = AltimetryHelper.profile_png(profile, 'en')
+        self.assertEqual(png[:8], b'\x89PNG\r\n\x1a\n')
+
+    def test_elevation_svg_keeps_active_language(self):
+        geom = LineString((1.5, 2.5, 8), (2.5, 2.5, 10),
+                          srid=settings.SRID)
+        profile = AltimetryHelper.elevation_profile(geom)
+        with translation.override('fr'):
+            AltimetryHelper.profile_svg(profile, 'en')
+            self.assertEqual(translation.get_language(), 'fr')
+
+    def test_elevation_pngs_output_by_language(self):
+        geom = LineString((1.5, 2.5, 8), (2.5, 2.5, 10),
+                          srid=settings.SRID)
+        profile = AltimetryHelper.elevation_profile(geom)
+        pngs = AltimetryHelper.profile_pngs(profile, ['en', 'fr'])
+        self.assertEqual(set(pngs.keys()), {'en', 'fr'})
+
+    def test_elevation_profiles_same_as_single_profile(self):
+        geoms = {
+            1: LineString((1.5, 2.5, 8), (2.5, 2.5, 10), srid=settings.SRID),
+            2: LineString((0, 0, 0), (3, 4, 10), (6, 8, 10), srid=settings.SRID),
+            3: Point(1, 1, 1, srid=settings.SRID),
+        }
+        profiles = AltimetryHelper.elevation_profiles(geoms)
+        self.assertEqual(set(profiles.keys()), {1, 2, 3})
+        for key, geom in geoms.items():
+            self.assertEqual([list(step) for step in profiles[key]],
+                             [list(step) for step in AltimetryHelper.elevation_profile(geom)])
+
+    def test_elevation_profile_downsample(self):
+        profile = [[float(i), i, i, i] for i in range(10)]
+        self.assertEqual(AltimetryHelper.downsample_profile(profile, 0), profile)
+        self.assertEqual(AltimetryHelper.downsample_profile(profile, 20), profile)
+        downsampled = AltimetryHelper.downsample_profile(profile, 4)
+        self.assertEqual(len(downsampled), 4)
+        self.assertEqual(downsampled[0], profile[0])
+        self.assertEqual(downsampled[-1], profile[-1])
+
     def test_elevation_altimetry_limits(self):
         geom = LineString((1.5, 2.5, 8), (2.5, 2.5, 10),
                           srid=settings.SRID)
@@ -241,6 +288,73 @@ class ElevationOtherGeomAreaTest(AreaTestCase):
         self.assertEqual(area['size']['y'], 1300.0)
 
 
+class StoredElevationAreaTest(AreaTestCase):
+    def setUp(self):
+        self._fill_raster()
+        self.root = tempfile.mkdtemp()
+        self.trek = TrekFactory.create()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_pack_unpack_area(self):
+        area = AltimetryHelper.elevation_area(LineString((100, 370), (1100, 370), srid=settings.SRID))
+        version, unpacked = AltimetryHelper.unpack_elevation_area(AltimetryHelper.pack_elevation_area(area, 'v1'))
+        self.assertEqual(version, 'v1')
+        self.assertEqual(unpacked, area)
+
+    def test_unpack_not_an_area(self):
+        with self.assertRaises(ValueError):
+            AltimetryHelper.unpack_elevation_area(b'{"altitudes": []}')
+
+    def test_area_is_stored(self):
+        with override_settings(ALTIMETRIC_AREA_ROOT=self.root):
+            area = self.trek.get_elevation_area()
+            self.assertTrue(os.path.exists(self.trek.get_elevation_area_path()))
+            with mock.patch('geotrek.altimetry.helpers.AltimetryHelper.elevation_area') as elevation_area:
+                self.assertEqual(self.trek.get_elevation_area(), area)
+                elevation_area.assert_not_called()
+
+    def test_area_is_computed_again_if_object_changed(self):
+        with override_settings(ALTIMETRIC_AREA_ROOT=self.root):
+            self.trek.get_elevation_area()
+            self.trek.save()
+            with mock.patch('geotrek.altimetry.helpers.AltimetryHelper.elevation_area', return_value={}) as elevation_area:
+                self.trek.get_elevation_area()
+                elevation_area.assert_called_once()
+
+    def test_area_is_computed_again_if_dem_changed(self):
+        with override_settings(ALTIMETRIC_AREA_ROOT=self.root):
+            self.trek.get_elevation_area()
+            conn = connections[DEFAULT_DB_ALIAS]
+            cur = conn.cursor()
+            # Done by loaddem
+            cur.execute("COMMENT ON TABLE mnt IS 'reloaded'")
+            with mock.patch('geotrek.altimetry.helpers.AltimetryHelper.elevation_area', return_value={}) as elevation_area:
+                self.trek.get_elevation_area()
+                elevation_area.assert_called_once()
+
+    def test_prewarm_command(self):
+        output = StringIO()
+        with override_settings(ALTIMETRIC_AREA_ROOT=self.root):
+            call_command('prewarm_dem', 'trekking.trek', pks=str(self.trek.pk), stdout=output)
+            self.assertIn('1 elevation areas computed, 0 up-to-date', output.getvalue())
+            self.assertTrue(os.path.exists(self.trek.get_elevation_area_path()))
+            output = StringIO()
+            call_command('prewarm_dem', 'trekking.trek', pks=str(self.trek.pk), stdout=output)
+            self.assertIn('0 elevation areas computed, 1 up-to-date', output.getvalue())
+
+    def test_prewarm_command_wrong_model(self):
+        with self.assertRaisesRegex(CommandError, "Model common.theme has no altimetry"):
+            call_command('prewarm_dem', 'common.theme', verbosity=0)
+
+
+class PrewarmNoDEMTest(TestCase):
+    def test_prewarm_command_no_dem(self):
+        with self.assertRaisesRegex(CommandError, 'No DEM present'):
+            call_command('prewarm_dem', verbosity=0)
+
+
 @skipIf(settings.TREKKING_TOPOLOGY_ENABLED, 'Test without dynamic segmentation only')
 class LengthTest(TestCase):
 
@@ -516,6 +630,128 @@ class CommandLoadDemTest(TestCase):
         with self.assertRaisesRegex(CommandError, 'Caught Exception: raster2pgsql failed with exit code 1'):
             call_command('loaddem', filename, '--replace', verbosity=0)
 
+    def test_success_tiled(self):
+        output_stdout = StringIO()
+        filename = os.path.join(os.path.dirname(__file__), 'data', 'elevation.tif')
+        call_command('loaddem', filename, '--replace', '--tiled', '--chunk-size', '5', verbosity=2,
+                     stdout=output_stdout)
+        self.assertIn('DEM successfully loaded.', output_stdout.getvalue())
+        self.assertIn('Chunk 1/', output_stdout.getvalue())
+        conn = connections[DEFAULT_DB_ALIAS]
+        cur = conn.cursor()
+        cur.execute('SELECT ST_Value(rast, ST_SetSRID(ST_MakePoint(602500, 6650000), 2154)) FROM mnt '
+                    'WHERE ST_Intersects(rast, ST_SetSRID(ST_MakePoint(602500, 6650000), 2154));')
+        self.assertAlmostEqual(cur.fetchone()[0], 343.600006103516, places=0)
+        cur.execute('SELECT COUNT(*) FROM loaddem_progress;')
+        self.assertEqual(cur.fetchone()[0], 0)
+        cur.execute('DROP TABLE mnt;')
+
+    def test_tiled_fail_table_mnt(self):
+        conn = connections[DEFAULT_DB_ALIAS]
+        cur = conn.cursor()
+        cur.execute('CREATE TABLE mnt (rid serial primary key, rast raster)')
+        filename = os.path.join(os.path.dirname(__file__), 'data', 'elevation.tif')
+        with self.assertRaisesRegex(CommandError, 'DEM file exists, use --replace to overwrite'):
+            call_command('loaddem', filename, '--tiled', verbosity=0)
+        cur.execute('DROP TABLE mnt;')
+
+    def test_tiled_resume(self):
+        filename = os.path.join(os.path.dirname(__file__), 'data', 'elevation.tif')
+        calls = []
+
+        def command_fail_second_chunk(loader, cmd, **kwargs):
+            if 'gdalwarp' in cmd:
+                calls.append(cmd)
+                if len(calls) == 2:
+                    return 1
+            return call(cmd, **kwargs)
+
+        with mock.patch('geotrek.altimetry.management.commands.loaddem.ChunkLoader.call_command_system',
+                        command_fail_second_chunk):
+            with self.assertRaisesRegex(CommandError, 'gdalwarp failed with exit code 1 \\(use --resume'):
+                call_command('loaddem', filename, '--replace', '--tiled', '--chunk-size', '5', verbosity=0)
+        output_stdout = StringIO()
+        call_command('loaddem', filename, '--replace', '--tiled', '--chunk-size', '5', '--resume', verbosity=2,
+                     stdout=output_stdout)
+        self.assertIn('Resuming load, 1 chunks already loaded.', output_stdout.getvalue())
+        self.assertIn('DEM successfully loaded.', output_stdout.getvalue())
+        conn = connections[DEFAULT_DB_ALIAS]
+        cur = conn.cursor()
+        cur.execute('DROP TABLE mnt;')
+
+    def test_tiled_resume_shadow_without_dem(self):
+        filename = os.path.join(os.path.dirname(__file__), 'data', 'elevation.tif')
+        calls = []
+
+        def command_fail_second_chunk(loader, cmd, **kwargs):
+            if 'gdalwarp' in cmd:
+                calls.append(cmd)
+                if len(calls) == 2:
+                    return 1
+            return call(cmd, **kwargs)
+
+        with mock.patch('geotrek.altimetry.management.commands.loaddem.ChunkLoader.call_command_system',
+                        command_fail_second_chunk):
+            with self.assertRaises(CommandError):
+                call_command('loaddem', filename, '--tiled', '--shadow', '--chunk-size', '5', verbosity=0)
+        # Interrupted load created mnt table, it is resumed there
+        output_stdout = StringIO()
+        call_command('loaddem', filename, '--tiled', '--shadow', '--chunk-size', '5', '--resume', verbosity=2,
+                     stdout=output_stdout)
+        self.assertIn('Resuming load, 1 chunks already loaded.', output_stdout.getvalue())
+        self.assertIn('DEM successfully loaded.', output_stdout.getvalue())
+        conn = connections[DEFAULT_DB_ALIAS]
+        cur = conn.cursor()
+        cur.execute("SELECT 1 FROM pg_class WHERE relname = 'mnt_shadow'")
+        self.assertEqual(cur.rowcount, 0)
+        cur.execute('DROP TABLE mnt;')
+
+    def test_tiled_shadow_and_overviews(self):
+        conn = connections[DEFAULT_DB_ALIAS]
+        cur = conn.cursor()
+        cur.execute('CREATE TABLE mnt (rid serial primary key, rast raster)')
+        cur.execute("SELECT 'mnt'::regclass::oid")
+        old_oid = cur.fetchone()[0]
+        filename = os.path.join(os.path.dirname(__file__), 'data', 'elevation.tif')
+        call_command('loaddem', filename, '--replace', '--tiled', '--shadow', '--overviews', '2', verbosity=0)
+        cur.execute("SELECT 'mnt'::regclass::oid")
+        self.assertNotEqual(cur.fetchone()[0], old_oid)
+        cur.execute("SELECT 1 FROM pg_class WHERE relname = 'mnt_shadow'")
+        self.assertEqual(cur.rowcount, 0)
+        cur.execute("SELECT overview_factor FROM raster_overviews WHERE r_table_name = 'mnt'")
+        self.assertEqual(cur.fetchall(), [(2, )])
+        self.assertEqual(AltimetryHelper.dem_table(1), 'mnt')
+        self.assertNotEqual(AltimetryHelper.dem_table(100000), 'mnt')
+        cur.execute('DROP TABLE o_2_mnt;')
+        cur.execute('DROP TABLE mnt;')
+
+    def test_dem_version_changed_by_load(self):
+        filename = os.path.join(os.path.dirname(__file__), 'data', 'elevation.tif')
+        call_command('loaddem', filename, '--replace', '--tiled', verbosity=0)
+        version = AltimetryHelper.dem_version()
+        self.assertIsNotNone(version)
+        with CaptureQueriesContext(connections[DEFAULT_DB_ALIAS]) as queries:
+            self.assertEqual(AltimetryHelper.dem_version(), version)
+        self.assertFalse([query['sql'] for query in queries.captured_queries if 'FROM mnt' in query['sql']])
+        call_command('loaddem', filename, '--replace', '--tiled', verbosity=0)
+        self.assertNotEqual(AltimetryHelper.dem_version(), version)
+        conn = connections[DEFAULT_DB_ALIAS]
+        cur = conn.cursor()
+        cur.execute('DROP TABLE mnt;')
+
+    def test_tiled_replace_drops_overviews(self):
+        filename = os.path.join(os.path.dirname(__file__), 'data', 'elevation.tif')
+        call_command('loaddem', filename, '--replace', '--tiled', '--overviews', '2', verbosity=0)
+        call_command('loaddem', filename, '--replace', '--tiled', verbosity=0)
+        conn = connections[DEFAULT_DB_ALIAS]
+        cur = conn.cursor()
+        cur.execute("SELECT overview_factor FROM raster_overviews WHERE r_table_name = 'mnt'")
+        self.assertEqual(cur.fetchall(), [])
+        cur.execute("SELECT 1 FROM pg_class WHERE relname = 'o_2_mnt'")
+        self.assertEqual(cur.rowcount, 0)
+        self.assertEqual(AltimetryHelper.dem_table(100000), 'mnt')
+        cur.execute('DROP TABLE mnt;')
+
     @mock.patch('osgeo.gdal.Dataset.GetProjection', return_value='')
     def test_fail_projection(self, sp):
         filename = os.path.join(os.path.dirname(__file__), 'data', 'elevation.tif')
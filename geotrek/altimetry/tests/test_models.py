@@ -1,6 +1,7 @@
 import os
 
 from django.test import TestCase
+from django.test.utils import override_settings
 from django.conf import settings
 from django.utils.translation import get_language
 
@@ -19,3 +20,35 @@ class AltimetryMixinTest(TestCase):
         self.assertTrue(os.listdir(basefolder))
         directory = os.listdir(basefolder)
         self.assertIn('%s-%s-%s.png' % (Trek._meta.model_name, str(trek.pk), get_language()), directory)
+
+    @override_settings(ALTIMETRIC_PROFILE_RENDERER='local')
+    def test_prepare_elevation_chart_local(self):
+        trek = TrekFactory.create(published=True)
+        path = trek.get_elevation_chart_path('en')
+        if os.path.exists(path):
+            os.remove(path)
+        self.assertTrue(trek.prepare_elevation_chart('en', 'http://localhost/'))
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(8), b'\x89PNG\r\n\x1a\n')
+        self.assertFalse(trek.prepare_elevation_chart('en', 'http://localhost/'))
+
+    @override_settings(ALTIMETRIC_PROFILE_RENDERER='local')
+    def test_prepare_elevation_charts_local(self):
+        trek = TrekFactory.create(published=True)
+        for language in ('en', 'fr'):
+            path = trek.get_elevation_chart_path(language)
+            if os.path.exists(path):
+                os.remove(path)
+        self.assertEqual(trek.prepare_elevation_charts(['en', 'fr'], 'http://localhost/'), ['en', 'fr'])
+        self.assertTrue(os.path.exists(trek.get_elevation_chart_path('fr')))
+        self.assertEqual(trek.prepare_elevation_charts(['en', 'fr'], 'http://localhost/'), [])
+        self.assertEqual([name for name in os.listdir(os.path.dirname(path)) if name.endswith('.part')], [])
+
+    def test_prepare_elevation_chart_convertit(self):
+        trek = TrekFactory.create(published=True)
+        path = trek.get_elevation_chart_path('en')
+        if os.path.exists(path):
+            os.remove(path)
+        self.assertTrue(trek.prepare_elevation_chart('en', 'http://localhost/'))
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual([name for name in os.listdir(os.path.dirname(path)) if name.endswith('.part')], [])
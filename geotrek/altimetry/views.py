@@ -8,11 +8,11 @@ from django.shortcuts import get_object_or_404
 from django.conf import settings
 from django.views import static
 
-from mapentity.decorators import view_cache_response_content
 from mapentity.views import JSONResponseMixin, LastModifiedMixin
 
 from geotrek.common.views import PublicOrReadPermMixin
 
+from .helpers import AltimetryHelper
 from .models import AltimetryMixin
 
 
@@ -39,29 +39,14 @@ class ElevationProfile(LastModifiedMixin, JSONResponseMixin,
         """
         Put elevation profile into response context.
         """
-        data = {}
-        elevation_profile = self.object.get_elevation_profile()
         # Formatted as distance, elevation, [lng, lat]
-        for step in elevation_profile:
-            formatted = step[0], step[3], step[1:3]
-            data.setdefault('profile', []).append(formatted)
-        data['limits'] = dict(zip(['ceil', 'floor'], self.object.get_elevation_limits()))
-        return data
+        return AltimetryHelper.profile_data(self.object.get_elevation_profile())
 
 
 class ElevationArea(LastModifiedMixin, JSONResponseMixin, PublicOrReadPermMixin,
                     BaseDetailView):
-    """Extract elevation profile on an area and return it as JSON"""
-
-    def view_cache_key(self):
-        """Used by the ``view_cache_response_content`` decorator.
-        """
-        obj = self.get_object()
-        return 'altimetry_dem_area_%s' % obj.pk
-
-    @view_cache_response_content()
-    def dispatch(self, *args, **kwargs):
-        return super(ElevationArea, self).dispatch(*args, **kwargs)
+    """Extract elevation profile on an area and return it as JSON.
+    Areas are stored per object, see ``AltimetryMixin.get_elevation_area()``"""
 
     def get_context_data(self, **kwargs):
         return self.object.get_elevation_area()
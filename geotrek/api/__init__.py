@@ -0,0 +1 @@
+default_app_config = 'geotrek.api.apps.ApiConfig'
@@ -0,0 +1,15 @@
+from django.apps import AppConfig
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.utils.translation import ugettext_lazy as _
+
+
+class ApiConfig(AppConfig):
+    name = 'geotrek.api'
+    verbose_name = _("API")
+
+    def ready(self):
+        from geotrek.api.v2.cache import on_m2m_changed, on_save_or_delete
+
+        post_save.connect(on_save_or_delete, dispatch_uid='api_cache_save')
+        post_delete.connect(on_save_or_delete, dispatch_uid='api_cache_delete')
+        m2m_changed.connect(on_m2m_changed, dispatch_uid='api_cache_m2m')
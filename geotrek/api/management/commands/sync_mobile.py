@@ -1,6 +1,8 @@
 import argparse
 import logging
 import filecmp
+from itertools import chain
+from multiprocessing import Pool
 import os
 from PIL import Image
 import re
@@ -12,6 +14,7 @@ import cairosvg
 from django.conf import settings
 from django.contrib.auth.models import AnonymousUser
 from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
 from django.db.models import Q
 from django.http import StreamingHttpResponse
 from django.test.client import RequestFactory
@@ -24,7 +27,7 @@ from geotrek.tourism import models as tourism_models
 from geotrek.trekking import models as trekking_models
 from geotrek.api.mobile.views.trekking import TrekViewSet
 from geotrek.api.mobile.views.common import FlatPageViewSet, SettingsView
-from geotrek.common.helpers_sync import ZipTilesBuilder
+from geotrek.common.helpers_sync import MANIFEST_NAME, SyncManifest, TileStore, ZipTilesBuilder, get_file_hash
 # Register mapentity models
 from geotrek.trekking import urls  # NOQA
 from geotrek.tourism import urls  # NOQA
@@ -32,6 +35,24 @@ from geotrek.tourism import urls  # NOQA
 
 logger = logging.getLogger(__name__)
 
+# Command running trek tasks in a worker process
+worker_command = None
+
+
+def close_connections():
+    # Each worker process must open its own database connection
+    connections.close_all()
+
+
+def init_worker(command):
+    global worker_command
+    close_connections()
+    worker_command = command
+
+
+def sync_trek_task(task):
+    return worker_command.sync_trek_task(*task)
+
 
 class Command(BaseCommand):
     def add_arguments(self, parser):
@@ -42,6 +63,9 @@ class Command(BaseCommand):
                             help='Skip inclusion of tiles in zip files')
         parser.add_argument('--url', '-u', dest='url', default='http://localhost', help='Base url')
         parser.add_argument('--indent', '-i', default=0, type=int, help='Indent json files')
+        parser.add_argument('--full', action='store_true', default=False,
+                            help='Regenerate all files, even those of unchanged objects')
+        parser.add_argument('--jobs', '-j', type=int, default=1, help='Number of parallel workers syncing treks')
         parser.add_argument('--task', default=None, help=argparse.SUPPRESS)
 
     def mkdirs(self, name):
@@ -239,25 +263,20 @@ class Command(BaseCommand):
 
     def sync_trekking(self, lang):
         self.sync_geojson(lang, TrekViewSet, 'treks.geojson', type_view={'get': 'list'})
-        treks = trekking_models.Trek.objects.existing().order_by('pk')
-        treks = treks.filter(**{'published_{lang}'.format(lang=lang): True})
 
-        if self.portal:
-            treks = treks.filter(Q(portal__name__in=self.portal) | Q(portal=None))
-
-        for trek in treks:
-            self.sync_geojson(lang, TrekViewSet, '{pk}/trek.geojson'.format(pk=trek.pk), pk=trek.pk,
-                              type_view={'get': 'retrieve'})
-            self.sync_trek_pois(lang, trek)
-            self.sync_trek_touristic_contents(lang, trek)
-            self.sync_trek_touristic_events(lang, trek)
-            # Sync detail of children too
-            for child in trek.children:
-                self.sync_geojson(
-                    lang, TrekViewSet,
-                    '{pk}/treks/{child_pk}.geojson'.format(pk=trek.pk, child_pk=child.pk),
-                    pk=child.pk, type_view={'get': 'retrieve'}, params={'root_pk': trek.pk},
-                )
+    def sync_trek(self, lang, trek):
+        self.sync_geojson(lang, TrekViewSet, '{pk}/trek.geojson'.format(pk=trek.pk), pk=trek.pk,
+                          type_view={'get': 'retrieve'})
+        self.sync_trek_pois(lang, trek)
+        self.sync_trek_touristic_contents(lang, trek)
+        self.sync_trek_touristic_events(lang, trek)
+        # Sync detail of children too
+        for child in trek.children:
+            self.sync_geojson(
+                lang, TrekViewSet,
+                '{pk}/treks/{child_pk}.geojson'.format(pk=trek.pk, child_pk=child.pk),
+                pk=child.pk, type_view={'get': 'retrieve'}, params={'root_pk': trek.pk},
+            )
 
     def sync_settings_json(self, lang):
         self.sync_json(lang, SettingsView, 'settings')
@@ -274,7 +293,6 @@ class Command(BaseCommand):
                 }
             )
         self.sync_global_media()
-        self.sync_treks_media()
 
     def sync_trek_by_pk_media(self, trek):
         url_trek = os.path.join('nolang')
@@ -305,8 +323,8 @@ class Command(BaseCommand):
             if desk.resized_picture:
                 self.sync_media_file(desk.resized_picture, prefix=trek.pk, directory=url_trek,
                                      zipfile=trekid_zipfile)
+        trek.prepare_elevation_charts(self.languages, self.referer)
         for lang in self.languages:
-            trek.prepare_elevation_chart(lang, self.referer)
             url_media = '/{}{}'.format(trek.pk, settings.MEDIA_URL)
             self.sync_file(trek.get_elevation_chart_url_png(lang), settings.MEDIA_ROOT,
                            url_media, directory=url_trek, zipfile=trekid_zipfile)
@@ -316,25 +334,103 @@ class Command(BaseCommand):
                 self.sync_media_file(resized, prefix=trek.pk, directory=url_trek, zipfile=trekid_zipfile)
             for desk in child.information_desks.all():
                 self.sync_media_file(desk.resized_picture, prefix=trek.pk, directory=url_trek, zipfile=trekid_zipfile)
+            child.prepare_elevation_charts(self.languages, self.referer)
             for lang in self.languages:
-                child.prepare_elevation_chart(lang, self.referer)
                 url_media = '/{}{}'.format(trek.pk, settings.MEDIA_URL)
                 self.sync_file(child.get_elevation_chart_url_png(lang), settings.MEDIA_ROOT,
                                url_media, directory=url_trek, zipfile=trekid_zipfile)
 
         self.close_zip(trekid_zipfile, zipname_trekid)
 
-    def sync_treks_media(self):
-        treks = trekking_models.Trek.objects.existing().filter(published=True).order_by('pk')
+    def get_trek_tasks(self):
+        """Treks to sync: media zip of published treks, and files of treks published in each language"""
+        treks = trekking_models.Trek.objects.existing().order_by('pk')
         if self.portal:
-            treks = treks.filter(Q(portal__name__in=self.portal) | Q(portal=None))
+            treks = treks.filter(Q(portal__name__in=self.portal) | Q(portal=None)).distinct()
+        tasks = [('nolang', pk) for pk in treks.filter(published=True).values_list('pk', flat=True)]
+        for lang in self.languages:
+            published = treks.filter(**{'published_{lang}'.format(lang=lang): True})
+            tasks += [(lang, pk) for pk in published.values_list('pk', flat=True)]
+        return tasks
+
+    def sync_trek_task(self, scope, pk):
+        """Sync media zip (scope 'nolang') or files in one language (scope is the language) of a trek,
+        unless they can be reused from previous sync.
+        Returns name of task, its manifest entry (None if it failed) and whether it was successful.
+        """
+        self.successfull = True
+        trek = trekking_models.Trek.objects.get(pk=pk)
+        name = os.path.join(scope, str(pk))
+        paths = [name + '.zip', name] if scope == 'nolang' else [name]
+        key = self.manifest.get_hash(name, self.settings_hashes.get(scope), self.get_trek_dependencies(trek))
+        if not self.reuse(name, key):
+            if scope == 'nolang':
+                self.sync_trek_by_pk_media(trek)
+            else:
+                translation.activate(scope)
+                self.sync_trek(scope, trek)
+                translation.deactivate()
+        if not self.successfull:
+            return name, None, False
+        return name, self.manifest.entry(key, paths, date_update=trek.date_update), True
+
+    def sync_treks(self):
+        tasks = self.get_trek_tasks()
+        if self.jobs > 1:
+            close_connections()
+            with Pool(self.jobs, initializer=init_worker, initargs=(self, )) as pool:
+                self.collect_trek_tasks(pool.imap_unordered(sync_trek_task, tasks), len(tasks))
+        else:
+            self.collect_trek_tasks((self.sync_trek_task(*task) for task in tasks), len(tasks))
 
-        for trek in treks:
-            self.sync_trek_by_pk_media(trek)
+    def collect_trek_tasks(self, results, total):
+        successfull = self.successfull
+        current_value = 30
+        for done, (name, entry, task_successfull) in enumerate(results, 1):
+            successfull = successfull and task_successfull
+            if entry:
+                self.manifest.entries[name] = entry
+            if self.celery_task and 30 + 70 * done // total != current_value:
+                current_value = 30 + 70 * done // total
+                self.celery_task.update_state(
+                    state='PROGRESS',
+                    meta={
+                        'name': self.celery_task.name,
+                        'current': current_value,
+                        'total': 100,
+                        'infos': "{} : {}/{} ...".format(_("Treks"), done, total)
+                    }
+                )
+        self.successfull = successfull
+
+    def get_pictogram_models(self):
+        """Models whose pictograms are synced, with size of pictograms"""
+        return [
+            (common_models.Theme, None),
+            (trekking_models.TrekNetwork, None),
+            (trekking_models.Practice, settings.MOBILE_CATEGORY_PICTO_SIZE),
+            (trekking_models.Accessibility, None),
+            (trekking_models.DifficultyLevel, None),
+            (trekking_models.POIType, settings.MOBILE_POI_PICTO_SIZE),
+            (trekking_models.Route, None),
+            (tourism_models.InformationDeskType, settings.MOBILE_INFORMATIONDESKTYPE_PICTO_SIZE),
+            (tourism_models.TouristicContentCategory, settings.MOBILE_CATEGORY_PICTO_SIZE),
+            (tourism_models.TouristicContentType, None),
+            (tourism_models.TouristicEventType, None),
+        ]
 
     def sync_global_media(self):
         url_media_nolang = os.path.join('nolang')
         zipname_settings = os.path.join('nolang', 'global.zip')
+        name = os.path.join('nolang', 'global')
+        paths = [zipname_settings, os.path.join(url_media_nolang, settings.MEDIA_URL.strip('/'))]
+        pictograms = [(model._meta.label, list(model.objects.order_by('pk').values_list('pk', 'pictogram')), size)
+                      for model, size in self.get_pictogram_models()]
+        key = self.manifest.get_hash(name, settings.LEAFLET_CONFIG['SPATIAL_EXTENT'], pictograms)
+        if self.reuse(name, key):
+            self.manifest.entries[name] = self.manifest.entry(key, paths)
+            return
+
         zipfullname_settings = os.path.join(self.tmp_root, zipname_settings)
         self.mkdirs(zipfullname_settings)
         self.zipfile_settings = ZipFile(zipfullname_settings, 'w')
@@ -342,24 +438,10 @@ class Command(BaseCommand):
         if not self.skip_tiles:
             self.sync_global_tiles(self.zipfile_settings)
 
-        self.sync_pictograms(common_models.Theme, directory=url_media_nolang, zipfile=self.zipfile_settings)
-        self.sync_pictograms(trekking_models.TrekNetwork, directory=url_media_nolang, zipfile=self.zipfile_settings)
-        self.sync_pictograms(trekking_models.Practice, directory=url_media_nolang, zipfile=self.zipfile_settings,
-                             size=settings.MOBILE_CATEGORY_PICTO_SIZE)
-        self.sync_pictograms(trekking_models.Accessibility, directory=url_media_nolang, zipfile=self.zipfile_settings)
-        self.sync_pictograms(trekking_models.DifficultyLevel, directory=url_media_nolang, zipfile=self.zipfile_settings)
-        self.sync_pictograms(trekking_models.POIType, directory=url_media_nolang, zipfile=self.zipfile_settings,
-                             size=settings.MOBILE_POI_PICTO_SIZE)
-        self.sync_pictograms(trekking_models.Route, directory=url_media_nolang, zipfile=self.zipfile_settings)
-        self.sync_pictograms(tourism_models.InformationDeskType, directory=url_media_nolang,
-                             zipfile=self.zipfile_settings, size=settings.MOBILE_INFORMATIONDESKTYPE_PICTO_SIZE)
-        self.sync_pictograms(tourism_models.TouristicContentCategory, directory=url_media_nolang,
-                             zipfile=self.zipfile_settings, size=settings.MOBILE_CATEGORY_PICTO_SIZE)
-        self.sync_pictograms(tourism_models.TouristicContentType, directory=url_media_nolang,
-                             zipfile=self.zipfile_settings)
-        self.sync_pictograms(tourism_models.TouristicEventType, directory=url_media_nolang,
-                             zipfile=self.zipfile_settings)
+        for model, size in self.get_pictogram_models():
+            self.sync_pictograms(model, directory=url_media_nolang, zipfile=self.zipfile_settings, size=size)
         self.close_zip(self.zipfile_settings, zipname_settings)
+        self.manifest.entries[name] = self.manifest.entry(key, paths)
 
     def sync_trek_tiles(self, trek, zipfile):
         """ Add tiles to zipfile for the specified Trek object.
@@ -411,9 +493,44 @@ class Command(BaseCommand):
         if self.verbosity == 2:
             self.stdout.write("\x1b[3D\x1b[32mdownloaded\x1b[0m")
 
+    def get_fingerprint(self):
+        """Options and settings used to generate all files"""
+        return [
+            settings.VERSION, self.languages, self.portal, self.skip_tiles, self.indent, self.referer,
+            settings.MOBILE_TILES_URL, settings.MOBILE_TILES_EXTENSION, settings.MOBILE_TILES_RADIUS_LARGE,
+            settings.MOBILE_TILES_RADIUS_SMALL, settings.MOBILE_TILES_LOW_ZOOMS, settings.MOBILE_TILES_HIGH_ZOOMS,
+            settings.MOBILE_TILES_GLOBAL_ZOOMS,
+        ]
+
+    def get_trek_dependencies(self, trek):
+        """Versions of objects whose changes can modify files of trek:
+        trek, children, their published POIs, touristic contents and events, attachments and information desks
+        """
+        dependencies = []
+        for obj in [trek] + list(trek.children):
+            related = chain([obj], obj.published_pois, obj.published_touristic_contents,
+                            obj.published_touristic_events)
+            for related_obj in related:
+                dependencies.append([related_obj._meta.label, related_obj.pk, related_obj.date_update,
+                                     related_obj.geom])
+                dependencies.append(list(related_obj.attachments.order_by('pk').values_list('pk', 'date_update')))
+            for desk in obj.information_desks.order_by('pk'):
+                dependencies.append([getattr(desk, field.attname) for field in desk._meta.concrete_fields])
+        return dependencies
+
+    def reuse(self, name, key):
+        """Hard link files of previous sync if they were generated from the same content.
+        Returns True if they were reused.
+        """
+        if not self.manifest.reuse(name, key):
+            return False
+        if self.verbosity == 2:
+            self.stdout.write("\x1b[36m**\x1b[0m \x1b[1m{name}\x1b[0m \x1b[32munchanged\x1b[0m".format(name=name))
+        return True
+
     def sync(self):
-        step_value = int(50 / len(settings.MODELTRANSLATION_LANGUAGES))
-        current_value = 30
+        step_value = int(20 / len(self.languages))
+        current_value = 10
 
         self.sync_medias()
 
@@ -432,16 +549,20 @@ class Command(BaseCommand):
 
             translation.activate(lang)
             self.sync_settings_json(lang)
+            # Names and pictograms of categories are in settings, not in trek files
+            self.settings_hashes[lang] = get_file_hash(os.path.join(self.tmp_root, lang, 'settings.json'))
             if 'geotrek.flatpages' in settings.INSTALLED_APPS:
                 self.sync_flatpage(lang)
             self.sync_trekking(lang)
             translation.deactivate()
 
+        self.sync_treks()
+
     def check_dst_root_is_empty(self):
         if not os.path.exists(self.dst_root):
             return
         existing = set([os.path.basename(p) for p in os.listdir(self.dst_root)])
-        remaining = existing - {'nolang'} - set(settings.MODELTRANSLATION_LANGUAGES)
+        remaining = existing - {'nolang', MANIFEST_NAME} - set(settings.MODELTRANSLATION_LANGUAGES)
         if remaining:
             raise CommandError("Destination directory contains extra data")
 
@@ -459,6 +580,7 @@ class Command(BaseCommand):
         self.verbosity = options['verbosity']
         self.skip_tiles = options['skip_tiles']
         self.indent = options['indent']
+        self.jobs = options['jobs']
         self.factory = RequestFactory()
         self.dst_root = options["path"].rstrip('/')
         self.abs_path = os.path.abspath(options["path"])
@@ -492,8 +614,10 @@ class Command(BaseCommand):
             'ignore_errors': True,
             'tiles_dir': os.path.join(settings.VAR_DIR, 'tiles'),
         }
+        self.settings_hashes = {}
 
         self.tmp_root = os.path.join(os.path.dirname(self.dst_root), 'tmp_sync_mobile')
+        self.manifest = SyncManifest(self.dst_root, self.tmp_root, self.get_fingerprint(), full=options['full'])
         try:
             os.mkdir(self.tmp_root)
         except OSError as e:
@@ -505,6 +629,7 @@ class Command(BaseCommand):
             )
         try:
             self.sync()
+            self.manifest.write()
             if self.celery_task:
                 self.celery_task.update_state(
                     state='PROGRESS',
@@ -520,6 +645,7 @@ class Command(BaseCommand):
             raise
 
         self.rename_root()
+        TileStore.purge(self.builder_args['tiles_dir'], settings.MOBILE_TILES_TTL)
 
         done_message = 'Done'
         if self.successfull:
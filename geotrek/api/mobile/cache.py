@@ -0,0 +1,37 @@
+"""
+Cache of mobile API payloads (POIs, touristic contents and events of treks, settings), by language.
+
+Payloads are stored in API cache with versions of models they are built from (see geotrek.api.v2.cache):
+saving or deleting an instance of these models changes their version, so outdated payloads are not used anymore.
+Lifetime of payloads can be set by name in API_CACHE_TIMEOUTS (ex: {'mobile_settings': 86400}).
+"""
+from hashlib import md5
+
+from django.conf import settings
+from django.utils import translation
+
+from geotrek.api.v2.cache import get_api_cache, get_model_dependencies, get_versions
+
+
+def get_cached_payload(name, models, build, *key_parts):
+    """
+    Payload built by build() from instances of models, taken from cache if these models did not change since
+    :param name: name of payload
+    :param models: models whose instances are rendered in payload
+    :param build: function building payload
+    :param key_parts: other values distinguishing payloads with same name (object id, parameters...)
+    """
+    timeout = settings.API_CACHE_TIMEOUTS.get(name, settings.API_CACHE_TIMEOUT)
+    if not timeout:
+        return build()
+    dependencies = set()
+    for model in models:
+        dependencies |= get_model_dependencies(model)
+    key = [name, translation.get_language(), key_parts, get_versions(dependencies)]
+    key = 'api_mobile_{}'.format(md5(repr(key).encode('utf-8')).hexdigest())
+    cache = get_api_cache()
+    payload = cache.get(key)
+    if payload is None:
+        payload = build()
+        cache.set(key, payload, timeout)
+    return payload
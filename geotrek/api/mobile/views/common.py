@@ -8,6 +8,7 @@ from rest_framework.permissions import AllowAny
 from rest_framework import response
 from rest_framework_extensions.mixins import DetailSerializerMixin
 
+from geotrek.api.mobile.cache import get_cached_payload
 from geotrek.api.mobile.serializers import common as api_serializers
 from geotrek.flatpages.models import FlatPage
 from geotrek.trekking.models import DifficultyLevel, Practice, Accessibility, Route, Theme, TrekNetwork, POIType, Trek
@@ -18,8 +19,17 @@ from geotrek.zoning.models import City, District
 
 class SettingsView(APIView):
     permission_classes = [AllowAny, ]
+    # Models rendered in settings, or used to select rendered objects
+    models = (DifficultyLevel, Practice, Accessibility, Route, Theme, TrekNetwork, POIType, Trek, InformationDesk,
+              InformationDeskType, TouristicContentType, TouristicEventType, TouristicContentCategory, City, District)
 
     def get(self, request, *args, **kwargs):
+        # URLs of pictograms are absolute
+        data = get_cached_payload('mobile_settings', self.models, lambda: self.build_settings(request),
+                                  request.build_absolute_uri('/'))
+        return response.Response(data)
+
+    def build_settings(self, request):
         filters = []
         for filter in settings.ENABLED_MOBILE_FILTERS:
             if filter == 'difficulty' and DifficultyLevel.objects.exists():
@@ -92,7 +102,7 @@ class SettingsView(APIView):
                     "showAllLabel": _("Show all routes"),
                     "hideAllLabel": _("Hide all routes")
                 })
-        return response.Response({
+        return {
             'filters': filters,
             'data': [
                 {
@@ -200,7 +210,7 @@ class SettingsView(APIView):
                         many=True, context={'request': request}).data,
                 },
             ]
-        })
+        }
 
 
 class FlatPageViewSet(DetailSerializerMixin, viewsets.ReadOnlyModelViewSet):
@@ -6,7 +6,11 @@ from django_filters.rest_framework.backends import DjangoFilterBackend
 from geotrek.api.mobile.serializers import trekking as api_serializers_trekking
 from geotrek.api.mobile.serializers import tourism as api_serializers_tourism
 
+from geotrek.api.mobile.cache import get_cached_payload
 from geotrek.api.v2.functions import Transform, Length, StartPoint, EndPoint
+from geotrek.api.v2.viewsets import BatchDetailMixin
+from geotrek.core.models import Topology
+from geotrek.tourism import models as tourism_models
 from geotrek.trekking import models as trekking_models
 
 from rest_framework_extensions.mixins import DetailSerializerMixin
@@ -15,8 +19,11 @@ from rest_framework import response
 from rest_framework import viewsets
 from rest_framework import decorators
 
+# Objects of treks are found by intersection with their geometry (topology)
+TREK_MODELS = (trekking_models.Trek, Topology)
 
-class TrekViewSet(DetailSerializerMixin, viewsets.ReadOnlyModelViewSet):
+
+class TrekViewSet(BatchDetailMixin, DetailSerializerMixin, viewsets.ReadOnlyModelViewSet):
     filter_backends = (DjangoFilterBackend,)
     serializer_class = api_serializers_trekking.TrekListSerializer
     serializer_detail_class = api_serializers_trekking.TrekDetailSerializer
@@ -49,26 +56,42 @@ class TrekViewSet(DetailSerializerMixin, viewsets.ReadOnlyModelViewSet):
     def pois(self, request, *args, **kwargs):
         trek = self.get_object()
         root_pk = self.request.GET.get('root_pk') or trek.pk
-        qs = trek.pois.filter(published=True).select_related('topo_object', 'type', )\
-            .prefetch_related('topo_object__aggregations', 'attachments') \
-            .annotate(geom2d_transformed=Transform(F('geom'), settings.API_SRID))
-        data = api_serializers_trekking.POIListSerializer(qs, many=True, context={'root_pk': root_pk}).data
+
+        def build():
+            qs = trek.pois.filter(published=True).select_related('topo_object', 'type', )\
+                .prefetch_related('topo_object__aggregations', 'attachments') \
+                .annotate(geom2d_transformed=Transform(F('geom'), settings.API_SRID))
+            return api_serializers_trekking.POIListSerializer(qs, many=True, context={'root_pk': root_pk}).data
+
+        data = get_cached_payload('mobile_trek_pois', TREK_MODELS + (trekking_models.POI, ), build, trek.pk, root_pk)
         return response.Response(data)
 
     @decorators.action(detail=True, methods=['get'])
     def touristic_contents(self, request, *args, **kwargs):
         trek = self.get_object()
         root_pk = self.request.GET.get('root_pk') or trek.pk
-        qs = trek.touristic_contents.filter(published=True).prefetch_related('attachments') \
-            .annotate(geom2d_transformed=Transform(F('geom'), settings.API_SRID))
-        data = api_serializers_tourism.TouristicContentListSerializer(qs, many=True, context={'root_pk': root_pk}).data
+
+        def build():
+            qs = trek.touristic_contents.filter(published=True).prefetch_related('attachments') \
+                .annotate(geom2d_transformed=Transform(F('geom'), settings.API_SRID))
+            return api_serializers_tourism.TouristicContentListSerializer(qs, many=True,
+                                                                          context={'root_pk': root_pk}).data
+
+        data = get_cached_payload('mobile_trek_touristic_contents', TREK_MODELS + (tourism_models.TouristicContent, ),
+                                  build, trek.pk, root_pk)
         return response.Response(data)
 
     @decorators.action(detail=True, methods=['get'])
     def touristic_events(self, request, *args, **kwargs):
         trek = self.get_object()
         root_pk = self.request.GET.get('root_pk') or trek.pk
-        qs = trek.trek.touristic_events.filter(published=True).prefetch_related('attachments') \
-            .annotate(geom2d_transformed=Transform(F('geom'), settings.API_SRID))
-        data = api_serializers_tourism.TouristicEventListSerializer(qs, many=True, context={'root_pk': root_pk}).data
+
+        def build():
+            qs = trek.trek.touristic_events.filter(published=True).prefetch_related('attachments') \
+                .annotate(geom2d_transformed=Transform(F('geom'), settings.API_SRID))
+            return api_serializers_tourism.TouristicEventListSerializer(qs, many=True,
+                                                                        context={'root_pk': root_pk}).data
+
+        data = get_cached_payload('mobile_trek_touristic_events', TREK_MODELS + (tourism_models.TouristicEvent, ),
+                                  build, trek.pk, root_pk)
         return response.Response(data)
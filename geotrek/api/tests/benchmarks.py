@@ -0,0 +1,65 @@
+"""
+Benchmarks of API v2 serialization.
+
+Run with ``./manage.py test geotrek.api.tests.benchmarks``.
+"""
+from unittest import mock
+
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.urls import reverse
+
+from geotrek.api.v2 import serializers as api_serializers
+from geotrek.api.v2.views.trekking import POIViewSet
+from geotrek.common.tests import BenchmarkMixin
+from geotrek.trekking.factories import POIFactory
+
+
+class SerializerBenchmark(BenchmarkMixin, TestCase):
+    benchmark_name = 'api_serializers'
+    benchmark_repeat = 20
+    nb_pois = 100
+
+    @classmethod
+    def setUpTestData(cls):
+        POIFactory.create_batch(cls.nb_pois)
+
+    def serialize(self, objects, params):
+        request = RequestFactory().get('/api/v2/poi/', params)
+        serializer_class = api_serializers.override_serializer(params.get('format', 'json'), params.get('dim', '2'),
+                                                               api_serializers.POIListSerializer)
+        return serializer_class(objects, many=True, context={'request': request, 'kwargs': {}}).data
+
+    def test_serializers(self):
+        pois = list(POIViewSet.queryset.select_related('type').annotate(**POIViewSet.annotations))
+        for label, params in (('json', {}),
+                              ('json_3d', {'dim': '3'}),
+                              ('geojson', {'format': 'geojson'}),
+                              ('geojson_3d', {'format': 'geojson', 'dim': '3'}),
+                              ('json_fields', {'fields': 'id,name,geometry'}),
+                              ('json_omit', {'omit': 'description,external_id'})):
+            # Instantiation cost only: one object per request
+            self.measure('instantiate/{}'.format(label), lambda: self.serialize(pois[:1], params))
+            self.measure('serialize/{}/{}pois'.format(label, len(pois)), lambda: self.serialize(pois, params), len(pois))
+
+    def test_list_rendered_in_database(self):
+        for label, params in (('json', {'fields': 'id,name,geometry'}),
+                              ('json_all_languages', {'fields': 'id,name,description,published,geometry'}),
+                              ('geojson', {'fields': 'id,name,geometry', 'format': 'geojson'})):
+            params['page_size'] = self.nb_pois
+            self.measure('list_database/{}/{}pois'.format(label, self.nb_pois),
+                         lambda: self.client.get(reverse('apiv2:poi-list'), params), self.nb_pois)
+            with mock.patch('geotrek.api.v2.viewsets.get_sql_expression', return_value=None):
+                self.measure('list_serializer/{}/{}pois'.format(label, self.nb_pois),
+                             lambda: self.client.get(reverse('apiv2:poi-list'), params), self.nb_pois)
+
+    def test_list_field_subsets(self):
+        # Only annotations, joins and prefetches required by fields are done
+        for label, params in (('all', {}),
+                              ('id_name', {'fields': 'id,name'}),
+                              ('geometry', {'fields': 'id,geometry'}),
+                              ('type', {'fields': 'id,type'}),
+                              ('omit_geometry', {'omit': 'geometry'})):
+            params['page_size'] = self.nb_pois
+            self.measure('list_fields/{}/{}pois'.format(label, self.nb_pois),
+                         lambda: self.client.get(reverse('apiv2:poi-list'), params), self.nb_pois)
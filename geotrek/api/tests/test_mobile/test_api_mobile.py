@@ -1,6 +1,11 @@
+from unittest import mock
+
 from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
 from django.urls import reverse
 from django.test.testcases import TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
 from django.contrib.gis.geos import Point, MultiPoint, MultiPolygon, Polygon
 
 from geotrek.trekking import factories as trek_factory, models as trek_models
@@ -360,6 +365,68 @@ class APIAccessTestCase(BaseApiTest):
         self.assertEqual(json_response.get('features')[0].get('properties')['description'],
                          "Sisi")
 
+    def test_trek_batch(self):
+        missing = self.trek_parent_not_published.pk
+        ids = [self.trek_child_published.pk, missing, self.trek.pk]
+        response = self.client.get(reverse('apimobile:treks-batch'), {'ids': ','.join(str(pk) for pk in ids)},
+                                   HTTP_ACCEPT_LANGUAGE='fr')
+        self.assertEqual(response.status_code, 200)
+        json_response = response.json()
+        self.assertEqual(json_response['missing'], [missing])
+        self.assertEqual([feature['id'] for feature in json_response['features']],
+                         [self.trek_child_published.pk, self.trek.pk])
+        self.assertEqual(sorted(json_response['features'][0]['properties'].keys()),
+                         TREK_DETAIL_PROPERTIES_GEOJSON_STRUCTURE)
+
+
+@override_settings(API_CACHE_TIMEOUT=60, CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+    'fat': settings.CACHES['fat'],
+    'api': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+})
+@mock.patch('geotrek.api.v2.cache.transaction.on_commit', lambda func: func())
+class APICacheTestCase(BaseApiTest):
+    def setUp(self):
+        caches['api'].clear()
+
+    def test_poi_list_is_cached(self):
+        response = self.get_poi_list(self.trek.pk, 'fr')
+        self.assertEqual(response.status_code, 200)
+        with CaptureQueriesContext(connection) as context:
+            cached_response = self.get_poi_list(self.trek.pk, 'fr')
+        self.assertFalse(any('trekking_poi' in query['sql'] for query in context.captured_queries))
+        self.assertEqual(cached_response.json(), response.json())
+
+    def test_poi_list_cache_invalidated_on_save(self):
+        self.get_poi_list(self.trek.pk, 'fr')
+        poi = self.trek.published_pois.first()
+        poi.name_fr = 'Nouveau nom'
+        poi.save()
+        response = self.get_poi_list(self.trek.pk, 'fr')
+        self.assertIn('Nouveau nom', [feature['properties']['name'] for feature in response.json()['features']])
+
+    def test_touristic_lists_cache_invalidated_on_save(self):
+        for obj, get_list in ((self.touristic_content, self.get_touristic_content_list),
+                              (self.touristic_event, self.get_touristic_event_list)):
+            get_list(self.trek.pk, 'fr')
+            obj.description_fr = 'Nouvelle description'
+            obj.save()
+            response = get_list(self.trek.pk, 'fr')
+            self.assertEqual(response.json()['features'][0]['properties']['description'], 'Nouvelle description')
+
+    def test_settings_are_cached(self):
+        response = self.client.get(reverse('apimobile:settings'), HTTP_ACCEPT_LANGUAGE='fr')
+        self.assertEqual(response.status_code, 200)
+        with self.assertNumQueries(0):
+            cached_response = self.client.get(reverse('apimobile:settings'), HTTP_ACCEPT_LANGUAGE='fr')
+        self.assertEqual(cached_response.json(), response.json())
+        route = trek_factory.RouteFactory.create()
+        self.trek.route = route
+        self.trek.save()
+        response = self.client.get(reverse('apimobile:settings'), HTTP_ACCEPT_LANGUAGE='fr')
+        routes = [data for data in response.json()['data'] if data['id'] == 'route'][0]['values']
+        self.assertIn(route.pk, [value['id'] for value in routes])
+
 
 class APISwaggerTestCase(BaseApiTest):
     """
@@ -20,6 +20,7 @@ from django.test import TestCase
 from django.test.utils import override_settings
 from django.utils import translation
 
+from geotrek.api.management.commands import sync_mobile
 from geotrek.common.factories import RecordSourceFactory, TargetPortalFactory, AttachmentFactory
 from geotrek.common.tests import TranslationResetMixin
 from geotrek.common.utils.testdata import get_dummy_uploaded_image_svg, get_dummy_uploaded_image, get_dummy_uploaded_file
@@ -33,6 +34,22 @@ from geotrek.tourism.factories import (InformationDeskFactory, InformationDeskTy
 from geotrek.tourism.models import TouristicEventType
 
 
+class InProcessPool:
+    """Run tasks of pool in the test process: test data is not visible from other database connections"""
+
+    def __init__(self, processes, initializer=None, initargs=()):
+        sync_mobile.worker_command = initargs[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def imap_unordered(self, func, iterable):
+        return map(func, iterable)
+
+
 class VarTmpTestCase(TestCase):
     def setUp(self):
         if os.path.exists(os.path.join('var', 'tmp_sync_mobile')):
@@ -544,3 +561,53 @@ class SyncMobileTreksTest(TranslationResetMixin, VarTmpTestCase):
         management.call_command('sync_mobile', 'var/tmp', url='http://localhost:8000',
                                 skip_tiles=True, verbosity=2, stdout=output)
         self.assertIn('Done', output.getvalue())
+
+    def test_sync_treks_incremental(self):
+        management.call_command('sync_mobile', 'var/tmp', url='http://localhost:8000',
+                                skip_tiles=True, verbosity=0)
+        trek_path = os.path.join('var/tmp/en', str(self.trek_1.pk), 'trek.geojson')
+        zip_path = os.path.join('var/tmp/nolang', '{}.zip'.format(self.trek_1.pk))
+        trek_inode, zip_inode = os.stat(trek_path).st_ino, os.stat(zip_path).st_ino
+        with open('var/tmp/manifest.json') as f:
+            manifest = json.load(f)
+        self.assertIn('nolang/{}'.format(self.trek_1.pk), manifest)
+        self.assertIn('en/{}'.format(self.trek_1.pk), manifest)
+        self.assertIn('nolang/global', manifest)
+
+        output = StringIO()
+        management.call_command('sync_mobile', 'var/tmp', url='http://localhost:8000',
+                                skip_tiles=True, verbosity=2, stdout=output)
+        self.assertIn('\x1b[1men/{}\x1b[0m \x1b[32munchanged'.format(self.trek_1.pk), output.getvalue())
+        self.assertNotIn('en/{}/trek.geojson'.format(self.trek_1.pk), output.getvalue())
+        # Files are hard links to those of previous sync
+        self.assertEqual(os.stat(trek_path).st_ino, trek_inode)
+        self.assertEqual(os.stat(zip_path).st_ino, zip_inode)
+
+        self.poi_1.save()
+        output = StringIO()
+        management.call_command('sync_mobile', 'var/tmp', url='http://localhost:8000',
+                                skip_tiles=True, verbosity=2, stdout=output)
+        self.assertIn('en/{}/trek.geojson'.format(self.trek_1.pk), output.getvalue())
+        self.assertNotEqual(os.stat(zip_path).st_ino, zip_inode)
+
+    def test_sync_treks_full(self):
+        management.call_command('sync_mobile', 'var/tmp', url='http://localhost:8000',
+                                skip_tiles=True, verbosity=0)
+        output = StringIO()
+        management.call_command('sync_mobile', 'var/tmp', url='http://localhost:8000',
+                                skip_tiles=True, full=True, verbosity=2, stdout=output)
+        self.assertIn('en/{}/trek.geojson'.format(self.trek_1.pk), output.getvalue())
+        self.assertNotIn('\x1b[1men/{}\x1b[0m'.format(self.trek_1.pk), output.getvalue())
+
+    @mock.patch('geotrek.api.management.commands.sync_mobile.close_connections')
+    @mock.patch('geotrek.api.management.commands.sync_mobile.Pool', InProcessPool)
+    def test_sync_treks_jobs(self, mock_close):
+        output = StringIO()
+        management.call_command('sync_mobile', 'var/tmp', url='http://localhost:8000',
+                                skip_tiles=True, jobs=2, verbosity=2, stdout=output)
+        mock_close.assert_called_once_with()
+        self.assertIn('Done', output.getvalue())
+        self.assertTrue(os.path.exists(os.path.join('var/tmp/nolang', '{}.zip'.format(self.trek_1.pk))))
+        for lang in settings.MODELTRANSLATION_LANGUAGES:
+            for trek in Trek.objects.filter(**{'published_{}'.format(lang): True}):
+                self.assertTrue(os.path.exists(os.path.join('var/tmp', lang, str(trek.pk), 'trek.geojson')))
@@ -1,11 +1,21 @@
+import json
+import math
+from base64 import urlsafe_b64encode
+from unittest import mock, skipIf
+from urllib.parse import parse_qs, urlparse
+
+from django.core.cache import caches
 from django.urls import reverse
 from django.db.models import Count
 from django.test.client import Client
 from django.test.testcases import TestCase
-from django.contrib.gis.geos import MultiPoint, Point
+from django.contrib.gis.geos import GEOSGeometry, MultiPoint, Point
 from django.conf import settings
-from django.test.utils import override_settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
 
+from geotrek.api.v2 import serializers as api_serializers
+from geotrek.api.v2.renderers import msgpack, pyarrow
 from geotrek.authent import factories as authent_factory, models as authent_models
 from geotrek.core import factories as core_factory, models as path_models
 from geotrek.common import factories as common_factory, models as common_models
@@ -177,6 +187,9 @@ class BaseApiTest(TestCase):
     def get_trek_practices_list(self, params=None):
         return self.client.get(reverse('apiv2:trek-practices'), params)
 
+    def get_trek_profiles(self, params=None):
+        return self.client.get(reverse('apiv2:trek-profiles'), params)
+
     def get_networks_list(self, params=None):
         return self.client.get(reverse('apiv2:network-list'), params)
 
@@ -446,6 +459,69 @@ class APIAccessAnonymousTestCase(BaseApiTest):
         response = self.get_trek_difficulties_list()
         self.assertEquals(response.status_code, 302)
 
+    def test_trek_profiles(self):
+        ids = [self.treks[1].pk, self.treks[0].pk]
+        response = self.get_trek_profiles({'ids': ','.join(str(pk) for pk in ids)})
+        self.assertEqual(response.status_code, 200)
+        json_response = response.json()
+        self.assertEqual([item['id'] for item in json_response], sorted(ids))
+        self.assertEqual(sorted(json_response[0].keys()), ['id', 'limits', 'profile'])
+        self.assertEqual(sorted(json_response[0]['limits'].keys()), ['ceil', 'floor'])
+
+    def test_trek_profiles_max_points(self):
+        response = self.get_trek_profiles({'ids': self.treks[0].pk, 'max_points': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(len(response.json()[0]['profile']), 2)
+
+    def test_trek_profiles_invalid_params(self):
+        self.assertEqual(self.get_trek_profiles().status_code, 400)
+        self.assertEqual(self.get_trek_profiles({'ids': self.treks[0].pk, 'max_points': 'a'}).status_code, 400)
+        self.assertEqual(self.get_trek_profiles({'ids': self.treks[0].pk, 'max_points': -1}).status_code, 400)
+        with override_settings(API_BATCH_MAX_SIZE=1):
+            ids = ','.join(str(trek.pk) for trek in self.treks[:2])
+            self.assertEqual(self.get_trek_profiles({'ids': ids}).status_code, 400)
+
+    def test_trek_list_ids(self):
+        ids = [self.treks[1].pk, self.treks[0].pk]
+        response = self.get_trek_list({'ids': ','.join(str(pk) for pk in ids)})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(item['id'] for item in response.json()['results']), sorted(ids))
+        self.assertEqual(self.get_trek_list({'ids': '1,a'}).status_code, 400)
+
+    def test_trek_batch(self):
+        missing = max(trek.pk for trek in self.treks) + 1000
+        ids = [self.treks[2].pk, missing, self.treks[0].pk]
+        response = self.client.get(reverse('apiv2:trek-batch'), {'ids': ','.join(str(pk) for pk in ids)})
+        self.assertEqual(response.status_code, 200)
+        json_response = response.json()
+        self.assertEqual(json_response['count'], 2)
+        self.assertEqual(json_response['missing'], [missing])
+        # Requested order, with detail serializer
+        self.assertEqual([item['id'] for item in json_response['results']], [self.treks[2].pk, self.treks[0].pk])
+        self.assertEqual(json_response['results'][0], self.get_trek_detail(self.treks[2].pk).json())
+
+    def test_poi_batch_geojson(self):
+        poi_id = self.get_poi_list().json()['results'][0]['id']
+        response = self.client.get(reverse('apiv2:poi-batch'), {'ids': poi_id, 'format': 'geojson'})
+        self.assertEqual(response.status_code, 200)
+        json_response = response.json()
+        self.assertEqual(json_response['type'], 'FeatureCollection')
+        self.assertEqual(json_response['missing'], [])
+        self.assertEqual([feature['id'] for feature in json_response['features']], [poi_id])
+
+    def test_city_batch(self):
+        response = self.client.get(reverse('apiv2:city-batch'), {'ids': '{},00000'.format(self.city.code)})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['code'] for item in response.json()['results']], [self.city.code])
+        self.assertEqual(response.json()['missing'], ['00000'])
+
+    def test_batch_invalid(self):
+        self.assertEqual(self.client.get(reverse('apiv2:trek-batch')).status_code, 400)
+        self.assertEqual(self.client.get(reverse('apiv2:trek-batch'), {'ids': 'a'}).status_code, 400)
+        with override_settings(API_BATCH_MAX_SIZE=1):
+            response = self.client.get(reverse('apiv2:trek-batch'), {'ids': '1,2'})
+        self.assertEqual(response.status_code, 400)
+
     def test_difficulty_list(self):
         response = self.get_difficulties_list()
         self.assertEqual(response.status_code, 200)
@@ -586,6 +662,381 @@ class APIAccessAnonymousTestCase(BaseApiTest):
         self.assertEqual(sorted(json_response.get('features')[0].get('properties').keys()),
                          POI_LIST_PROPERTIES_GEOJSON_STRUCTURE)
 
+    def test_poi_list_fields_omit(self):
+        response = self.get_poi_list({'fields': 'id,name,geometry'})
+        self.assertEqual(sorted(response.json()['results'][0].keys()), ['geometry', 'id', 'name'])
+        response = self.get_poi_list({'omit': 'description,url'})
+        keys = response.json()['results'][0].keys()
+        self.assertNotIn('description', keys)
+        self.assertNotIn('url', keys)
+        self.assertIn('name', keys)
+        # Empty fields parameter keeps all fields
+        response = self.get_poi_list({'fields': ''})
+        self.assertEqual(response.json()['results'][0].keys(), self.get_poi_list().json()['results'][0].keys())
+
+    def test_generated_serializer_is_memoized(self):
+        serializer_class = api_serializers.override_serializer('geojson', '3', api_serializers.POIListSerializer)
+        self.assertIs(api_serializers.override_serializer('geojson', '3', api_serializers.POIListSerializer),
+                      serializer_class)
+        self.assertIs(api_serializers.override_serializer('json', '2', api_serializers.POIListSerializer),
+                      api_serializers.POIListSerializer)
+
+    def test_poi_list_cursor_pagination(self):
+        expected_ids = [poi['id'] for poi in self.get_poi_list({'page_size': 1000}).json()['results']]
+        ids = []
+        params = {'cursor': '', 'page_size': 10}
+        while True:
+            response = self.get_poi_list(params)
+            self.assertEqual(response.status_code, 200)
+            json_response = response.json()
+            self.assertEqual(sorted(json_response.keys()), PAGINATED_JSON_STRUCTURE)
+            self.assertEqual(json_response['count'], len(expected_ids))
+            self.assertIsNone(json_response['previous'])
+            ids += [poi['id'] for poi in json_response['results']]
+            if not json_response['next']:
+                break
+            params['cursor'] = parse_qs(urlparse(json_response['next']).query)['cursor'][0]
+        self.assertEqual(ids, sorted(expected_ids))
+
+    def test_poi_list_cursor_pagination_date_update_geojson(self):
+        response = self.get_poi_list({'cursor': '', 'cursor_ordering': 'date_update', 'count': 'false',
+                                      'format': 'geojson', 'page_size': 10})
+        self.assertEqual(response.status_code, 200)
+        json_response = response.json()
+        self.assertEqual(sorted(json_response.keys()), PAGINATED_GEOJSON_STRUCTURE)
+        self.assertIsNone(json_response['count'])
+        self.assertEqual(len(json_response['features']), 10)
+        cursor = parse_qs(urlparse(json_response['next']).query)['cursor'][0]
+        first_ids = [feature['properties']['id'] for feature in json_response['features']]
+        response = self.get_poi_list({'cursor': cursor, 'format': 'geojson', 'page_size': 10})
+        next_ids = [feature['properties']['id'] for feature in response.json()['features']]
+        self.assertFalse(set(first_ids) & set(next_ids))
+        dates = dict(trek_models.POI.objects.filter(pk__in=first_ids + next_ids).values_list('pk', 'date_update'))
+        ordered = [(dates[pk], pk) for pk in first_ids + next_ids]
+        self.assertEqual(ordered, sorted(ordered))
+
+    def test_poi_list_invalid_cursor(self):
+        response = self.get_poi_list({'cursor': 'foo'})
+        self.assertEqual(response.status_code, 404)
+        response = self.get_poi_list({'cursor': '', 'cursor_ordering': 'name'})
+        self.assertEqual(response.status_code, 404)
+        for content in ([['id'], [1]], ['id', 1], [1, [1]]):
+            response = self.get_poi_list({'cursor': urlsafe_b64encode(json.dumps(content).encode()).decode()})
+            self.assertEqual(response.status_code, 404)
+
+    def test_poi_list_streamed(self):
+        for params in ({}, {'format': 'geojson'}, {'cursor': '', 'page_size': 10}, {'format': 'geojson', 'dim': '3'}):
+            response = self.get_poi_list(params)
+            with override_settings(API_STREAMING_PAGE_SIZE=1):
+                streamed_response = self.get_poi_list(params)
+            self.assertTrue(streamed_response.streaming)
+            self.assertEqual(streamed_response['Content-Type'], 'application/json')
+            self.assertEqual(json.loads(b''.join(streamed_response.streaming_content).decode()), response.json())
+
+    @override_settings(API_STREAMING_PAGE_SIZE=1)
+    def test_trek_list_streamed_empty_page(self):
+        cursor = urlsafe_b64encode(json.dumps(['id', [10 ** 9]]).encode()).decode()
+        response = self.get_trek_list({'cursor': cursor})
+        json_response = json.loads(b''.join(response.streaming_content).decode())
+        self.assertEqual(json_response['results'], [])
+        self.assertIsNone(json_response['next'])
+
+    def assert_list_rendered_in_database(self, get_list, params):
+        with CaptureQueriesContext(connection) as queries:
+            response = get_list(params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(any('json_build_object' in query['sql'] for query in queries.captured_queries))
+        with mock.patch('geotrek.api.v2.viewsets.get_sql_expression', return_value=None):
+            expected = get_list(params)
+        self.assertEqual(response['Content-Type'], expected['Content-Type'])
+        self.assertEqual(response.json(), expected.json())
+
+    def test_list_rendered_in_database(self):
+        for params in ({'fields': 'id,name,description,external_id,published,geometry'},
+                       {'fields': 'id,name,geometry', 'language': 'fr'},
+                       {'fields': 'id,name,geometry', 'format': 'geojson'},
+                       {'fields': 'id,geometry', 'format': 'geojson', 'dim': '3', 'page_size': 10},
+                       {'fields': 'id,published', 'cursor': '', 'page_size': 10}):
+            self.assert_list_rendered_in_database(self.get_poi_list, params)
+        self.assert_list_rendered_in_database(self.get_path_list, {'fields': 'id,name,comments,geometry'})
+        self.assert_list_rendered_in_database(self.get_touristiccontent_list,
+                                              {'fields': 'id,approved,geometry', 'format': 'geojson'})
+
+    @skipIf(msgpack is None, "msgpack is not installed")
+    def test_list_msgpack(self):
+        for params in ({'page_size': 5}, {'fields': 'id,name,geometry', 'dim': '3', 'page_size': 5}):
+            response = self.get_poi_list(dict(params, format='msgpack'))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], 'application/msgpack')
+            self.assertEqual(msgpack.unpackb(response.content, raw=False), self.get_poi_list(params).json())
+        response = self.get_trek_detail(self.treks[0].pk, {'format': 'msgpack'})
+        self.assertEqual(msgpack.unpackb(response.content, raw=False), self.get_trek_detail(self.treks[0].pk).json())
+
+    @skipIf(pyarrow is None, "pyarrow is not installed")
+    def test_list_arrow(self):
+        params = {'fields': 'id,name,type,geometry', 'page_size': 5}
+        expected = self.get_poi_list(params).json()
+        response = self.get_poi_list(dict(params, format='arrow'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/vnd.apache.arrow.stream')
+        table = pyarrow.ipc.open_stream(response.content).read_all()
+        envelope = json.loads(table.schema.metadata[b'geotrek:envelope'].decode('utf-8'))
+        self.assertEqual(envelope, {key: expected[key] for key in ('count', 'next', 'previous')})
+        self.assertEqual(table.schema.field('geometry').metadata[b'ARROW:extension:name'], b'geoarrow.wkb')
+        columns = table.to_pydict()
+        for name in ('name', 'type'):
+            # Objects are JSON encoded
+            if table.schema.field(name).metadata:
+                self.assertEqual(table.schema.field(name).metadata[b'ARROW:extension:name'], b'arrow.json')
+                columns[name] = [json.loads(value) for value in columns[name]]
+        for i, poi in enumerate(expected['results']):
+            self.assertEqual(columns['id'][i], poi['id'])
+            self.assertEqual(columns['name'][i], poi['name'])
+            self.assertEqual(columns['type'][i], poi['type'])
+            geometry = GEOSGeometry(memoryview(columns['geometry'][i]))
+            self.assertEqual(len(geometry.coords), 2)
+            for coordinate, expected_coordinate in zip(geometry.coords, poi['geometry']['coordinates']):
+                self.assertAlmostEqual(coordinate, expected_coordinate)
+        # Elevations are kept
+        expected = self.get_poi_list(dict(params, dim=3)).json()
+        response = self.get_poi_list(dict(params, dim=3, format='arrow'))
+        columns = pyarrow.ipc.open_stream(response.content).read_all().to_pydict()
+        for i, poi in enumerate(expected['results']):
+            geometry = GEOSGeometry(memoryview(columns['geometry'][i]))
+            self.assertTrue(geometry.hasz)
+            self.assertEqual(len(geometry.coords), len(poi['geometry']['coordinates']))
+            for coordinate, expected_coordinate in zip(geometry.coords, poi['geometry']['coordinates']):
+                self.assertAlmostEqual(coordinate, expected_coordinate)
+
+    def test_list_not_rendered_in_database(self):
+        for params in ({}, {'fields': 'id,name,type'}, {'fields': 'id,url'}):
+            with CaptureQueriesContext(connection) as queries:
+                self.get_poi_list(params)
+            self.assertFalse(any('json_build_object' in query['sql'] for query in queries.captured_queries))
+
+    def test_trek_list_simplified(self):
+        params = {'fields': 'id,geometry', 'dim': '3'}
+        full = {trek['id']: trek['geometry'] for trek in self.get_trek_list(params).json()['results']}
+        response = self.get_trek_list(dict(params, zoom='0'))
+        self.assertEqual(response.status_code, 200)
+        for trek in response.json()['results']:
+            self.assertEqual(trek['geometry']['type'], 'LineString')
+            self.assertEqual(trek['geometry']['coordinates'][0], full[trek['id']]['coordinates'][0])
+            self.assertEqual(trek['geometry']['coordinates'][-1], full[trek['id']]['coordinates'][-1])
+            self.assertEqual(len(trek['geometry']['coordinates']), 2)
+            self.assertEqual(len(trek['geometry']['coordinates'][0]), 3)
+        response = self.get_trek_list(dict(params, simplify='0'))
+        self.assertEqual({trek['id']: trek['geometry'] for trek in response.json()['results']}, full)
+
+    def test_path_list_simplified_quantized(self):
+        # 10 meters are about 0.0001 degree: 5 digits are kept
+        response = self.get_path_list({'simplify': '10', 'quantize': 'true'})
+        self.assertEqual(response.status_code, 200)
+        for path in response.json()['results']:
+            for coord in path['geometry']['coordinates']:
+                self.assertEqual([round(value, 5) for value in coord], coord)
+
+    def test_list_simplified_invalid(self):
+        for params in ({'zoom': '23'}, {'zoom': 'a'}, {'simplify': '-1'}, {'simplify': 'nan'}):
+            self.assertEqual(self.get_trek_list(params).status_code, 400)
+
+    def get_tile(self, basename, z, x, y, params=None):
+        return self.client.get(reverse('apiv2:{}-tile'.format(basename), args=(z, x, y)), params)
+
+    def test_poi_tile(self):
+        poi = trek_models.POI.objects.existing().first()
+        lng, lat = poi.geom.transform(4326, clone=True).coords
+        z = 12
+        x = int((lng + 180) / 360 * 2 ** z)
+        y = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * 2 ** z)
+        response = self.get_tile('poi', z, x, y, {'language': 'en'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/vnd.mapbox-vector-tile')
+        self.assertIn(b'poi', response.content)
+        self.assertIn(poi.name_en.encode(), response.content)
+        response = self.get_tile('poi', z, (x + 2 ** (z - 1)) % 2 ** z, y)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b'')
+
+    def test_tiles(self):
+        for basename in ('trek', 'path', 'sensitivearea'):
+            response = self.get_tile(basename, 0, 0, 0)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], 'application/vnd.mapbox-vector-tile')
+        self.assertIn(b'trek', self.get_tile('trek', 0, 0, 0).content)
+        self.assertEqual(self.get_tile('trek', 1, 2, 0).status_code, 404)
+        self.assertEqual(self.get_tile('trek', 23, 0, 0).status_code, 404)
+
+    def test_trek_list_fields_prune_queryset(self):
+        with CaptureQueriesContext(connection) as full_queries:
+            self.get_trek_list()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get_trek_list({'fields': 'id,name'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(response.json()['results'][0].keys()), ['id', 'name'])
+        sqls = [query['sql'] for query in queries.captured_queries]
+        self.assertFalse([sql for sql in sqls if 'ST_Transform' in sql or 'ST_Length' in sql])
+        themes_table = trek_models.Trek.themes.through._meta.db_table
+        self.assertFalse([sql for sql in sqls if themes_table in sql])
+        self.assertLess(len(queries), len(full_queries))
+        # Other fields do not add queries
+        with CaptureQueriesContext(connection) as id_queries:
+            self.get_trek_list({'fields': 'id'})
+        self.assertEqual(len(id_queries), len(queries))
+
+    def test_trek_list_invalid_dim_is_2d(self):
+        response = self.get_trek_list()
+        for dim in ('1', '2d'):
+            self.assertEqual(self.get_trek_list({'dim': dim}).json(), response.json())
+
+    def test_trek_list_fields_require_queryset(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get_trek_list({'fields': 'id,themes,length_2d', 'omit': 'length_2d'})
+        self.assertEqual(sorted(response.json()['results'][0].keys()), ['id', 'themes'])
+        sqls = [query['sql'] for query in queries.captured_queries]
+        self.assertFalse([sql for sql in sqls if 'ST_Length' in sql])
+        themes_table = trek_models.Trek.themes.through._meta.db_table
+        self.assertEqual(len([sql for sql in sqls if themes_table in sql]), 1)
+
+    def test_poi_list_geometry_3d_only(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get_poi_list({'fields': 'id,geometry', 'dim': '3'})
+        self.assertEqual(len(response.json()['results'][0]['geometry']['coordinates']), 3)
+        sqls = [query['sql'] for query in queries.captured_queries]
+        self.assertTrue([sql for sql in sqls if '"geom_3d"' in sql and 'ST_Transform' in sql])
+        self.assertFalse([sql for sql in sqls if 'ST_Transform("core_topology"."geom",' in sql])
+
+    def test_trek_list_language_columns(self):
+        with mock.patch('geotrek.api.v2.viewsets.GeotrekViewset.defer_unused_columns', lambda self, qs: qs):
+            expected = self.get_trek_list({'language': 'fr'}).json()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get_trek_list({'language': 'fr', 'fields': 'id,name,description_teaser'})
+        self.assertEqual(response.json()['results'],
+                         [{key: trek[key] for key in ('id', 'name', 'description_teaser')} for trek in expected['results']])
+        trek_table = trek_models.Trek._meta.db_table
+        sql = [query['sql'] for query in queries.captured_queries if 'FROM "{}"'.format(trek_table) in query['sql']][-1]
+        self.assertIn('"name_fr"', sql)
+        self.assertIn('"description_teaser_fr"', sql)
+        self.assertNotIn('"name_it"', sql)
+        self.assertNotIn('"description_teaser_it"', sql)
+        # Large text fields which are not requested are not loaded
+        self.assertNotIn('"description_fr"', sql)
+        self.assertNotIn('"ambiance_fr"', sql)
+
+    def test_trek_detail_language_columns(self):
+        expected = self.get_trek_detail(self.treks[0].pk, {'language': 'all'}).json()
+        response = self.get_trek_detail(self.treks[0].pk, {'language': 'it'}).json()
+        self.assertEqual(response['description'], expected['description']['it'])
+        self.assertEqual(response['gpx'], expected['gpx'])
+
+    def test_poi_list_near(self):
+        poi = trek_models.POI.objects.existing().order_by('pk').last()
+        point = poi.geom.transform(settings.API_SRID, clone=True)
+        near = '{},{}'.format(point.x, point.y)
+        response = self.get_poi_list({'near': near, 'limit': 3, 'fields': 'id,distance'})
+        self.assertEqual(response.status_code, 200)
+        json_response = response.json()
+        self.assertEqual(json_response['count'], 3)
+        results = json_response['results']
+        self.assertEqual(results[0]['id'], poi.pk)
+        self.assertAlmostEqual(results[0]['distance'], 0, places=3)
+        self.assertEqual(sorted(results, key=lambda result: result['distance']), results)
+        other = trek_models.POI.objects.get(pk=results[1]['id'])
+        self.assertAlmostEqual(results[1]['distance'], other.geom.distance(poi.geom), places=3)
+        response = self.get_poi_list({'near': near, 'format': 'geojson'})
+        self.assertEqual(response.json()['count'], trek_models.POI.objects.existing().count())
+        self.assertIn('distance', response.json()['features'][0]['properties'])
+
+    def test_list_near(self):
+        point = self.content.geom.transform(settings.API_SRID, clone=True)
+        response = self.get_touristiccontent_list({'near': '{},{}'.format(point.x, point.y), 'limit': 1})
+        self.assertEqual(response.json()['results'][0]['id'], self.content.pk)
+        response = self.get_trek_list({'near': '{},{}'.format(point.x, point.y), 'limit': 2, 'omit': 'distance'})
+        self.assertEqual(len(response.json()['results']), 2)
+        self.assertNotIn('distance', response.json()['results'][0])
+        response = self.client.get(reverse('apiv2:sensitivearea-list'), {'near': '{},{}'.format(point.x, point.y)})
+        self.assertEqual(response.status_code, 200)
+        # Practices have no geometry
+        response = self.get_practices_list({'near': '{},{}'.format(point.x, point.y)})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_poi_list({'near': '1.2'}).status_code, 400)
+        self.assertEqual(self.get_poi_list({'near': '1.2,43', 'limit': 'a'}).status_code, 400)
+        self.assertEqual(self.get_poi_list({'near': '1.2,43', 'cursor': ''}).status_code, 400)
+
+    def test_trek_list_not_modified(self):
+        response = self.get_trek_list()
+        self.assertEqual(response.status_code, 200)
+        # Last update date of list does not change when elements are deleted
+        self.assertNotIn('Last-Modified', response)
+        etag = response['ETag']
+        response = self.client.get(reverse('apiv2:trek-list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        response = self.client.get(reverse('apiv2:trek-list'), {'language': 'fr'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.treks[0].save()
+        response = self.client.get(reverse('apiv2:trek-list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        last_modified = self.get_trek_detail(self.treks[0].pk)['Last-Modified']
+        response = self.client.get(reverse('apiv2:trek-list'), HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+
+    @skipIf(msgpack is None, "msgpack is not installed")
+    def test_trek_list_not_modified_depends_on_accepted_format(self):
+        etag = self.get_trek_list()['ETag']
+        response = self.client.get(reverse('apiv2:trek-list'), HTTP_IF_NONE_MATCH=etag,
+                                   HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_partial_reads_not_modified_without_aggregate(self):
+        requests = [
+            (reverse('apiv2:poi-list'), {'cursor': '', 'count': 'false', 'page_size': 10}),
+            (reverse('apiv2:poi-tile', args=(0, 0, 0)), {}),
+        ]
+        for url, params in requests:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse([query['sql'] for query in queries.captured_queries if 'MAX(' in query['sql']])
+            response = self.client.get(url, params, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(response.status_code, 304)
+
+    def test_trek_detail_not_modified(self):
+        response = self.get_trek_detail(self.treks[0].pk)
+        last_modified = response['Last-Modified']
+        response = self.client.get(reverse('apiv2:trek-detail', args=(self.treks[0].pk, )),
+                                   HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(reverse('apiv2:trek-detail', args=(self.treks[1].pk, )),
+                                   HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+
+    @mock.patch('geotrek.api.v2.cache.transaction.on_commit', lambda func: func())
+    def test_trek_detail_not_modified_depends_on_related_models(self):
+        etag = self.get_trek_detail(self.treks[0].pk)['ETag']
+        self.attachment_1.legend = 'Changed legend'
+        self.attachment_1.save()
+        response = self.client.get(reverse('apiv2:trek-detail', args=(self.treks[0].pk, )), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_poi_used_types_not_modified(self):
+        etag = self.get_poi_used_types_list()['ETag']
+        response = self.client.get(reverse('apiv2:poi-used-types'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        poi_type = trek_models.POIType.objects.first()
+        poi_type.label = 'Changed'
+        poi_type.save()
+        response = self.client.get(reverse('apiv2:poi-used-types'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_practice_list_not_modified(self):
+        etag = self.get_practices_list()['ETag']
+        response = self.client.get(reverse('apiv2:practice-list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
     def test_poi_detail(self):
         id_poi = trek_models.POI.objects.order_by('?').first().pk
         response = self.get_poi_detail(id_poi)
@@ -710,6 +1161,84 @@ class APIAccessAnonymousTestCase(BaseApiTest):
                          tourism_models.TouristicContent.objects.all().count())
 
 
+@override_settings(API_CACHE_TIMEOUT=60, CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+    'fat': settings.CACHES['fat'],
+    'api': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+})
+@mock.patch('geotrek.api.v2.cache.transaction.on_commit', lambda func: func())
+class APICacheTestCase(BaseApiTest):
+    def setUp(self):
+        caches['api'].clear()
+
+    def test_trek_list_is_cached(self):
+        response = self.get_trek_list()
+        self.assertEqual(response.status_code, 200)
+        with self.assertNumQueries(0):
+            cached_response = self.get_trek_list()
+        self.assertEqual(cached_response.status_code, 200)
+        self.assertEqual(cached_response.content, response.content)
+        self.assertEqual(cached_response['ETag'], response['ETag'])
+        self.assertEqual(cached_response['Content-Type'], response['Content-Type'])
+
+    def test_cached_response_not_modified(self):
+        etag = self.get_trek_list()['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('apiv2:trek-list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_cache_depends_on_params(self):
+        self.get_trek_list()
+        response = self.get_trek_list({'language': 'fr'})
+        self.assertIsInstance(response.json()['results'][0]['name'], str)
+
+    @skipIf(msgpack is None, "msgpack is not installed")
+    def test_cache_depends_on_accepted_format(self):
+        response = self.client.get(reverse('apiv2:trek-list'), HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertIn('Accept', response['Vary'])
+        response = self.get_trek_list()
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertIsInstance(response.json(), dict)
+
+    @override_settings(ALLOWED_HOSTS=['*'])
+    def test_cache_depends_on_host(self):
+        self.get_trek_list()
+        response = self.client.get(reverse('apiv2:trek-list'), HTTP_HOST='other.example.com')
+        self.assertIn('http://other.example.com/', response.json()['results'][0]['url'])
+        response = self.client.get(reverse('apiv2:trek-list'), secure=True)
+        self.assertTrue(response.json()['results'][0]['url'].startswith('https://'))
+
+    def test_cache_invalidated_on_save(self):
+        self.get_trek_list()
+        self.treks[0].name_en = 'Changed name'
+        self.treks[0].save()
+        response = self.get_trek_list()
+        self.assertIn(b'Changed name', response.content)
+
+    def test_cache_invalidated_on_related_change(self):
+        etag = self.get_trek_detail(self.treks[0].pk)['ETag']
+        self.attachment_1.legend = 'Changed legend'
+        self.attachment_1.save()
+        response = self.client.get(reverse('apiv2:trek-detail', args=(self.treks[0].pk, )), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['thumbnail']['legend'], 'Changed legend')
+
+    def test_cache_invalidated_on_m2m_change(self):
+        response = self.get_trek_detail(self.treks[0].pk)
+        self.assertEqual(response.json()['themes'], [{'id': self.theme.pk}])
+        self.treks[0].themes.remove(self.theme)
+        response = self.get_trek_detail(self.treks[0].pk)
+        self.assertEqual(response.json()['themes'], [])
+
+    @override_settings(API_CACHE_TIMEOUTS={'trek': 0})
+    def test_cache_disabled_by_endpoint(self):
+        self.get_trek_list()
+        with CaptureQueriesContext(connection) as context:
+            self.get_trek_list()
+        self.assertTrue(context.captured_queries)
+
+
 class APISwaggerTestCase(BaseApiTest):
     """
     TestCase for administrator API profile
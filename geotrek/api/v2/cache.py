@@ -0,0 +1,80 @@
+"""
+Versions of models used to invalidate cached API v2 responses.
+
+A version is kept in API cache for each model, and changed once the transaction
+saving or deleting instances of this model (or changing its many-to-many relations) is committed.
+"""
+from functools import lru_cache
+from uuid import uuid4
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+VERSION_KEY = 'api_version_{}'
+
+
+def get_api_cache():
+    return caches[settings.API_CACHE]
+
+
+def get_versions(models):
+    """Return versions of models, ordered by model label"""
+    cache = get_api_cache()
+    keys = sorted(VERSION_KEY.format(model._meta.label_lower) for model in models)
+    versions = cache.get_many(keys)
+    missing = {key: uuid4().hex for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, None)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+def bump_versions(models):
+    get_api_cache().set_many({VERSION_KEY.format(model._meta.label_lower): uuid4().hex for model in models}, None)
+
+
+@lru_cache(maxsize=None)
+def get_model_dependencies(model):
+    """Models whose changes can modify content of model instances: itself, parents and related models"""
+    dependencies = {model}
+    dependencies.update(model._meta.get_parent_list())
+    dependencies.update(field.related_model for field in model._meta.get_fields()
+                        if field.is_relation and field.related_model is not None)
+    return frozenset(dependencies)
+
+
+def flush_changed_models():
+    connection = transaction.get_connection()
+    models, connection.api_changed_models = connection.api_changed_models, set()
+    bump_versions(models)
+
+
+def model_changed(models):
+    connection = transaction.get_connection()
+    if not any(func == flush_changed_models for sids, func in connection.run_on_commit):
+        connection.api_changed_models = set()
+        connection.api_changed_models.update(models)
+        transaction.on_commit(flush_changed_models)
+    else:
+        connection.api_changed_models.update(models)
+
+
+def changed_models(model):
+    models = {model}
+    models.update(model._meta.get_parent_list())
+    if model._meta.label == 'core.Path':
+        # Database triggers update geometries of topologies when paths change
+        models.add(apps.get_model('core', 'Topology'))
+    return models
+
+
+def on_save_or_delete(sender, **kwargs):
+    # Versions are also used by ETags of API v2 responses, even if responses are not cached
+    model_changed(changed_models(sender))
+
+
+def on_m2m_changed(sender, instance, action, model, **kwargs):
+    if action.startswith('post_'):
+        model_changed(changed_models(instance.__class__) | changed_models(model) | {sender})
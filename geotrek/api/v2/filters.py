@@ -1,15 +1,22 @@
+from collections import OrderedDict
 from datetime import date
+import math
 import operator
 from functools import reduce
 
 from coreapi.document import Field
 from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import F, Value
 from django.db.models.query_utils import Q
-from django.contrib.gis.db.models import Union
+from django.contrib.gis.db.models import GeometryField, Union
+from django.contrib.gis.geos import Point
 from django.utils.translation import ugettext as _
+from rest_framework.exceptions import ParseError
 from rest_framework.filters import BaseFilterBackend
 from rest_framework_gis.filters import InBBOXFilter, DistanceToPointFilter
 
+from geotrek.api.v2.functions import DistanceOperator, SimplifyPreserveTopology, SnapToGrid, Transform
 from geotrek.zoning.models import City, District
 
 
@@ -25,7 +32,7 @@ class GeotrekQueryParamsFilter(BaseFilterBackend):
                                description=_("Set language for translation. 'all' by default"),
                                example="fr")
         field_format = Field(name='format', required=False,
-                             description=_("Set output format (json / geojson). JSON by default"),
+                             description=_("Set output format (json / geojson, msgpack / arrow if available). JSON by default"),
                              example="geojson")
         field_fields = Field(name='fields', required=False,
                              description=_("Limit required fields to increase performances. Ex : id,url,geometry"))
@@ -34,6 +41,167 @@ class GeotrekQueryParamsFilter(BaseFilterBackend):
         return field_dim, field_language, field_format, field_fields, field_omit
 
 
+class GeotrekSimplifyFilter(BaseFilterBackend):
+    """
+    Simplify geometries annotated on queryset (see `simplified_geometries` view attribute)
+    with a tolerance in meters (`simplify`) or matching a map zoom level (`zoom`), before transformation to API_SRID.
+    Coordinates can then be rounded to this tolerance (`quantize`), to shorten output.
+    """
+    max_zoom = 22
+    # Meters per pixel of 256px tiles at zoom level 0 (at equator)
+    zoom_0_resolution = 2 * math.pi * 6378137 / 256
+    # Meters per degree of latitude
+    degree_length = 111320
+
+    def get_tolerance(self, request):
+        simplify = request.GET.get('simplify')
+        zoom = request.GET.get('zoom')
+        try:
+            if simplify:
+                tolerance = float(simplify)
+            elif zoom:
+                zoom = int(zoom)
+                if not 0 <= zoom <= self.max_zoom:
+                    raise ValueError
+                tolerance = self.zoom_0_resolution / 2 ** zoom
+            else:
+                return None
+        except ValueError:
+            raise ParseError(_('Invalid simplify or zoom parameter'))
+        if not math.isfinite(tolerance) or tolerance < 0:
+            raise ParseError(_('Invalid simplify or zoom parameter'))
+        return tolerance
+
+    def filter_queryset(self, request, queryset, view):
+        tolerance = self.get_tolerance(request)
+        if not tolerance:
+            return queryset
+        grid_size = None
+        if request.GET.get('quantize', 'false').lower() == 'true':
+            # Largest power of ten (in degrees) below tolerance, at most 7 digits like serializers
+            digits = min(7, max(0, math.ceil(-math.log10(tolerance / self.degree_length))))
+            grid_size = 10 ** -digits
+        annotations = {}
+        for name, field in getattr(view, 'simplified_geometries', {}).items():
+            if name not in queryset.query.annotations:
+                # Geometry not requested
+                continue
+            geom = Transform(SimplifyPreserveTopology(F(field), tolerance), settings.API_SRID)
+            if grid_size is not None:
+                geom = SnapToGrid(geom, grid_size)
+            annotations[name] = geom
+        return queryset.annotate(**annotations) if annotations else queryset
+
+    def get_schema_fields(self, view):
+        field_simplify = Field(name='simplify', required=False,
+                               description=_('Simplify geometries with this tolerance in meters'),
+                               example=50, type='number')
+        field_zoom = Field(name='zoom', required=False,
+                           description=_('Simplify geometries for display at this map zoom level (0-22)'),
+                           example=10, type='integer')
+        field_quantize = Field(name='quantize', required=False,
+                               description=_('Round coordinates of simplified geometries to tolerance: true/false. '
+                                             'false by default'),
+                               example='true', type='boolean')
+        return field_simplify, field_zoom, field_quantize
+
+
+class GeotrekIdsFilter(BaseFilterBackend):
+    """
+    Keep elements whose id is in `ids` parameter (comma separated)
+    """
+    ids_query_param = 'ids'
+
+    @classmethod
+    def get_ids(cls, request, model):
+        """
+        Requested ids converted to primary key type of model, without duplicates, in requested order.
+        None if no ids are requested.
+        """
+        ids = request.query_params.get(cls.ids_query_param, '')
+        if not ids:
+            return None
+        pk_field = model._meta.pk
+        try:
+            ids = [pk_field.to_python(pk) for pk in ids.split(',')]
+        except ValidationError:
+            raise ParseError(_("Invalid ids: {}").format(request.query_params[cls.ids_query_param]))
+        return list(OrderedDict.fromkeys(ids))
+
+    def filter_queryset(self, request, queryset, view):
+        ids = self.get_ids(request, queryset.model)
+        if ids is None:
+            return queryset
+        return queryset.filter(pk__in=ids)
+
+    def get_schema_fields(self, view):
+        field_ids = Field(name=self.ids_query_param, required=False,
+                          description=_("Keep only elements with these ids (comma separated)"),
+                          example='1,3')
+        return field_ids,
+
+
+class GeotrekNearFilter(BaseFilterBackend):
+    """
+    Sort elements by distance to `near` point (LNG,LAT), and keep the `limit` nearest ones.
+    Distance in meters is annotated as `near_distance` (rendered as `distance` field).
+    Nearest elements are found with spatial index, in SRID.
+    """
+    near_param = 'near'
+    limit_param = 'limit'
+
+    def get_near_point(self, request):
+        try:
+            lng, lat = (float(value) for value in request.GET[self.near_param].split(','))
+        except ValueError:
+            raise ParseError(_('Invalid near parameter'))
+        point = Point(lng, lat, srid=settings.API_SRID)
+        point.transform(settings.SRID)
+        return point
+
+    @classmethod
+    def is_active(cls, request, view):
+        """Distance is annotated if point is given, and view elements have a geometry"""
+        if cls not in view.filter_backends or not request.GET.get(cls.near_param):
+            return False
+        try:
+            view.get_serializer_class().Meta.model._meta.get_field(getattr(view, 'near_filter_field', 'geom'))
+        except FieldDoesNotExist:
+            return False
+        return True
+
+    def filter_queryset(self, request, queryset, view):
+        if not self.is_active(request, view):
+            return queryset
+        point = self.get_near_point(request)
+        cursor_param = getattr(view.paginator, 'cursor_query_param', None)
+        if cursor_param and cursor_param in request.GET:
+            # Keyset pagination orders elements by its own keys
+            raise ParseError(_('near parameter can not be used with cursor parameter'))
+        try:
+            limit = int(request.GET.get(self.limit_param) or 0)
+        except ValueError:
+            raise ParseError(_('Invalid limit parameter'))
+        field = getattr(view, 'near_filter_field', 'geom')
+        queryset = queryset.annotate(
+            near_distance=DistanceOperator(F(field), Value(point, output_field=GeometryField(srid=settings.SRID)))
+        )
+        if limit > 0:
+            # Sorted with a limit in a subquery, so that spatial index is used and queryset can still be filtered
+            queryset = queryset.filter(pk__in=queryset.order_by('near_distance').values('pk')[:limit])
+        return queryset.order_by('near_distance', 'pk')
+
+    def get_schema_fields(self, view):
+        field_near = Field(name=self.near_param, required=False,
+                           description=_('Sort elements by distance to this point LNG,LAT. '
+                                         'Distance in meters is given in distance field. Can not be used with cursor'),
+                           example='1.2563,46.5214')
+        field_limit = Field(name=self.limit_param, required=False,
+                            description=_('Number of nearest elements to keep, with near parameter'),
+                            example=10, type='integer')
+        return field_near, field_limit
+
+
 class GeotrekInBBoxFilter(InBBOXFilter):
     """
     Override DRF gis InBBOXFilter with coreapi field descriptors
@@ -115,25 +283,42 @@ class GeotrekPublishedFilter(BaseFilterBackend):
 
 
 class GeotrekSensitiveAreaFilter(BaseFilterBackend):
+    """
+    Filter sensitive areas on their practices, structure and period of occupancy.
+    Conditions on species are tested without joins (so without duplicates to remove):
+    periods with the mask stored on areas, practices with a subquery.
+    """
     def filter_queryset(self, request, queryset, view):
         qs = queryset
         practices = request.GET.get('practices', '')
         if practices:
-            qs = qs.filter(species__practices__id__in=practices.split(','))
+            species_model = qs.model._meta.get_field('species').related_model
+            species = species_model.objects.filter(practices__id__in=practices.split(','))
+            qs = qs.filter(species_id__in=species.values('pk'))
         structure = request.GET.get('structure', '')
         if structure:
             qs = qs.filter(structure_id=structure)
         period = request.GET.get('period', '')
         if not period:
-            qs = qs.filter(**{'species__period{:02}'.format(date.today().month): True})
+            qs = self.filter_months(qs, [date.today().month])
         elif period == 'any':
-            qs = qs.filter(reduce(operator.or_, (Q(**{'species__period{:02}'.format(m): True}) for m in range(1, 13))))
+            qs = qs.filter(period_mask__gt=0)
         elif period == 'ignore':
             pass
         else:
-            months = [int(m) for m in period.split(',')]
-            qs = qs.filter(reduce(operator.or_, (Q(**{'species__period{:02}'.format(m): True}) for m in months)))
-        return qs.distinct()
+            try:
+                months = [int(m) for m in period.split(',')]
+            except ValueError:
+                raise ParseError(_('Invalid period parameter'))
+            if not all(1 <= month <= 12 for month in months):
+                raise ParseError(_('Invalid period parameter'))
+            qs = self.filter_months(qs, months)
+        return qs
+
+    def filter_months(self, queryset, months):
+        """Keep areas occupied during any of months"""
+        mask = reduce(operator.or_, (1 << (month - 1) for month in months))
+        return queryset.annotate(period_match=F('period_mask').bitand(mask)).filter(period_match__gt=0)
 
     def get_schema_fields(self, view):
         field_period = Field(name='period', required=False,
@@ -1,5 +1,5 @@
 from django.db.models import Func
-from django.db.models.fields import FloatField, CharField
+from django.db.models.fields import BinaryField, FloatField, CharField, TextField
 from django.contrib.gis.db.models import GeometryField, PointField
 
 
@@ -17,6 +17,42 @@ def Buffer(geom, radius, num_seg):
     return Func(geom, radius, num_seg, function='ST_Buffer', output_field=GeometryField())
 
 
+def SimplifyPreserveTopology(geom, tolerance):
+    """
+    ST_SimplifyPreserveTopology postgis function
+    """
+    return Func(geom, tolerance, function='ST_SimplifyPreserveTopology', output_field=GeometryField())
+
+
+def SnapToGrid(geom, size):
+    """
+    ST_SnapToGrid postgis function
+    """
+    return Func(geom, size, function='ST_SnapToGrid', output_field=GeometryField())
+
+
+def MakeEnvelope(bounds, srid):
+    """
+    ST_MakeEnvelope postgis function
+    """
+    return Func(*bounds, srid, function='ST_MakeEnvelope', output_field=GeometryField(srid=srid))
+
+
+def AsMVTGeom(geom, bounds, extent, buffer):
+    """
+    ST_AsMVTGeom postgis function.
+    Output is not a geometry field, so that it is selected as is and not converted by Django.
+    """
+    return Func(geom, bounds, extent, buffer, function='ST_AsMVTGeom', output_field=BinaryField())
+
+
+def DistanceOperator(geom, other):
+    """
+    <-> postgis operator: distance between geometries, in SRID units, using spatial index to sort
+    """
+    return Func(geom, other, arg_joiner=' <-> ', template='(%(expressions)s)', output_field=FloatField())
+
+
 def GeometryType(geom):
     """
     GeometryType postgis function
@@ -69,3 +105,44 @@ class EndPoint(Func):
     """
     function = 'ST_EndPoint'
     output_field = PointField()
+
+
+class JSONBuildObject(Func):
+    """
+    json_build_object postgres function, with alternate keys and values
+    """
+    function = 'json_build_object'
+    output_field = TextField()
+
+
+class JSONBuildArray(Func):
+    """
+    json_build_array postgres function
+    """
+    function = 'json_build_array'
+    output_field = TextField()
+
+
+class AsGeoJSON(Func):
+    """
+    ST_AsGeoJSON postgis function, as json value
+    """
+    function = 'ST_AsGeoJSON'
+    template = '%(function)s(%(expressions)s)::json'
+    output_field = TextField()
+
+
+def RoundedFloat(value, precision):
+    """
+    Float value rounded to precision digits
+    """
+    return Func(Func(value, template='%(expressions)s::numeric'), precision, function='round',
+                output_field=FloatField())
+
+
+def BBox(geom, precision):
+    """
+    Bounding box of geometry (xmin, ymin, xmax, ymax) as json array
+    """
+    return JSONBuildArray(*(RoundedFloat(Func(geom, function=function, output_field=FloatField()), precision)
+                            for function in ('ST_XMin', 'ST_YMin', 'ST_XMax', 'ST_YMax')))
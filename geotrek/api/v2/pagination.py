@@ -1,22 +1,176 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
 from collections import OrderedDict
+from functools import reduce
+import operator
 
+from coreapi.document import Field
+from django.core.exceptions import ValidationError
+from django.core.paginator import InvalidPage
+from django.db.models.query_utils import Q
+from django.utils.translation import ugettext as _, ugettext_lazy
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
 
 class StandardResultsSetPagination(PageNumberPagination):
+    """
+    Page number pagination, or keyset pagination if `cursor` parameter is given.
+    Keyset pagination avoids counting and skipping previous elements at each page:
+    the first page is requested with an empty cursor (`?cursor=`),
+    next pages with the cursor of the `next` link, which stays valid if elements are added or removed.
+    """
     page_size = 100
     page_size_query_param = 'page_size'
     max_page_size = 1000
+    cursor_query_param = 'cursor'
+    cursor_ordering_query_param = 'cursor_ordering'
+    cursor_orderings = OrderedDict([
+        ('id', ('pk', )),
+        ('date_update', ('date_update', 'pk')),
+    ])
+    count_query_param = 'count'
+    invalid_cursor_message = ugettext_lazy('Invalid cursor')
 
-    def get_paginated_response(self, data):
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_ordering = None
+        if self.cursor_query_param not in request.query_params:
+            return super(StandardResultsSetPagination, self).paginate_queryset(queryset, request, view)
+        return self.paginate_queryset_by_cursor(queryset, request)
+
+    def paginate_queryset_lazily(self, queryset, request, view=None):
+        """
+        Same as paginate_queryset, but page elements are not fetched: a sliced queryset is returned
+        """
+        self.cursor_ordering = None
+        if self.cursor_query_param in request.query_params:
+            return self.paginate_queryset_by_cursor(queryset, request, lazy=True)
+        paginator = self.django_paginator_class(queryset, self.get_page_size(request))
+        page_number = request.query_params.get(self.page_query_param, 1)
+        if page_number in self.last_page_strings:
+            page_number = paginator.num_pages
+        try:
+            self.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(page_number=page_number, message=str(exc)))
+        self.request = request
+        return self.page.object_list
+
+    def paginate_queryset_by_cursor(self, queryset, request, lazy=False):
+        self.request = request
+        self.cursor_ordering, position = self.decode_cursor(request)
+        fields = self.cursor_orderings[self.cursor_ordering]
+        if 'date_update' in fields and not hasattr(queryset.model, 'date_update'):
+            raise NotFound(self.invalid_cursor_message)
+        if self.is_uncounted(request):
+            self.cursor_count = None
+        else:
+            self.cursor_count = queryset.count()
+        queryset = queryset.order_by(*fields)
+        if position is not None:
+            queryset = self.filter_after(queryset, fields, position)
+        page_size = self.get_page_size(request)
+        if lazy:
+            # Only fetch keys of last element and of the following one
+            bounds = list(queryset.values_list(*fields)[page_size - 1:page_size + 1])
+            self.has_next = len(bounds) > 1
+            if bounds:
+                self.next_position = [self.encode_value(value) for value in bounds[0]]
+            return queryset[:page_size]
+        results = list(queryset[:page_size + 1])
+        self.has_next = len(results) > page_size
+        results = results[:page_size]
+        if results:
+            self.next_position = [self.encode_value(getattr(results[-1], field)) for field in fields]
+        return results
+
+    def is_uncounted(self, request):
+        """Keyset pagination without count only reads elements of the page"""
+        return (self.cursor_query_param in request.query_params
+                and request.query_params.get(self.count_query_param, 'true').lower() == 'false')
+
+    def decode_cursor(self, request):
+        encoded = request.query_params[self.cursor_query_param]
+        if not encoded:
+            ordering = request.query_params.get(self.cursor_ordering_query_param, 'id')
+            position = None
+        else:
+            try:
+                ordering, position = json.loads(urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            except (TypeError, ValueError):
+                raise NotFound(self.invalid_cursor_message)
+        if not isinstance(ordering, str) or ordering not in self.cursor_orderings:
+            raise NotFound(self.invalid_cursor_message)
+        if position is not None and (not isinstance(position, list)
+                                     or len(position) != len(self.cursor_orderings[ordering])):
+            raise NotFound(self.invalid_cursor_message)
+        return ordering, position
+
+    def encode_cursor(self, ordering, position):
+        return urlsafe_b64encode(json.dumps([ordering, position]).encode('utf-8')).decode('ascii')
+
+    def encode_value(self, value):
+        # Keep microseconds of datetimes, elements could be skipped otherwise
+        return value.isoformat() if hasattr(value, 'isoformat') else value
+
+    def filter_after(self, queryset, fields, position):
+        """Keep elements after position: (a, b) > (x, y) is a > x or (a = x and b > y)"""
+        filters = []
+        for i, field in enumerate(fields):
+            lookups = {'{}__gt'.format(field): position[i]}
+            lookups.update({previous: position[j] for j, previous in enumerate(fields[:i])})
+            filters.append(Q(**lookups))
+        try:
+            return queryset.filter(reduce(operator.or_, filters))
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_cursor_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param,
+                                   self.encode_cursor(self.cursor_ordering, self.next_position))
+
+    def get_envelope(self):
+        """
+        Return envelope of paginated results, and key of results in it
+        """
+        if self.cursor_ordering is None:
+            count = self.page.paginator.count
+            next_link, previous_link = self.get_next_link(), self.get_previous_link()
+        else:
+            count = self.cursor_count
+            next_link, previous_link = self.get_next_cursor_link(), None
         if self.request.query_params.get('format', 'json') == 'geojson':
-            return Response(OrderedDict([
+            return OrderedDict([
                 ('type', 'FeatureCollection'),
-                ('count', self.page.paginator.count),
-                ('next', self.get_next_link()),
-                ('previous', self.get_previous_link()),
-                ('features', data['features'])
-            ]))
+                ('count', count),
+                ('next', next_link),
+                ('previous', previous_link),
+            ]), 'features'
         else:
-            return super(StandardResultsSetPagination, self).get_paginated_response(data)
+            return OrderedDict([
+                ('count', count),
+                ('next', next_link),
+                ('previous', previous_link),
+            ]), 'results'
+
+    def get_paginated_response(self, data):
+        envelope, results_key = self.get_envelope()
+        envelope[results_key] = data['features'] if results_key == 'features' else data
+        return Response(envelope)
+
+    def get_schema_fields(self, view):
+        fields = super(StandardResultsSetPagination, self).get_schema_fields(view)
+        field_cursor = Field(name=self.cursor_query_param, required=False,
+                             description=_("Use keyset pagination: empty for first page, then value given in next link"))
+        field_cursor_ordering = Field(name=self.cursor_ordering_query_param, required=False,
+                                      description=_("Ordering of keyset pagination: id or date_update. id by default"),
+                                      example='date_update')
+        field_count = Field(name=self.count_query_param, required=False,
+                            description=_("Count elements with keyset pagination: true/false. true by default"),
+                            type='boolean', example='false')
+        return fields + [field_cursor, field_cursor_ordering, field_count]
@@ -0,0 +1,153 @@
+import json
+
+from django.conf import settings
+from django.contrib.gis.geos import GEOSGeometry, WKBWriter
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import msgpack
+except ImportError:  # Optional dependency of MessagePackRenderer
+    msgpack = None
+try:
+    import pyarrow
+except ImportError:  # Optional dependency of ArrowRenderer
+    pyarrow = None
+
+GEOJSON_GEOMETRY_TYPES = ('Point', 'LineString', 'Polygon', 'MultiPoint', 'MultiLineString', 'MultiPolygon',
+                          'GeometryCollection')
+
+
+class StreamingJSONRenderer(JSONRenderer):
+    """
+    Render a paginated list one element at a time, to keep memory flat whatever the page size
+    """
+
+    def render_stream(self, envelope, results_key, results, accepted_media_type=None, renderer_context=None,
+                      raw=False):
+        """
+        Yield envelope rendered with results at results_key (which must be its last key).
+        If raw is True, results are already rendered JSON strings.
+        """
+        head = self.render(envelope, accepted_media_type, renderer_context).rstrip()[:-1]
+        yield head + b',' + self.render(results_key) + b':['
+        for i, result in enumerate(results):
+            if raw:
+                rendered = result.encode('utf-8')
+            else:
+                rendered = self.render(result, accepted_media_type, renderer_context)
+            yield b',' + rendered if i else rendered
+        yield b']}'
+
+
+class VectorTileRenderer(BaseRenderer):
+    """
+    Mapbox vector tiles, already rendered by database (errors have no content)
+    """
+    media_type = 'application/vnd.mapbox-vector-tile'
+    format = 'mvt'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return data if isinstance(data, bytes) else b''
+
+
+class MessagePackRenderer(BaseRenderer):
+    """
+    Same content as JSON, encoded with MessagePack (requires msgpack package)
+    """
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        # Dates, decimals, lazy translations... are converted like in JSON
+        return msgpack.packb(data, default=JSONEncoder().default, use_bin_type=True)
+
+
+class ArrowRenderer(BaseRenderer):
+    """
+    Elements as an Apache Arrow table (IPC stream format, requires pyarrow package), one row per element:
+    - GeoJSON geometries are WKB encoded (geoarrow.wkb extension),
+    - other objects and lists are JSON encoded (arrow.json extension),
+    - envelope of paginated lists (count, next, previous) is stored as JSON in ``geotrek:envelope`` schema metadata.
+    """
+    media_type = 'application/vnd.apache.arrow.stream'
+    format = 'arrow'
+    charset = None
+    render_style = 'binary'
+    envelope_metadata_key = 'geotrek:envelope'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        envelope = {}
+        if isinstance(data, dict) and isinstance(data.get('results'), list):
+            envelope = {key: value for key, value in data.items() if key != 'results'}
+            rows = data['results']
+        elif isinstance(data, list):
+            rows = data
+        else:
+            rows = [data]
+        rows = [row if isinstance(row, dict) else {'value': row} for row in rows]
+        columns = []
+        for row in rows:
+            columns += [name for name in row if name not in columns]
+        fields, arrays = [], []
+        for name in columns:
+            field, array = self.build_column(name, [row.get(name) for row in rows])
+            fields.append(field)
+            arrays.append(array)
+        schema = pyarrow.schema(fields, metadata={self.envelope_metadata_key: self.encode_json(envelope)})
+        table = pyarrow.Table.from_arrays(arrays, schema=schema)
+        sink = pyarrow.BufferOutputStream()
+        writer = pyarrow.ipc.new_stream(sink, schema)
+        writer.write_table(table)
+        writer.close()
+        return sink.getvalue().to_pybytes()
+
+    def is_geometry(self, value):
+        return isinstance(value, dict) and value.get('type') in GEOJSON_GEOMETRY_TYPES
+
+    def encode_json(self, value):
+        return json.dumps(value, cls=JSONEncoder, ensure_ascii=False)
+
+    def encode_wkb(self, geometry):
+        # Default WKB output is 2D, elevations are kept if requested (dim=3)
+        return bytes(WKBWriter(dim=3 if geometry.hasz else 2).write(geometry))
+
+    def build_column(self, name, values):
+        present = [value for value in values if value is not None]
+        if present and all(self.is_geometry(value) for value in present):
+            metadata = {'ARROW:extension:name': 'geoarrow.wkb',
+                        'ARROW:extension:metadata': json.dumps({'crs': 'EPSG:{}'.format(settings.API_SRID)})}
+            values = [None if value is None else self.encode_wkb(GEOSGeometry(json.dumps(value))) for value in values]
+            return pyarrow.field(name, pyarrow.binary(), metadata=metadata), pyarrow.array(values, pyarrow.binary())
+        if any(isinstance(value, (dict, list)) for value in present):
+            values = [None if value is None else self.encode_json(value) for value in values]
+            metadata = {'ARROW:extension:name': 'arrow.json'}
+            return pyarrow.field(name, pyarrow.string(), metadata=metadata), pyarrow.array(values, pyarrow.string())
+        try:
+            array = pyarrow.array(values)
+        except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError):
+            # Mixed scalar types
+            array = pyarrow.array([None if value is None else self.encode_json(value) for value in values],
+                                  pyarrow.string())
+            return pyarrow.field(name, pyarrow.string(), metadata={'ARROW:extension:name': 'arrow.json'}), array
+        return pyarrow.field(name, array.type), array
+
+
+def get_binary_renderer_classes():
+    """
+    Binary renderers whose optional dependencies are installed
+    """
+    renderer_classes = []
+    if msgpack is not None:
+        renderer_classes.append(MessagePackRenderer)
+    if pyarrow is not None:
+        renderer_classes.append(ArrowRenderer)
+    return renderer_classes
@@ -1,17 +1,20 @@
 import json
+from functools import lru_cache
 
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
 from django.db.models import F
 from django.urls import reverse
+from django.utils.functional import cached_property
 from django.utils.translation import get_language
 from django.utils.translation import ugettext_lazy as _
-from drf_dynamic_fields import DynamicFieldsMixin
+from drf_dynamic_fields import DynamicFieldsMixin as BaseDynamicFieldsMixin
 from rest_framework import serializers
 from rest_framework.relations import HyperlinkedIdentityField
 from rest_framework_gis import serializers as geo_serializers
 
 from geotrek.api.v2.functions import Length, Length3D, Transform
+from geotrek.api.v2.sql import Column, Geometry, Translation
 from geotrek.api.v2.utils import build_url, get_translation_or_dict
 from geotrek.authent import models as authent_models
 from geotrek.common import models as common_models
@@ -29,6 +32,51 @@ if 'geotrek.zoning' in settings.INSTALLED_APPS:
     from geotrek.zoning import models as zoning_models
 
 
+class DynamicFieldsMixin(BaseDynamicFieldsMixin):
+    """
+    Filter fields according to `fields` and `omit` query parameters.
+    drf-dynamic-fields builds all fields again at each access, i.e. for each serialized object:
+    here fields are built once per serializer, and only the kept ones.
+    """
+    _field_names_cache = {}
+
+    @cached_property
+    def fields(self):
+        return super(BaseDynamicFieldsMixin, self).fields
+
+    def get_dynamic_params(self):
+        # Only filter if this is the root serializer, or if the parent is the root serializer with many=True
+        is_root = self.root == self
+        parent_is_list_root = self.parent == self.root and getattr(self.parent, 'many', False)
+        if not (is_root or parent_is_list_root):
+            return None
+        request = self.context.get('request')
+        if request is None:
+            return None
+        params = getattr(request, 'query_params', getattr(request, 'GET', None))
+        return params.get('fields'), params.get('omit')
+
+    def get_field_names(self, declared_fields, info):
+        field_names = self._field_names_cache.get(self.__class__)
+        if field_names is None:
+            field_names = super(DynamicFieldsMixin, self).get_field_names(declared_fields, info)
+            field_names = self._field_names_cache[self.__class__] = tuple(field_names)
+        params = self.get_dynamic_params()
+        if params is None:
+            return field_names
+        return filter_field_names(field_names, *params)
+
+
+@lru_cache(maxsize=1024)
+def filter_field_names(field_names, filter_fields, omit_fields):
+    """
+    Keep field names listed in filter_fields (all if empty) and not in omit_fields (comma separated)
+    """
+    allowed = set(filter(None, filter_fields.split(','))) if filter_fields else set(field_names)
+    omitted = set(filter(None, (omit_fields or '').split(',')))
+    return tuple(name for name in field_names if name in allowed and name not in omitted)
+
+
 class BaseGeoJSONSerializer(geo_serializers.GeoFeatureModelSerializer):
     """
     Mixin used to serialize geojson
@@ -49,8 +97,16 @@ def override_serializer(format_output, dimension, base_serializer_class):
     """
     Override Serializer switch output format and dimension data
     """
-    if format_output == 'geojson':
-        if dimension == '3':
+    return generate_serializer(format_output == 'geojson', dimension == '3', base_serializer_class)
+
+
+@lru_cache(maxsize=None)
+def generate_serializer(geojson, dim3, base_serializer_class):
+    """
+    Generate serializer class once per format, dimension and base class
+    """
+    if geojson:
+        if dim3:
             class GeneratedGeo3DSerializer(BaseGeoJSONSerializer,
                                            base_serializer_class):
                 geometry = geo_serializers.GeometryField(read_only=True, source='geom3d_transformed', precision=7)
@@ -70,7 +126,7 @@ def override_serializer(format_output, dimension, base_serializer_class):
 
             final_class = GeneratedGeoSerializer
     else:
-        if dimension == '3':
+        if dim3:
             class Generated3DSerializer(base_serializer_class):
                 geometry = geo_serializers.GeometryField(read_only=True, source='geom3d_transformed', precision=7)
 
@@ -264,6 +320,7 @@ if 'geotrek.tourism' in settings.INSTALLED_APPS:
         url = HyperlinkedIdentityField(view_name='apiv2:touristiccontent-detail')
         category = TouristicContentCategorySerializer()
         geometry = geo_serializers.GeometryField(read_only=True, source="geom2d_transformed", precision=7)
+        sql_fields = {'id': Column(), 'approved': Column(), 'geometry': Geometry()}
 
         class Meta:
             model = tourism_models.TouristicContent
@@ -316,6 +373,8 @@ if 'geotrek.core' in settings.INSTALLED_APPS:
         def get_length_3d(self, obj):
             return round(obj.length_3d_m, 1)
 
+        sql_fields = {'id': Column(), 'name': Column(), 'comments': Column(), 'geometry': Geometry()}
+
         class Meta:
             model = core_models.Path
             fields = ('id', 'name', 'comments', 'url', 'length_2d', 'length_3d', 'geometry')
@@ -565,6 +624,11 @@ if 'geotrek.trekking' in settings.INSTALLED_APPS:
         def get_description(self, obj):
             return get_translation_or_dict('description', self, obj)
 
+        sql_fields = {
+            'id': Column(), 'name': Translation('name'), 'description': Translation('description'),
+            'external_id': Column('eid'), 'published': Translation('published'), 'geometry': Geometry()
+        }
+
         class Meta:
             model = trekking_models.POI
             fields = (
@@ -623,7 +687,8 @@ if 'geotrek.sensitivity' in settings.INSTALLED_APPS:
             return [getattr(obj.species, 'period{:02}'.format(p)) for p in range(1, 13)]
 
         def get_practices(self, obj):
-            return obj.species.practices.values_list('id', flat=True)
+            # Prefetched with species
+            return [practice.pk for practice in obj.species.practices.all()]
 
         def get_elevation(self, obj):
             return obj.species.radius
@@ -0,0 +1,99 @@
+"""
+Render API v2 list elements as JSON directly in database.
+
+Serializers declare in their ``sql_fields`` attribute fields whose value can be built in SQL
+(columns, translated columns, geometries). If all fields requested (see ``fields`` and ``omit`` parameters)
+are declared, elements are rendered by PostgreSQL instead of Django REST framework.
+"""
+from itertools import chain
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import F, TextField, Value
+from django.db.models.functions import Cast
+from rest_framework_gis.serializers import GeoFeatureModelSerializer
+
+from geotrek.api.v2.functions import AsGeoJSON, BBox, JSONBuildObject
+
+
+class Column:
+    """
+    Model field, rendered as is
+    """
+
+    def __init__(self, name=None):
+        self.name = name
+
+    def get_expression(self, field, queryset, language):
+        return F(self.name or field.source)
+
+
+class Translation:
+    """
+    Translated model field: value in requested language, or object with all translations
+    (same as get_translation_or_dict)
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def get_expression(self, field, queryset, language):
+        languages = settings.MODELTRANSLATION_LANGUAGES if language == 'all' else [language]
+        names = ['{}_{}'.format(self.name, lang) for lang in languages]
+        try:
+            for name in names:
+                queryset.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return None
+        if language != 'all':
+            return F(names[0])
+        return JSONBuildObject(*chain.from_iterable((Value(lang), F(name)) for lang, name in zip(languages, names)))
+
+
+class Geometry:
+    """
+    Geometry field, annotated on queryset, rendered as GeoJSON geometry
+    """
+
+    def get_expression(self, field, queryset, language):
+        if field.source not in queryset.query.annotations:
+            return None
+        return AsGeoJSON(F(field.source), field.precision)
+
+
+def build_object(values):
+    return JSONBuildObject(*chain.from_iterable((Value(key), value) for key, value in values))
+
+
+def get_sql_expression(serializer, queryset, language):
+    """
+    Expression rendering serialized objects as JSON text, or None if serializer can not be rendered in database
+    :param serializer: serializer instance, with fields filtered according to request
+    :param queryset: queryset of serialized objects
+    :param language: requested language (or 'all')
+    """
+    sql_fields = getattr(serializer, 'sql_fields', None)
+    if not sql_fields:
+        return None
+    if language != 'all' and language not in settings.MODELTRANSLATION_LANGUAGES:
+        return None
+    fields = serializer.fields
+    if any(name not in sql_fields for name in fields):
+        return None
+    values = [(name, sql_fields[name].get_expression(field, queryset, language)) for name, field in fields.items()]
+    if any(value is None for _, value in values):
+        return None
+    if isinstance(serializer, GeoFeatureModelSerializer):
+        # Same structure as GeoFeatureModelSerializer, with rounded bbox (see BaseGeoJSONSerializer)
+        id_field, geo_field = serializer.Meta.id_field, serializer.Meta.geo_field
+        if id_field not in fields or geo_field not in fields:
+            return None
+        values = dict(values)
+        values = [
+            ('id', values.pop(id_field)),
+            ('type', Value('Feature')),
+            ('geometry', values.pop(geo_field)),
+            ('bbox', BBox(F(fields[geo_field].source), 7)),
+            ('properties', build_object((name, values[name]) for name in fields if name in values)),
+        ]
+    return Cast(build_object(values), TextField())
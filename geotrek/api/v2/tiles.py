@@ -0,0 +1,82 @@
+"""
+Mapbox vector tiles of API v2 resources, generated by PostGIS (ST_AsMVT).
+"""
+import math
+
+from django.contrib.gis.db.models import GeometryField
+from django.contrib.gis.geos import Polygon
+from django.core.exceptions import FieldDoesNotExist
+from django.db import connection
+from django.db.models import F, Func
+
+from geotrek.api.v2.functions import AsMVTGeom, MakeEnvelope, SimplifyPreserveTopology
+
+# Half size of the web mercator world in meters
+WEB_MERCATOR_HALF_SIZE = math.pi * 6378137
+TILE_EXTENT = 4096  # Size of tiles in their own coordinates system
+TILE_BUFFER = 64  # Geometries are clipped this far outside tiles (in tile coordinates)
+MAX_ZOOM = 22
+
+
+def tile_bounds(z, x, y):
+    """
+    Bounding box of tile in web mercator, or None if tile does not exist
+    """
+    if not 0 <= z <= MAX_ZOOM or not 0 <= x < 2 ** z or not 0 <= y < 2 ** z:
+        return None
+    size = 2 * WEB_MERCATOR_HALF_SIZE / 2 ** z
+    xmin = -WEB_MERCATOR_HALF_SIZE + x * size
+    ymax = WEB_MERCATOR_HALF_SIZE - y * size
+    return xmin, ymax - size, xmin + size, ymax
+
+
+def get_attribute_lookup(model, lookup, language):
+    """
+    Lookup of a tile attribute, in given language if the field is translated
+    """
+    *path, name = lookup.split('__')
+    for part in path:
+        model = model._meta.get_field(part).related_model
+    translated = '{}_{}'.format(name, language)
+    try:
+        model._meta.get_field(translated)
+    except FieldDoesNotExist:
+        return lookup
+    return '__'.join(path + [translated])
+
+
+def get_vector_tile(queryset, layer, geometry_field, attributes, bounds, language):
+    """
+    Render objects of queryset intersecting bounds as a vector tile layer
+    :param queryset: objects to render
+    :param layer: name of layer in tile
+    :param geometry_field: geometry field or annotation of queryset
+    :param attributes: lookups of attributes of features (scalar values only)
+    :param bounds: bounds of tile in web mercator
+    :param language: language of translated attributes
+    :return: tile content (protobuf)
+    """
+    margin = (bounds[2] - bounds[0]) * TILE_BUFFER / TILE_EXTENT
+    buffered = Polygon.from_bbox((bounds[0] - margin, bounds[1] - margin, bounds[2] + margin, bounds[3] + margin))
+    buffered.srid = 3857
+    mercator = Func(F(geometry_field), 3857, function='ST_Transform', output_field=GeometryField(srid=3857))
+    if geometry_field in queryset.query.annotations:
+        # SRID of annotations is not known by Django
+        queryset = queryset.annotate(mvt_source=mercator).filter(mvt_source__intersects=buffered)
+    else:
+        queryset = queryset.filter(**{'{}__intersects'.format(geometry_field): buffered})
+    # Details smaller than a tile pixel would be lost anyway
+    tolerance = (bounds[2] - bounds[0]) / TILE_EXTENT
+    geom = AsMVTGeom(SimplifyPreserveTopology(mercator, tolerance), MakeEnvelope(bounds, 3857), TILE_EXTENT, TILE_BUFFER)
+    annotations = {'mvt_attribute_{}'.format(i): F(get_attribute_lookup(queryset.model, lookup, language))
+                   for i, lookup in enumerate(attributes)}
+    rows = queryset.annotate(mvt_geom=geom, **annotations).values('mvt_geom', *annotations.keys())
+    sql, params = rows.query.sql_with_params()
+    columns = ', '.join(['t.mvt_geom'] + ['t.mvt_attribute_{} AS {}'.format(i, connection.ops.quote_name(lookup))
+                                          for i, lookup in enumerate(attributes)])
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT ST_AsMVT(tile, %s, {extent}, 'mvt_geom') FROM (SELECT {columns} FROM ({sql}) AS t "
+                       "WHERE t.mvt_geom IS NOT NULL) AS tile".format(extent=TILE_EXTENT, columns=columns, sql=sql),
+                       [layer] + list(params))
+        content = cursor.fetchone()[0]
+    return bytes(content) if content is not None else b''
@@ -3,6 +3,7 @@ from django.urls import path, include
 from rest_framework import routers
 
 from geotrek.api.v2 import views as api_views
+from geotrek.api.v2.renderers import VectorTileRenderer
 
 router = routers.DefaultRouter()
 router.register('structure', api_views.StructureViewSet, basename='structure')
@@ -28,8 +29,24 @@ if 'geotrek.zoning' in settings.INSTALLED_APPS:
     router.register('city', api_views.CityViewSet, basename='city')
     router.register('district', api_views.DistrictViewSet, basename='district')
 
+
+def tile_path(prefix, viewset, basename):
+    view = viewset.as_view({'get': 'tile'}, basename=basename, renderer_classes=[VectorTileRenderer])
+    return path('{}/<int:z>/<int:x>/<int:y>.mvt'.format(prefix), view, name='{}-tile'.format(basename))
+
+
+tile_urlpatterns = []
+if 'geotrek.core' in settings.INSTALLED_APPS:
+    tile_urlpatterns.append(tile_path('path', api_views.PathViewSet, 'path'))
+if 'geotrek.trekking' in settings.INSTALLED_APPS:
+    tile_urlpatterns.append(tile_path('trek', api_views.TrekViewSet, 'trek'))
+    tile_urlpatterns.append(tile_path('poi', api_views.POIViewSet, 'poi'))
+if 'geotrek.sensitivity' in settings.INSTALLED_APPS:
+    tile_urlpatterns.append(tile_path('sensitivearea', api_views.SensitiveAreaViewSet, 'sensitivearea'))
+
 app_name = 'apiv2'
 urlpatterns = [
     path('', api_views.SwaggerSchemaView.as_view(), name="schema"),
+] + tile_urlpatterns + [
     path('', include(router.urls))
 ]
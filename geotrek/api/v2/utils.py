@@ -35,3 +35,23 @@ def build_url(serializer, url):
         url = request.build_absolute_uri(url)
     else:
         raise Exception('Bad context. No server variable found in the request !')
+
+
+def iterate_queryset(queryset, chunk_size=100):
+    """
+    Iterate on queryset without fetching all elements at once.
+    A server-side cursor is used, except if related objects must be prefetched for each chunk.
+    :param queryset: queryset to iterate on
+    :param chunk_size: number of elements fetched at once
+    :return: generator of elements
+    """
+    if not queryset._prefetch_related_lookups:
+        yield from queryset.iterator(chunk_size=chunk_size)
+        return
+    start = 0
+    while True:
+        chunk = list(queryset[start:start + chunk_size])
+        yield from chunk
+        if len(chunk) < chunk_size:
+            break
+        start += chunk_size
@@ -1,12 +1,14 @@
 from django.conf import settings
-from django.db.models import F, Case, When
+from django.db.models import F
 from django_filters.rest_framework.backends import DjangoFilterBackend
+from rest_framework import decorators
 
 from geotrek.api.v2 import serializers as api_serializers, \
     viewsets as api_viewsets
-from geotrek.api.v2.functions import Transform, Buffer, GeometryType, Area
+from geotrek.api.v2.functions import Transform, Area
 from geotrek.sensitivity import models as sensitivity_models
-from ..filters import GeotrekQueryParamsFilter, GeotrekInBBoxFilter, GeotrekSensitiveAreaFilter
+from ..filters import GeotrekQueryParamsFilter, GeotrekInBBoxFilter, GeotrekSensitiveAreaFilter, GeotrekNearFilter, \
+    GeotrekIdsFilter
 
 
 class SensitiveAreaViewSet(api_viewsets.GeotrekViewset):
@@ -15,10 +17,14 @@ class SensitiveAreaViewSet(api_viewsets.GeotrekViewset):
         GeotrekQueryParamsFilter,
         GeotrekInBBoxFilter,
         GeotrekSensitiveAreaFilter,
+        GeotrekNearFilter,
+        GeotrekIdsFilter,
     )
     authentication_classes = []
-    bbox_filter_field = 'geom2d_transformed'
+    # Stored buffered geometries are indexed
+    bbox_filter_field = 'geom_buffered'
     bbox_filter_include_overlapping = True
+    tile_geometry_field = 'geom_buffered'
 
     def get_serializer_class(self):
         if 'bubble' in self.request.GET:
@@ -33,27 +39,40 @@ class SensitiveAreaViewSet(api_viewsets.GeotrekViewset):
         queryset = sensitivity_models.SensitiveArea.objects.existing() \
             .filter(published=True) \
             .select_related('species', 'structure') \
-            .prefetch_related('species__practices') \
-            .annotate(geom_type=GeometryType(F('geom')))
+            .prefetch_related('species__practices')
         if 'bubble' in self.request.GET:
             queryset = queryset.annotate(geom2d_transformed=Transform(F('geom'), settings.API_SRID))
         else:
-            queryset = queryset.annotate(geom2d_transformed=Case(
-                When(geom_type='POINT', then=Transform(Buffer(F('geom'), F('species__radius'), 4), settings.API_SRID)),
-                When(geom_type='POLYGON', then=Transform(F('geom'), settings.API_SRID)),
-                When(geom_type='MULTIPOLYGON', then=Transform(F('geom'), settings.API_SRID)),
-            ))
+            # Points buffered by radius of species, maintained by database triggers
+            queryset = queryset.annotate(geom2d_transformed=Transform(F('geom_buffered'), settings.API_SRID))
         # Ensure smaller areas are at the end of the list, ie above bigger areas on the map
         # to ensure we can select every area in case of overlapping
         # Second sort key pk is required for reliable pagination
-        queryset = queryset.annotate(area=Area('geom2d_transformed')).order_by('-area', 'pk')
+        # Areas are computed in database projection, as the index sorting them
+        queryset = queryset.annotate(area=Area('geom_buffered')).order_by('-area', 'pk')
         return queryset
 
+    def get_version_querysets(self):
+        # Radius and practices of species are rendered too
+        querysets = super(SensitiveAreaViewSet, self).get_version_querysets()
+        return querysets + [sensitivity_models.Species.objects.all(), sensitivity_models.SportPractice.objects.all()]
+
     def list(self, request, *args, **kwargs):
         response = super(SensitiveAreaViewSet, self).list(request, *args, **kwargs)
         response['Access-Control-Allow-Origin'] = '*'
         return response
 
+    def tile(self, request, *args, **kwargs):
+        response = super(SensitiveAreaViewSet, self).tile(request, *args, **kwargs)
+        response['Access-Control-Allow-Origin'] = '*'
+        return response
+
+    @decorators.action(detail=False, methods=['get'])
+    def batch(self, request, *args, **kwargs):
+        response = super(SensitiveAreaViewSet, self).batch(request, *args, **kwargs)
+        response['Access-Control-Allow-Origin'] = '*'
+        return response
+
 
 class SportPracticeViewSet(api_viewsets.GeotrekViewset):
     filter_backends = (
@@ -3,9 +3,12 @@ from django.db.models import F
 from django.db.models.aggregates import Count
 from django.http import HttpResponseRedirect
 from django.urls import reverse
+from django.utils.translation import ugettext as _
 from rest_framework import response, decorators
+from rest_framework.exceptions import ParseError
 from django_filters.rest_framework.backends import DjangoFilterBackend
 
+from geotrek.altimetry.helpers import AltimetryHelper
 from geotrek.api.v2 import serializers as api_serializers, \
     viewsets as api_viewsets, filters as api_filters
 from geotrek.api.v2.functions import Transform, Length, Length3D
@@ -18,18 +21,67 @@ class TrekViewSet(api_viewsets.GeotrekViewset):
                        api_filters.GeotrekInBBoxFilter,
                        api_filters.GeotrekDistanceToPointFilter,
                        api_filters.GeotrekPublishedFilter,
-                       api_filters.GeotrekTrekQueryParamsFilter)
+                       api_filters.GeotrekTrekQueryParamsFilter,
+                       api_filters.GeotrekSimplifyFilter,
+                       api_filters.GeotrekNearFilter,
+                       api_filters.GeotrekIdsFilter)
     serializer_class = api_serializers.TrekListSerializer
     serializer_detail_class = api_serializers.TrekDetailSerializer
     queryset = trekking_models.Trek.objects.existing() \
-        .select_related('topo_object', 'difficulty', 'practice') \
-        .prefetch_related('topo_object__aggregations', 'themes', 'accessibilities', 'networks', 'attachments') \
-        .annotate(geom2d_transformed=Transform(F('geom'), settings.API_SRID),
-                  geom3d_transformed=Transform(F('geom_3d'), settings.API_SRID),
-                  length_2d_m=Length('geom'),
-                  length_3d_m=Length3D('geom_3d')) \
         .order_by('pk')  # Required for reliable pagination
+    annotations = {
+        'geom2d_transformed': Transform(F('geom'), settings.API_SRID),
+        'geom3d_transformed': Transform(F('geom_3d'), settings.API_SRID),
+        'length_2d_m': Length('geom'),
+        'length_3d_m': Length3D('geom_3d'),
+    }
+    field_requirements = {
+        'geometry': {'annotations': ('geom{dim}d_transformed', )},
+        'length_2d': {'annotations': ('length_2d_m', )},
+        'length_3d': {'annotations': ('length_3d_m', )},
+        'difficulty': {'select_related': ('difficulty', )},
+        'practice': {'select_related': ('practice', )},
+        'update_datetime': {'select_related': ('topo_object', )},
+        'create_datetime': {'select_related': ('topo_object', )},
+        'themes': {'prefetch_related': ('themes', )},
+        'networks': {'prefetch_related': ('networks', )},
+        'accessibilities': {'prefetch_related': ('accessibilities', )},
+        'thumbnail': {'prefetch_related': ('attachments', )},
+        'pictures': {'prefetch_related': ('attachments', )},
+    }
     filterset_fields = ('difficulty', 'themes', 'networks', 'practice')
+    simplified_geometries = {'geom2d_transformed': 'geom', 'geom3d_transformed': 'geom_3d'}
+
+    @decorators.action(detail=False, methods=['get'])
+    def profiles(self, request, *args, **kwargs):
+        """
+        Get elevation profiles and limits of several treks at once.
+        Treks are selected with `ids` (comma separated) and usual filters.
+        Profiles can be downsampled to `max_points` steps.
+        """
+        ids = api_filters.GeotrekIdsFilter.get_ids(request, trekking_models.Trek)
+        if not ids:
+            raise ParseError(_("ids parameter is required"))
+        if len(ids) > settings.API_BATCH_MAX_SIZE:
+            raise ParseError(_("At most {} ids can be requested at once").format(settings.API_BATCH_MAX_SIZE))
+        try:
+            max_points = int(request.GET.get('max_points') or 0)
+        except ValueError:
+            max_points = -1
+        if max_points < 0:
+            raise ParseError(_('Invalid max_points parameter'))
+        # Selected by ids with GeotrekIdsFilter
+        qs = self.filter_queryset(self.get_queryset())
+        pks = list(qs.values_list('pk', flat=True))
+        treks = trekking_models.Trek.objects.filter(pk__in=pks).only('geom_3d', 'date_update')
+        profiles = trekking_models.Trek.get_elevation_profiles(treks)
+        data = []
+        for pk in pks:
+            if not profiles.get(pk):
+                continue
+            profile = AltimetryHelper.downsample_profile(profiles[pk], max_points)
+            data.append(dict(id=pk, **AltimetryHelper.profile_data(profile)))
+        return response.Response(data)
 
     @decorators.action(detail=False, methods=['get'])
     def practices(self, request, *args, **kwargs):
@@ -73,13 +125,25 @@ class POIViewSet(api_viewsets.GeotrekViewset):
     serializer_class = api_serializers.POIListSerializer
     serializer_detail_class = api_serializers.POIDetailSerializer
     queryset = trekking_models.POI.objects.existing() \
-        .select_related('topo_object', 'type', ) \
-        .prefetch_related('topo_object__aggregations', 'attachments') \
-        .annotate(geom2d_transformed=Transform(F('geom'), settings.API_SRID),
-                  geom3d_transformed=Transform(F('geom_3d'), settings.API_SRID)) \
         .order_by('pk')  # Required for reliable pagination
+    annotations = {
+        'geom2d_transformed': Transform(F('geom'), settings.API_SRID),
+        'geom3d_transformed': Transform(F('geom_3d'), settings.API_SRID),
+    }
+    field_requirements = {
+        'geometry': {'annotations': ('geom{dim}d_transformed', )},
+        'type': {'select_related': ('type', )},
+        'update_datetime': {'select_related': ('topo_object', )},
+        'create_datetime': {'select_related': ('topo_object', )},
+        'pictures': {'prefetch_related': ('attachments', )},
+    }
     filterset_fields = ('type',)
 
+    def get_version_querysets(self):
+        if self.action in ('all_types', 'used_types'):
+            return [trekking_models.POIType.objects.all(), trekking_models.POI.objects.existing()]
+        return super(POIViewSet, self).get_version_querysets()
+
     @decorators.action(detail=False, methods=['get'])
     def all_types(self, request, *args, **kwargs):
         """
@@ -1,24 +1,131 @@
+from collections import OrderedDict
+from datetime import date
+from hashlib import md5
+
+from django.conf import settings
+from django.contrib.gis.db.models import GeometryField
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.db.models import Count, Max, TextField
+from django.http import HttpResponse, StreamingHttpResponse
+from django.template.response import SimpleTemplateResponse
+from django.utils import translation
+from django.utils.cache import get_conditional_response, patch_vary_headers, quote_etag
+from django.utils.http import http_date
+from django.utils.translation import ugettext as _
 from django_filters.rest_framework.backends import DjangoFilterBackend
-from rest_framework import viewsets
+from rest_framework import decorators, response, serializers, viewsets
+from rest_framework.exceptions import NotFound, ParseError
 from rest_framework.authentication import BasicAuthentication, SessionAuthentication
 from rest_framework.permissions import IsAuthenticatedOrReadOnly
+from rest_framework.settings import api_settings
 from rest_framework_extensions.mixins import DetailSerializerMixin
 
 from geotrek.api.v2 import pagination as api_pagination, filters as api_filters
-from geotrek.api.v2.serializers import override_serializer
+from geotrek.api.v2.cache import get_api_cache, get_model_dependencies, get_versions
+from geotrek.api.v2.renderers import StreamingJSONRenderer, VectorTileRenderer, get_binary_renderer_classes
+from geotrek.api.v2.serializers import filter_field_names, override_serializer
+from geotrek.api.v2.sql import get_sql_expression
+from geotrek.api.v2.tiles import get_vector_tile, tile_bounds
+from geotrek.api.v2.utils import iterate_queryset
+
+if 'modeltranslation' in settings.INSTALLED_APPS:
+    from modeltranslation.translator import translator, NotRegistered
+    from modeltranslation.utils import get_language, resolution_order
+
+
+class EarlyResponse(Exception):
+    """Raised to answer without calling the action (not modified or cached response)"""
+    def __init__(self, response):
+        self.response = response
+
+
+class BatchDetailMixin(object):
+    """
+    Add a `batch` route to a viewset with detail serializer (see DetailSerializerMixin),
+    rendering details of several elements in one request
+    """
+
+    @decorators.action(detail=False, methods=['get'])
+    def batch(self, request, *args, **kwargs):
+        """
+        Details of elements selected with `ids` (comma separated) and usual filters, in requested order.
+        Requested ids which are not found are listed in `missing`.
+        """
+        queryset = self.filter_queryset(self.get_queryset())
+        ids = api_filters.GeotrekIdsFilter.get_ids(request, queryset.model)
+        if not ids:
+            raise ParseError(_("ids parameter is required"))
+        if len(ids) > settings.API_BATCH_MAX_SIZE:
+            raise ParseError(_("At most {} ids can be requested at once").format(settings.API_BATCH_MAX_SIZE))
+        # Prefetches of queryset are done once for all elements
+        found = {obj.pk: obj for obj in queryset.filter(pk__in=ids)}
+        data = self.get_serializer([found[pk] for pk in ids if pk in found], many=True).data
+        envelope = OrderedDict([
+            ('count', len(found)),
+            ('missing', [pk for pk in ids if pk not in found]),
+        ])
+        if isinstance(data, dict) and 'features' in data:
+            envelope['type'] = 'FeatureCollection'
+            envelope.move_to_end('type', last=False)
+            envelope['features'] = data['features']
+        else:
+            envelope['results'] = data
+        return response.Response(envelope)
 
+    def _is_request_to_detail_endpoint(self):
+        # Batch elements are rendered with detail serializer and queryset
+        if getattr(self, 'action', None) == 'batch':
+            return True
+        return super(BatchDetailMixin, self)._is_request_to_detail_endpoint()
 
-class GeotrekViewset(DetailSerializerMixin, viewsets.ReadOnlyModelViewSet):
+
+class GeotrekViewset(BatchDetailMixin, DetailSerializerMixin, viewsets.ReadOnlyModelViewSet):
     filter_backends = (DjangoFilterBackend,
                        api_filters.GeotrekQueryParamsFilter,
                        api_filters.GeotrekInBBoxFilter,
                        api_filters.GeotrekDistanceToPointFilter,
-                       api_filters.GeotrekPublishedFilter)
+                       api_filters.GeotrekPublishedFilter,
+                       api_filters.GeotrekNearFilter,
+                       api_filters.GeotrekIdsFilter)
     distance_filter_field = 'geometry'
     distance_filter_convert_meters = True
     pagination_class = api_pagination.StandardResultsSetPagination
     permission_classes = [IsAuthenticatedOrReadOnly]
     authentication_classes = [BasicAuthentication, SessionAuthentication]
+    cached_headers = ('Content-Type', 'Access-Control-Allow-Origin')
+    # Binary formats (format=msgpack, format=arrow) are available if their optional dependencies are installed
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + get_binary_renderer_classes()
+    tile_geometry_field = 'geom'
+    # Annotations which can be required by serializer fields, by name
+    annotations = {}
+    # Annotations, joins and prefetches required by serializer fields, ex:
+    # {'geometry': {'annotations': ('geom{dim}d_transformed', )}, 'themes': {'prefetch_related': ('themes', )}}
+    # Names of annotations are formatted with requested dimension (dim).
+    field_requirements = {}
+
+    def get_queryset(self):
+        """
+        Add to queryset only annotations, joins and prefetches required by requested fields
+        """
+        queryset = self.defer_unused_columns(super(GeotrekViewset, self).get_queryset())
+        if not self.field_requirements:
+            return queryset
+        # Same as override_serializer: any dimension other than 3 is 2D
+        dim = '3' if self.request.query_params.get('dim') == '3' else '2'
+        annotations, select_related, prefetch_related = [], [], []
+        for name in self.get_serializer().fields:
+            requirements = self.field_requirements.get(name, {})
+            annotations += [annotation.format(dim=dim) for annotation in requirements.get('annotations', ())]
+            select_related += requirements.get('select_related', [])
+            prefetch_related += requirements.get('prefetch_related', [])
+        if annotations:
+            queryset = queryset.annotate(**{name: self.annotations[name] for name in annotations})
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        if prefetch_related:
+            queryset = queryset.prefetch_related(*prefetch_related)
+        return queryset
 
     def get_serializer_class(self):
         base_serializer_class = super(GeotrekViewset, self).get_serializer_class()
@@ -26,8 +133,236 @@ class GeotrekViewset(DetailSerializerMixin, viewsets.ReadOnlyModelViewSet):
         dimension = self.request.query_params.get('dim', '2')
         return override_serializer(format_output, dimension, base_serializer_class)
 
+    def get_serializer(self, *args, **kwargs):
+        serializer = super(GeotrekViewset, self).get_serializer(*args, **kwargs)
+        if api_filters.GeotrekNearFilter.is_active(self.request, self):
+            # Distance to near point is annotated by GeotrekNearFilter
+            child = getattr(serializer, 'child', serializer)
+            get_dynamic_params = getattr(child, 'get_dynamic_params', lambda: None)
+            if filter_field_names(('distance', ), *(get_dynamic_params() or (None, None))):
+                child.fields['distance'] = serializers.FloatField(source='near_distance', read_only=True)
+        return serializer
+
     def get_serializer_context(self):
         return {
             'request': self.request,
             'kwargs': self.kwargs
         }
+
+    def list(self, request, *args, **kwargs):
+        if request.accepted_renderer.format not in ('json', 'geojson'):
+            return super(GeotrekViewset, self).list(request, *args, **kwargs)
+        response = self.list_in_database(request)
+        if response is not None:
+            return response
+        page_size = self.paginator.get_page_size(request)
+        if page_size < settings.API_STREAMING_PAGE_SIZE:
+            return super(GeotrekViewset, self).list(request, *args, **kwargs)
+        # Large pages are serialized and sent one element at a time
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginator.paginate_queryset_lazily(queryset, request, view=self)
+        serializer = self.get_serializer(page, many=True).child
+        envelope, results_key = self.paginator.get_envelope()
+        results = (serializer.to_representation(obj) for obj in iterate_queryset(page))
+        renderer = StreamingJSONRenderer()
+        content = renderer.render_stream(envelope, results_key, results,
+                                         request.accepted_media_type, self.get_renderer_context())
+        return StreamingHttpResponse(content, content_type=renderer.media_type)
+
+    def list_in_database(self, request):
+        """
+        Render page elements as JSON in database if all requested fields allow it (see geotrek.api.v2.sql),
+        return None otherwise
+        """
+        expression = get_sql_expression(self.get_serializer(), self.get_queryset(),
+                                        request.query_params.get('language', 'all'))
+        if expression is None:
+            return None
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginator.paginate_queryset_lazily(queryset, request, view=self)
+        # Related objects are not rendered, no need to prefetch them
+        results = page.prefetch_related(None).annotate(api_json=expression).values_list('api_json', flat=True)
+        envelope, results_key = self.paginator.get_envelope()
+        renderer = StreamingJSONRenderer()
+        content = renderer.render_stream(envelope, results_key, results, request.accepted_media_type,
+                                         self.get_renderer_context(), raw=True)
+        return HttpResponse(b''.join(content), content_type=renderer.media_type)
+
+    def defer_unused_columns(self, queryset):
+        """
+        If a language is requested, do not load translated columns of other languages
+        (except fallback ones), nor large text columns of fields which are not requested in lists
+        """
+        language = self.request.query_params.get('language', 'all')
+        if 'modeltranslation' not in settings.INSTALLED_APPS or language not in settings.MODELTRANSLATION_LANGUAGES:
+            return queryset
+        try:
+            translated = translator.get_options_for_model(queryset.model).fields
+        except NotRegistered:
+            translated = {}
+        # Translated fields descriptors read active language, with fallback
+        languages = set(resolution_order(language)) | set(resolution_order(get_language()))
+        deferred = {field.name for fields in translated.values() for field in fields if field.language not in languages}
+        if self.action == 'list':
+            requested = set(self.get_serializer().fields)
+            for field in queryset.model._meta.concrete_fields:
+                name = getattr(field, 'translated_field', field).name
+                # Original fields of translated ones can not be deferred (queryset would defer a translation)
+                if isinstance(field, TextField) and name not in requested and field.name not in translated:
+                    deferred.add(field.name)
+        return queryset.defer(*deferred) if deferred else queryset
+
+    def tile(self, request, z, x, y, *args, **kwargs):
+        """
+        Mapbox vector tile of filtered elements, with attributes set in API_VECTOR_TILES_ATTRIBUTES
+        """
+        bounds = tile_bounds(int(z), int(x), int(y))
+        if bounds is None:
+            raise NotFound()
+        language = request.query_params.get('language')
+        if language not in settings.MODELTRANSLATION_LANGUAGES:
+            language = settings.MODELTRANSLATION_DEFAULT_LANGUAGE
+        queryset = self.filter_queryset(self.get_queryset())
+        attributes = settings.API_VECTOR_TILES_ATTRIBUTES.get(self.basename, ('id', ))
+        content = get_vector_tile(queryset, self.basename, self.tile_geometry_field, attributes, bounds, language)
+        return HttpResponse(content, content_type=VectorTileRenderer.media_type)
+
+    def get_version_querysets(self):
+        """
+        Querysets whose content is rendered by current action, used to compute response validators
+        """
+        queryset = self.filter_queryset(self.get_queryset())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        if lookup_url_kwarg in self.kwargs:
+            queryset = queryset.filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        return [queryset]
+
+    def get_version_models(self):
+        """
+        Models whose changes can modify content rendered by current action
+        """
+        models = set()
+        for queryset in self.get_version_querysets():
+            models |= get_model_dependencies(queryset.model)
+        return models
+
+    def get_queryset_version(self, queryset):
+        """
+        Cheap version of queryset content: last update date and count,
+        or checksum of rows (without geometries) if model has no update date.
+        """
+        queryset = queryset.order_by()
+        model = queryset.model
+        if hasattr(model, 'date_update'):
+            version = model._base_manager.filter(pk__in=queryset.values('pk')) \
+                .aggregate(last_update=Max('date_update'), count=Count('pk'))
+            return version['last_update'], version['count']
+        columns = [field.attname for field in model._meta.concrete_fields if not isinstance(field, GeometryField)]
+        sql, params = queryset.values_list(*columns).order_by('pk').query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT md5(string_agg(CAST(t AS text), ',')), COUNT(*) FROM ({}) AS t".format(sql), params)
+            checksum, count = cursor.fetchone()
+        return None, '{}-{}'.format(checksum, count)
+
+    def is_partial_read(self, request):
+        """
+        Whether current action only reads a small part of filtered elements: vector tiles and uncounted keyset pages
+        """
+        if self.action == 'tile':
+            return True
+        return self.action == 'list' and self.paginator is not None and self.paginator.is_uncounted(request)
+
+    def get_validators(self, request):
+        """
+        ETag and last modification date of response, computed without serializing anything
+        """
+        if self.is_partial_read(request):
+            # Aggregating all filtered elements would cost more than the action: only versions of models are used
+            # (changed by any save or delete), with current date used by some filters (periods of sensitive areas)
+            versions = [(None, date.today())]
+        else:
+            try:
+                versions = [self.get_queryset_version(queryset) for queryset in self.get_version_querysets()]
+            except (TypeError, ValueError, ValidationError):
+                # Invalid lookup, let the action handle it
+                return None, None
+        dates = [last_update for last_update, _ in versions if last_update is not None]
+        last_modified = max(dates) if len(dates) == len(versions) else None
+        if (self.lookup_url_kwarg or self.lookup_field) not in self.kwargs:
+            # Last update date of lists does not change when an element is deleted or unpublished, only ETag does
+            last_modified = None
+        # Format can be negotiated with Accept header instead of format parameter.
+        # Related models (difficulty, pictures...) are rendered but do not change the version of querysets.
+        key = [self.__class__.__name__, self.action, request.path, request.accepted_renderer.format,
+               translation.get_language(), sorted(request.query_params.lists()),
+               [(str(last_update), str(count)) for last_update, count in versions],
+               get_versions(self.get_version_models())]
+        etag = quote_etag(md5(repr(key).encode('utf-8')).hexdigest())
+        return etag, last_modified
+
+    def get_cache_timeout(self):
+        return settings.API_CACHE_TIMEOUTS.get(getattr(self, 'basename', None), settings.API_CACHE_TIMEOUT)
+
+    def get_cache_key(self, request):
+        """
+        Key of response in API cache, changed when a model rendered by current action changes
+        """
+        # Responses contain absolute URLs
+        key = [self.__class__.__name__, self.action, request.scheme, request.get_host(), request.path,
+               request.accepted_renderer.format, translation.get_language(), sorted(request.query_params.lists()),
+               get_versions(self.get_version_models())]
+        return 'api_response_{}'.format(md5(repr(key).encode('utf-8')).hexdigest())
+
+    def get_cached_response(self, request, cached):
+        content, headers, self.etag, self.last_modified = cached
+        timestamp = int(self.last_modified.timestamp()) if self.last_modified else None
+        response = get_conditional_response(request, etag=self.etag, last_modified=timestamp)
+        if response is None:
+            response = HttpResponse(content)
+            for name, value in headers.items():
+                response[name] = value
+        return response
+
+    def cache_response(self, response):
+        headers = {name: response[name] for name in self.cached_headers if response.has_header(name)}
+        get_api_cache().set(self.cache_key, (response.content, headers, self.etag, self.last_modified),
+                            self.get_cache_timeout())
+
+    def initial(self, request, *args, **kwargs):
+        super(GeotrekViewset, self).initial(request, *args, **kwargs)
+        self.etag, self.last_modified, self.cache_key = None, None, None
+        if request.method not in ('GET', 'HEAD'):
+            return
+        # Browsable API is not cached, it shows current user
+        if self.get_cache_timeout() and request.accepted_renderer.format != 'api':
+            self.cache_key = self.get_cache_key(request)
+            cached = get_api_cache().get(self.cache_key)
+            if cached is not None:
+                self.cache_key = None
+                raise EarlyResponse(self.get_cached_response(request, cached))
+        self.etag, self.last_modified = self.get_validators(request)
+        if self.etag is None:
+            return
+        timestamp = int(self.last_modified.timestamp()) if self.last_modified else None
+        response = get_conditional_response(request, etag=self.etag, last_modified=timestamp)
+        if response is not None:
+            raise EarlyResponse(response)
+
+    def handle_exception(self, exc):
+        if isinstance(exc, EarlyResponse):
+            return exc.response
+        return super(GeotrekViewset, self).handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super(GeotrekViewset, self).finalize_response(request, response, *args, **kwargs)
+        patch_vary_headers(response, ('Accept', ))
+        if response.status_code in (200, 304) and getattr(self, 'etag', None):
+            response['ETag'] = self.etag
+            if self.last_modified:
+                response['Last-Modified'] = http_date(self.last_modified.timestamp())
+        if getattr(self, 'cache_key', None) and response.status_code == 200:
+            if isinstance(response, SimpleTemplateResponse):
+                response.add_post_render_callback(self.cache_response)
+            elif not response.streaming:
+                self.cache_response(response)
+        return response
@@ -9,6 +9,7 @@ from geotrek.common.utils.testdata import (dummy_filefield_as_sequence,
 
 from . import models
 
+from geotrek.common.helpers_sync import SyncManifest
 from geotrek.common.management.commands.sync_rando import Command
 
 from django.test.client import RequestFactory
@@ -23,6 +24,8 @@ class FakeSyncCommand(Command):
     with_signages = True
     with_events = True
     rando_url = 'localhost:3000'
+    referer = 'https://localhost:8000'
+    languages = ('en', 'fr')
 
     def __init__(self, portal='', source='', skip_dem=False, skip_pdf=False, skip_profile_png=False):
         super(FakeSyncCommand, self).__init__(stdout=None, stderr=None, no_color=False, force_color=False)
@@ -40,6 +43,8 @@ class FakeSyncCommand(Command):
         self.skip_dem = skip_dem
         self.skip_pdf = skip_pdf
         self.skip_profile_png = skip_profile_png
+        self.successfull = True
+        self.manifest = SyncManifest(self.dst_root, self.tmp_root, [], full=True)
 
 
 class OrganismFactory(factory.DjangoModelFactory):
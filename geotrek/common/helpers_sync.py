@@ -1,7 +1,16 @@
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
 import logging
+import os
 import re
+import threading
+import time
 
 from django.conf import settings
+from django.contrib.gis.geos import GEOSGeometry
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models.fields.files import FieldFile
 from landez import TilesManager
 from landez.sources import DownloadError
 
@@ -10,13 +19,94 @@ from geotrek.common import views
 
 logger = logging.getLogger(__name__)
 
+# Content hashes of files generated by previous sync, used to reuse unchanged files
+MANIFEST_NAME = 'manifest.json'
+
+
+def write_file_atomically(path, content):
+    """Write file at once: it can be read or written by other threads or processes at the same time"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partname = '{}.{}.{}.part'.format(path, os.getpid(), threading.get_ident())
+    with open(partname, 'wb') as f:
+        f.write(content)
+    os.replace(partname, path)
+
+
+class TileStore(object):
+    """
+    Tiles downloaded by previous syncs, shared by sync_rando and sync_mobile.
+    Contents are stored once by hash (many tiles are identical: sea, blank areas...),
+    tiles of a layer refer to their content and expire after ttl seconds.
+    """
+
+    def __init__(self, folder, layer, ttl):
+        self.folder = folder
+        self.layer = hashlib.sha1(layer.encode('utf-8')).hexdigest()
+        self.ttl = ttl
+
+    def tile_path(self, tile):
+        return os.path.join(self.folder, 'layers', self.layer, *[str(i) for i in tile])
+
+    def content_path(self, digest):
+        return os.path.join(self.folder, 'contents', digest[:2], digest)
+
+    def get(self, tile):
+        """Content of tile, None if it is not stored or expired"""
+        path = self.tile_path(tile)
+        try:
+            if time.time() - os.path.getmtime(path) >= self.ttl:
+                return None
+            with open(path) as f:
+                digest = f.read()
+            with open(self.content_path(digest), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def set(self, tile, content):
+        digest = hashlib.sha1(content).hexdigest()
+        try:
+            # Content is kept as long as the most recent tile referring to it
+            os.utime(self.content_path(digest))
+        except FileNotFoundError:
+            write_file_atomically(self.content_path(digest), content)
+        write_file_atomically(self.tile_path(tile), digest.encode('ascii'))
+
+    @staticmethod
+    def purge(folder, ttl):
+        """Remove expired tiles and contents of all layers, returns the number of removed files"""
+        removed = 0
+        expiry = time.time() - ttl
+        for subfolder in ('layers', 'contents'):
+            for dirpath, dirnames, filenames in os.walk(os.path.join(folder, subfolder), topdown=False):
+                for filename in filenames:
+                    path = os.path.join(dirpath, filename)
+                    try:
+                        if os.path.getmtime(path) < expiry:
+                            os.remove(path)
+                            removed += 1
+                    except FileNotFoundError:
+                        pass
+                if dirpath != os.path.join(folder, subfolder):
+                    try:
+                        os.rmdir(dirpath)  # Only if empty
+                    except OSError:
+                        pass
+        return removed
+
 
 class ZipTilesBuilder(object):
+    # Tiles fetched at once, to bound memory used by tiles waiting to be written in zip file
+    chunk_size = 256
+
     def __init__(self, zipfile, prefix="", **builder_args):
         self.zipfile = zipfile
         self.prefix = prefix
         builder_args['tile_format'] = self.format_from_url(builder_args['tiles_url'])
+        # Tiles are kept in store instead of landez cache, which is not safe with several threads
+        builder_args['cache'] = False
         self.tm = TilesManager(**builder_args)
+        layers = [builder_args['tiles_url']]
 
         if not isinstance(settings.MOBILE_TILES_URL, str) and len(settings.MOBILE_TILES_URL) > 1:
             for url in settings.MOBILE_TILES_URL[1:]:
@@ -24,7 +114,9 @@ class ZipTilesBuilder(object):
                 args['tiles_url'] = url
                 args['tile_format'] = self.format_from_url(args['tiles_url'])
                 self.tm.add_layer(TilesManager(**args), opacity=1)
+                layers.append(url)
 
+        self.store = TileStore(builder_args['tiles_dir'], ' '.join(layers), settings.MOBILE_TILES_TTL)
         self.tiles = set()
 
     def format_from_url(self, url):
@@ -41,19 +133,141 @@ class ZipTilesBuilder(object):
     def add_coverage(self, bbox, zoomlevels):
         self.tiles |= set(self.tm.tileslist(bbox, zoomlevels))
 
-    def run(self):
-        for tile in self.tiles:
-            name = '{prefix}{0}/{1}/{2}{ext}'.format(
-                *tile,
-                prefix=self.prefix,
-                ext=settings.MOBILE_TILES_EXTENSION or self.tm._tile_extension
-            )
+    def fetch(self, tile):
+        """Content of tile from store, or downloaded (retried later if it fails)"""
+        content = self.store.get(tile)
+        if content is not None:
+            return content
+        for retry in range(settings.MOBILE_TILES_RETRIES + 1):
             try:
-                data = self.tm.tile(tile)
+                content = self.tm.tile(tile)
+                break
             except DownloadError:
-                logger.warning("Failed to download tile %s" % name)
-            else:
-                self.zipfile.writestr(name, data)
+                if retry == settings.MOBILE_TILES_RETRIES:
+                    raise
+                time.sleep(settings.MOBILE_TILES_RETRY_DELAY * 2 ** retry)
+        self.store.set(tile, content)
+        return content
+
+    def run(self):
+        tiles = sorted(self.tiles)
+        with ThreadPoolExecutor(max_workers=settings.MOBILE_TILES_WORKERS) as executor:
+            for i in range(0, len(tiles), self.chunk_size):
+                chunk = tiles[i:i + self.chunk_size]
+                futures = [executor.submit(self.fetch, tile) for tile in chunk]
+                for tile, future in zip(chunk, futures):
+                    name = '{prefix}{0}/{1}/{2}{ext}'.format(
+                        *tile,
+                        prefix=self.prefix,
+                        ext=settings.MOBILE_TILES_EXTENSION or self.tm._tile_extension
+                    )
+                    try:
+                        data = future.result()
+                    except DownloadError:
+                        logger.warning("Failed to download tile %s" % name)
+                    else:
+                        self.zipfile.writestr(name, data)
+
+
+class ManifestEncoder(DjangoJSONEncoder):
+    """Encode dependencies of files: geometries as hashes, files as names, other objects as representations"""
+
+    def default(self, o):
+        if isinstance(o, GEOSGeometry):
+            return hashlib.md5(bytes(o.ewkb)).hexdigest()
+        if isinstance(o, FieldFile):
+            return o.name
+        if isinstance(o, (set, frozenset)):
+            return sorted(o, key=str)
+        try:
+            return super().default(o)
+        except TypeError:
+            # Memory addresses change at each run
+            return re.sub(r' at 0x[0-9a-f]+', '', repr(o))
+
+
+def get_file_hash(path):
+    """Hash of content of file, None if it does not exist"""
+    if not os.path.isfile(path):
+        return None
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+class SyncManifest:
+    """
+    Hashes of content which files of a sync were generated from, stored in destination directory.
+    Files of previous sync whose hash did not change are hard linked instead of being generated again.
+    """
+
+    def __init__(self, dst_root, tmp_root, fingerprint, full=False):
+        """
+        :param fingerprint: options and settings used to generate all files
+        :param full: ignore previous sync, all files are generated
+        """
+        self.dst_root = dst_root
+        self.tmp_root = tmp_root
+        self.fingerprint = None
+        self.fingerprint = self.get_hash(fingerprint)
+        self.previous = {} if full else self.load()
+        self.entries = {}
+
+    def load(self):
+        try:
+            with open(os.path.join(self.dst_root, MANIFEST_NAME)) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def write(self):
+        with open(os.path.join(self.tmp_root, MANIFEST_NAME), 'w') as f:
+            json.dump(self.entries, f, cls=ManifestEncoder)
+
+    def get_hash(self, *dependencies):
+        """Hash of dependencies of files, and of fingerprint of sync"""
+        # Keys of dictionaries which are not strings or numbers (in settings) are ignored
+        content = json.dumps([self.fingerprint, dependencies], cls=ManifestEncoder, skipkeys=True)
+        return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+    def entry(self, key, paths, **extra):
+        """Manifest entry of files (or directories) generated from content with given hash"""
+        entry = {
+            'hash': key,
+            'paths': [path for path in paths if os.path.exists(os.path.join(self.tmp_root, path))],
+        }
+        entry.update(extra)
+        return entry
+
+    def link_path(self, name):
+        """Hard link file or directory of previous sync into new one"""
+        src = os.path.join(self.dst_root, name)
+        if os.path.isdir(src):
+            for filename in os.listdir(src):
+                self.link_path(os.path.join(name, filename))
+            return
+        dst = os.path.join(self.tmp_root, name)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        try:
+            os.link(src, dst)
+        except FileExistsError:
+            # Already generated or linked by another object
+            pass
+
+    def reuse(self, name, key):
+        """Hard link files of previous sync if they were generated from the same content.
+        Returns manifest entry of previous sync, None if files can not be reused.
+        """
+        previous = self.previous.get(name)
+        if not previous or previous['hash'] != key:
+            return None
+        if not all(os.path.exists(os.path.join(self.dst_root, path)) for path in previous['paths']):
+            return None
+        for path in previous['paths']:
+            self.link_path(path)
+        return previous
 
 
 class SyncRando:
@@ -1,6 +1,9 @@
 import argparse
+from collections import OrderedDict
 import logging
 import filecmp
+from itertools import chain
+from multiprocessing import Pool
 import os
 import shutil
 from time import sleep
@@ -8,7 +11,9 @@ from zipfile import ZipFile
 
 from django.conf import settings
 from django.contrib.auth.models import AnonymousUser
+from django.core.management import call_command
 from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
 from django.db.models import Q
 from django.http import StreamingHttpResponse
 from django.test.client import RequestFactory
@@ -16,6 +21,8 @@ from django.utils import translation
 from django.utils.translation import ugettext as _
 
 from geotrek.common.models import FileType  # NOQA
+from geotrek.altimetry.helpers import AltimetryHelper
+from geotrek.authent import models as authent_models
 from geotrek.altimetry.views import ElevationProfile, ElevationArea, serve_elevation_chart
 from geotrek.common import models as common_models
 
@@ -23,12 +30,14 @@ from geotrek.tourism import models as tourism_models
 from geotrek.trekking import models as trekking_models
 
 from geotrek.common import helpers_sync as common_sync
+from geotrek.common.helpers_sync import MANIFEST_NAME, SyncManifest, get_file_hash
 from geotrek.trekking import helpers_sync as trekking_sync
 
 if 'geotrek.diving' in settings.INSTALLED_APPS:
     from geotrek.diving import helpers_sync as diving_sync
 if 'geotrek.sensitivity' in settings.INSTALLED_APPS:
     from geotrek.sensitivity import helpers_sync as sensitivity_sync
+    from geotrek.sensitivity import models as sensitivity_models
 if 'geotrek.signage' in settings.INSTALLED_APPS:
     from geotrek.signage import helpers_sync as signage_sync
 if 'geotrek.infrastructure' in settings.INSTALLED_APPS:
@@ -46,8 +55,60 @@ from geotrek.tourism import urls  # NOQA
 
 logger = logging.getLogger(__name__)
 
+# Command running tasks in a worker process
+worker_command = None
+
+
+class ZipEntries:
+    """
+    Files to add to a zip file, recorded by worker processes: zip files of main process can not be written by them
+    """
+
+    def __init__(self):
+        self.entries = []
+
+    def namelist(self):
+        return [arcname for filename, arcname in self.entries]
+
+    def write(self, filename, arcname):
+        self.entries.append((filename, arcname))
+
+
+def close_connections():
+    # Each worker process must open its own database connection
+    connections.close_all()
+
+
+def init_worker(command):
+    global worker_command
+    close_connections()
+    worker_command = command
+
+
+def run_task(task):
+    return worker_command.run_task(*task)
+
+
+def get_view_key(view):
+    """Class and arguments of a view returned by as_view(), or view itself if it is a function"""
+    cls = getattr(view, 'cls', None) or getattr(view, 'view_class', None)
+    if cls is None:
+        return view
+    initkwargs = getattr(view, 'initkwargs', None) or getattr(view, 'view_initkwargs', {})
+    return cls, repr(sorted(initkwargs.items())), repr(sorted((getattr(view, 'actions', None) or {}).items()))
+
 
 class Command(BaseCommand):
+    pool = None
+    # Files generated by current task, relative to tmp_root
+    generated_files = None
+
+    def __init__(self, *args, **kwargs):
+        super(Command, self).__init__(*args, **kwargs)
+        # Files rendered during this run, by view, url, params, language and view arguments
+        self.rendered_views = {}
+        self.saved_renders = 0
+
     def add_arguments(self, parser):
         parser.add_argument('path')
         parser.add_argument('--url', '-u', dest='url', default='http://localhost', help='Base url')
@@ -75,12 +136,16 @@ class Command(BaseCommand):
                             default=False, help='include infrastructures')
         parser.add_argument('--with-dives', action='store_true', dest='with_dives',
                             default=False, help='include dives')
+        parser.add_argument('--jobs', '-j', type=int, dest='jobs', default=1,
+                            help='Number of parallel workers computing DEM files, tiles and treks details')
+        parser.add_argument('--full', action='store_true', dest='full', default=False,
+                            help='Generate all files, even those of unchanged objects')
         parser.add_argument('--task', default=None, help=argparse.SUPPRESS)
 
     def mkdirs(self, name):
         dirname = os.path.dirname(name)
-        if not os.path.exists(dirname):
-            os.makedirs(dirname)
+        # Workers can create the same directory at the same time
+        os.makedirs(dirname, exist_ok=True)
 
     def get_params_portal(self, params):
         if self.portal:
@@ -144,12 +209,112 @@ class Command(BaseCommand):
         tiles.run()
         self.close_zip(zipfile, zipname)
 
+    def add_generated_file(self, name):
+        if self.generated_files is not None:
+            self.generated_files.append(name)
+
+    def sync_incrementally(self, name, key, sync, obj=None):
+        """Call sync() to generate files, unless files generated from the same content by previous sync
+        can be reused. Generated files, their hashes and files added to current zip file are stored in manifest.
+        :param name: name of manifest entry
+        :param key: hash of content used to generate files
+        :param obj: source object of files
+        """
+        previous = self.manifest.reuse(name, key)
+        if previous:
+            for arcname in previous['zip']:
+                self.zipfile.write(os.path.join(self.tmp_root, arcname), arcname)
+            self.manifest.entries[name] = previous
+            if self.verbosity == 2:
+                self.stdout.write("{name} unchanged".format(name=name))
+            return
+        zip_names = set(self.zipfile.namelist()) if self.zipfile else set()
+        self.generated_files = []
+        try:
+            sync()
+            files = list(OrderedDict.fromkeys(self.generated_files))
+        finally:
+            self.generated_files = None
+        if not self.successfull:
+            return
+        self.manifest.entries[name] = self.manifest.entry(
+            key, files,
+            source='{}.{}'.format(obj._meta.label_lower, obj.pk) if obj else None,
+            date_update=getattr(obj, 'date_update', None),
+            output={path: get_file_hash(os.path.join(self.tmp_root, path)) for path in files},
+            zip=[arcname for arcname in self.zipfile.namelist() if arcname not in zip_names] if self.zipfile else [],
+        )
+
+    def sync_global_tiles_incrementally(self):
+        name = os.path.join('zip', 'tiles', 'global')
+        self.sync_incrementally(name, self.manifest.get_hash(name), self.sync_global_tiles)
+
+    def sync_trek_tiles_by_pk(self, pk):
+        trek = trekking_models.Trek.objects.get(pk=pk)
+        name = os.path.join('zip', 'tiles', str(pk))
+        self.sync_incrementally(name, self.manifest.get_hash(name, trek.geom), lambda: self.sync_trek_tiles(trek),
+                                obj=trek)
+
+    def sync_trek_detail(self, lang, pk):
+        translation.activate(lang)
+        trek = trekking_models.Trek.objects.get(pk=pk)
+        name = os.path.join('api', lang, 'treks', str(pk))
+        key = self.manifest.get_hash(name, self.get_trek_dependencies(trek))
+        self.sync_incrementally(name, key, lambda: trekking_sync.SyncRando(self).sync_detail(lang, trek), obj=trek)
+
+    def run_task(self, method, args):
+        """Run a task (name of method and its arguments) with its own success, current zip file, manifest
+        entries and count of saved renders, and return them: worker processes can not change those of main process.
+        """
+        state = self.successfull, self.zipfile, self.manifest.entries, self.saved_renders
+        self.successfull, self.zipfile, self.manifest.entries, self.saved_renders = True, ZipEntries(), {}, 0
+        try:
+            getattr(self, method)(*args)
+            return self.successfull, self.zipfile.entries, self.manifest.entries, self.saved_renders
+        finally:
+            self.successfull, self.zipfile, self.manifest.entries, self.saved_renders = state
+
+    def run_tasks(self, tasks):
+        """Run tasks (names of methods and their arguments), in worker processes with --jobs option.
+        Files added to the current zip file by tasks are added to it once they are done.
+        """
+        if self.pool:
+            results = self.pool.imap(run_task, tasks)
+        else:
+            results = (self.run_task(*task) for task in tasks)
+        successfull = self.successfull
+        names = None
+        for task_successfull, entries, manifest_entries, saved_renders in results:
+            successfull = successfull and task_successfull
+            self.manifest.entries.update(manifest_entries)
+            self.saved_renders += saved_renders
+            if entries and names is None:
+                names = set(self.zipfile.namelist())
+            for filename, arcname in entries:
+                if arcname not in names:
+                    self.zipfile.write(filename, arcname)
+                    names.add(arcname)
+        self.successfull = successfull
+
     def sync_view(self, lang, view, name, url='/', params={}, zipfile=None, fix2028=False, **kwargs):
         if self.verbosity == 2:
             self.stdout.write("{lang} {name} ...".format(lang=lang, name=name), ending="")
             self.stdout._out.flush()
         fullname = os.path.join(self.tmp_root, name)
         self.mkdirs(fullname)
+        # Views independent of objects (parameters, themes, metas...) are synced for every trek: render them once
+        key = (get_view_key(view), url, repr(sorted(params.items())), lang, repr(sorted(kwargs.items())))
+        rendered = self.rendered_views.get(key)
+        if rendered and os.path.isfile(os.path.join(self.tmp_root, rendered)):
+            if rendered != name and not os.path.isfile(fullname):
+                os.link(os.path.join(self.tmp_root, rendered), fullname)
+            self.saved_renders += 1
+            if self.verbosity == 2:
+                self.stdout.write("already rendered")
+            self.add_generated_file(name)
+            if zipfile and name not in zipfile.namelist():
+                zipfile.write(fullname, name)
+            return
         request = self.factory.get(url, params, HTTP_HOST=self.host, secure=self.secure)
         request.LANGUAGE_CODE = lang
         request.user = AnonymousUser()
@@ -169,7 +334,10 @@ class Command(BaseCommand):
             if self.verbosity > 0:
                 self.stderr.write(self.style.ERROR("failed (HTTP {code})".format(code=response.status_code)))
             return
-        f = open(fullname, 'wb')
+        # Files rendered for every trek (parameters, metas...) can be written by several workers at the same time,
+        # so they are replaced at once
+        partname = '{}.{}.part'.format(fullname, os.getpid())
+        f = open(partname, 'wb')
         if isinstance(response, StreamingHttpResponse):
             content = b''.join(response.streaming_content)
         else:
@@ -182,14 +350,17 @@ class Command(BaseCommand):
         f.close()
         oldfilename = os.path.join(self.dst_root, name)
         # If new file is identical to old one, don't recreate it. This will help backup
-        if os.path.isfile(oldfilename) and filecmp.cmp(fullname, oldfilename):
-            os.unlink(fullname)
-            os.link(oldfilename, fullname)
+        if os.path.isfile(oldfilename) and filecmp.cmp(partname, oldfilename):
+            os.unlink(partname)
+            os.link(oldfilename, partname)
             if self.verbosity == 2:
                 self.stdout.write("unchanged")
         else:
             if self.verbosity == 2:
                 self.stdout.write("generated")
+        os.replace(partname, fullname)
+        self.rendered_views[key] = name
+        self.add_generated_file(name)
         # FixMe: Find why there are duplicate files.
         if zipfile:
             if name not in zipfile.namelist():
@@ -226,6 +397,8 @@ class Command(BaseCommand):
         self.sync_object_view(lang, obj, view, 'profile.json', zipfile=zipfile)
 
     def sync_profile_png(self, lang, obj, zipfile=None):
+        # Render charts of all languages in one pass, next languages will be up-to-date
+        obj.prepare_elevation_charts(self.languages, self.referer)
         view = serve_elevation_chart
         model_name = type(obj)._meta.model_name
         self.sync_object_view(lang, obj, view, 'profile.png', zipfile=zipfile, model_name=model_name, from_command=True)
@@ -236,6 +409,21 @@ class Command(BaseCommand):
         view = ElevationArea.as_view(model=type(obj))
         self.sync_object_view(lang, obj, view, 'dem.json')
 
+    def prewarm_dems(self):
+        """ Computes outdated DEM files of all treks at once, in parallel.
+        sync_dem() then only reads them.
+        """
+        if self.skip_dem or AltimetryHelper.dem_version() is None:
+            return
+        treks = trekking_models.Trek.objects.existing()
+        if self.source:
+            treks = treks.filter(source__name__in=self.source)
+        if self.portal:
+            treks = treks.filter(Q(portal__name=self.portal) | Q(portal=None))
+        pks = ','.join([str(pk) for pk in treks.values_list('pk', flat=True)])
+        if pks:
+            call_command('prewarm_dem', 'trekking.trek', pks=pks, jobs=self.jobs, verbosity=0)
+
     def sync_metas(self, lang, metaview, obj=None):
         params = {'rando_url': self.rando_url, 'lang': lang}
         self.get_params_portal(params)
@@ -257,7 +445,12 @@ class Command(BaseCommand):
                 self.stdout.write("\x1b[36m{lang}\x1b[0m \x1b[1m{url}/{name}\x1b[0m \x1b[31mfile does not exist\x1b[0m".format(lang=lang, url=url, name=name))
             return
         if not os.path.isfile(dst):
-            os.link(src, dst)
+            try:
+                os.link(src, dst)
+            except FileExistsError:
+                # Linked by another worker in the meantime
+                pass
+        self.add_generated_file(os.path.join(url, name))
         if zipfile:
             zipfile.write(dst, os.path.join(url, name))
         if self.verbosity == 2:
@@ -289,6 +482,7 @@ class Command(BaseCommand):
             oldzipfile.close()
 
         zipfile.close()
+        self.add_generated_file(name)
         if uptodate:
             stat = os.stat(oldzipfilename)
             os.utime(zipfilename, (stat.st_atime, stat.st_mtime))
@@ -313,7 +507,7 @@ class Command(BaseCommand):
                     }
                 )
 
-            self.sync_global_tiles()
+            self.run_tasks([('sync_global_tiles_incrementally', ())])
 
             if self.celery_task:
                 self.celery_task.update_state(
@@ -333,9 +527,8 @@ class Command(BaseCommand):
             if self.portal:
                 treks = treks.filter(Q(portal__name=self.portal) | Q(portal=None))
 
-            for trek in treks:
-                if trek.any_published or any([parent.any_published for parent in trek.parents]):
-                    self.sync_trek_tiles(trek)
+            self.run_tasks([('sync_trek_tiles_by_pk', (trek.pk, )) for trek in treks
+                            if trek.any_published or any([parent.any_published for parent in trek.parents])])
 
             if self.celery_task:
                 self.celery_task.update_state(
@@ -348,14 +541,19 @@ class Command(BaseCommand):
                     }
                 )
 
+    def get_topoguide_file_type(self):
+        if not hasattr(self, 'topoguide_file_type'):
+            try:
+                self.topoguide_file_type = FileType.objects.get(type="Topoguide")
+            except FileType.DoesNotExist:
+                self.topoguide_file_type = None
+        return self.topoguide_file_type
+
     def sync_pdf(self, lang, obj, view):
         if self.skip_pdf:
             return
-        try:
-            file_type = FileType.objects.get(type="Topoguide")
-        except FileType.DoesNotExist:
-            file_type = None
-        attachments = common_models.Attachment.objects.attachments_for_object_only_type(obj, file_type)
+        attachments = common_models.Attachment.objects.attachments_for_object_only_type(obj,
+                                                                                        self.get_topoguide_file_type())
         if attachments:
             path = attachments[0].attachment_file.name
             modelname = obj._meta.model_name
@@ -363,6 +561,7 @@ class Command(BaseCommand):
             dst = os.path.join(self.tmp_root, 'api', lang, '{modelname}s'.format(modelname=modelname), str(obj.pk), obj.slug + '.pdf')
             self.mkdirs(dst)
             os.link(src, dst)
+            self.add_generated_file(os.path.relpath(dst, self.tmp_root))
             if self.verbosity == 2:
                 self.stdout.write("\x1b[36m{lang}\x1b[0m \x1b[1m{dst}\x1b[0m \x1b[32mcopied\x1b[0m".format(lang=lang, dst=dst))
         elif settings.ONLY_EXTERNAL_PUBLIC_PDF:
@@ -375,9 +574,19 @@ class Command(BaseCommand):
             self.sync_object_view(lang, obj, view, '{obj.slug}.pdf', params=params, slug=obj.slug)
 
     def sync(self):
+        if self.jobs > 1:
+            close_connections()
+            with Pool(self.jobs, initializer=init_worker, initargs=(self, )) as self.pool:
+                self.sync_all()
+            self.pool = None
+        else:
+            self.sync_all()
+
+    def sync_all(self):
         step_value = int(50 / len(settings.MODELTRANSLATION_LANGUAGES))
         current_value = 30
         self.sync_tiles()
+        self.prewarm_dems()
         subcommands = [trekking_sync.SyncRando(self), common_sync.SyncRando(self)]
         if self.with_signages and 'geotrek.signage' in settings.INSTALLED_APPS:
             subcommands.append(signage_sync.SyncRando(self))
@@ -425,11 +634,63 @@ class Command(BaseCommand):
         self.sync_pictograms('**', [tourism_models.InformationDeskType, tourism_models.TouristicContentCategory,
                                     tourism_models.TouristicContentType, tourism_models.TouristicEventType])
 
+    def get_fingerprint(self):
+        """Options, settings, DEM and categories used to generate all files"""
+        options = ('url', 'rando_url', 'source', 'portal', 'skip_pdf', 'skip_tiles', 'skip_dem', 'skip_profile_png',
+                   'languages', 'with_events', 'content_categories', 'with_signages', 'with_infrastructures',
+                   'with_dives')
+        categories = [
+            authent_models.Structure, common_models.Theme, common_models.RecordSource, common_models.TargetPortal,
+            common_models.FileType, trekking_models.TrekNetwork, trekking_models.Practice,
+            trekking_models.Accessibility, trekking_models.DifficultyLevel, trekking_models.POIType,
+            trekking_models.ServiceType, trekking_models.Route, trekking_models.WebLinkCategory,
+            trekking_models.WebLink, trekking_models.LabelTrek, tourism_models.InformationDeskType,
+            tourism_models.TouristicContentCategory, tourism_models.TouristicContentType,
+            tourism_models.TouristicEventType,
+        ]
+        if 'geotrek.sensitivity' in settings.INSTALLED_APPS:
+            # Species are rendered in sensitive areas of treks, their changes do not update areas
+            categories += [sensitivity_models.SportPractice, sensitivity_models.Species,
+                           sensitivity_models.Species.practices.through]
+        return [
+            settings.VERSION,
+            {name: self.options.get(name) for name in options},
+            {name: getattr(settings, name) for name in dir(settings) if name.isupper()},
+            AltimetryHelper.dem_version(),
+            [(model._meta.label, list(model.objects.order_by('pk').values_list())) for model in categories],
+        ]
+
+    def get_trek_dependencies(self, trek):
+        """Versions of objects whose changes can modify files of trek details:
+        trek, parents, children, POIs, services and other objects close to trek, attachments, information desks
+        """
+        objects = chain([trek], trek.parents, trek.children, trek.published_pois, trek.services)
+        if self.with_infrastructures:
+            objects = chain(objects, trek.infrastructures)
+        if self.with_signages:
+            objects = chain(objects, trek.signages)
+        if self.with_events:
+            objects = chain(objects, trek.touristic_events)
+        if self.categories:
+            objects = chain(objects, trek.touristic_contents)
+        if 'geotrek.sensitivity' in settings.INSTALLED_APPS:
+            objects = chain(objects, trek.published_sensitive_areas)
+        dependencies = []
+        for obj in objects:
+            dependencies.append([obj._meta.label, obj.pk, obj.date_update, obj.geom])
+            if hasattr(obj, 'attachments'):
+                dependencies.append(list(obj.attachments.order_by('pk').values_list('pk', 'date_update')))
+        for desk in trek.information_desks.order_by('pk'):
+            dependencies.append([getattr(desk, field.attname) for field in desk._meta.concrete_fields])
+        dependencies.append([str(area) for area in chain(trek.published_cities, trek.published_districts,
+                                                         trek.published_areas)])
+        return dependencies
+
     def check_dst_root_is_empty(self):
         if not os.path.exists(self.dst_root):
             return
         existing = set([os.path.basename(p) for p in os.listdir(self.dst_root)])
-        remaining = existing - set(('api', 'media', 'meta', 'static', 'zip'))
+        remaining = existing - set(('api', 'media', 'meta', 'static', 'zip', MANIFEST_NAME))
         if remaining:
             raise CommandError("Destination directory contains extra data")
 
@@ -482,6 +743,7 @@ class Command(BaseCommand):
         self.with_infrastructures = options.get('with_infrastructures', False)
         self.with_dives = options.get('with_dives', False)
         self.celery_task = options.get('task', None)
+        self.jobs = options.get('jobs', 1)
 
         if self.source is not None:
             self.source = self.source.split(',')
@@ -498,6 +760,8 @@ class Command(BaseCommand):
             'tiles_dir': os.path.join(settings.VAR_DIR, 'tiles'),
         }
         self.tmp_root = os.path.join(os.path.dirname(self.dst_root), 'tmp_sync_rando')
+        self.zipfile = None
+        self.manifest = SyncManifest(self.dst_root, self.tmp_root, self.get_fingerprint(), full=options['full'])
         try:
             os.mkdir(self.tmp_root)
         except OSError as e:
@@ -509,6 +773,7 @@ class Command(BaseCommand):
             )
         try:
             self.sync()
+            self.manifest.write()
             if self.celery_task:
                 self.celery_task.update_state(
                     state='PROGRESS',
@@ -525,12 +790,14 @@ class Command(BaseCommand):
             raise
 
         self.rename_root()
+        common_sync.TileStore.purge(self.builder_args['tiles_dir'], settings.MOBILE_TILES_TTL)
 
         done_message = 'Done'
         if self.successfull:
             done_message = self.style.SUCCESS(done_message)
 
         if self.verbosity >= 1:
+            self.stdout.write("{count} identical renders saved".format(count=self.saved_renders))
             self.stdout.write(done_message)
 
         if not self.successfull:
@@ -1,4 +1,12 @@
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
 import os
+import re
+from socketserver import ThreadingMixIn
+import threading
+import time
+import tracemalloc
 
 from unittest import mock
 
@@ -26,6 +34,137 @@ class TranslationResetMixin(object):
         super(TranslationResetMixin, self).setUp()
 
 
+class BenchmarkMixin(object):
+    """
+    Time stages of a benchmark and compare them with a stored baseline.
+
+    Benchmark modules are not collected by default (they are not named test*.py),
+    run them explicitly, ex: ``./manage.py test geotrek.altimetry.tests.benchmarks``.
+    Set ``BENCHMARK_SAVE=1`` to store results as the new baseline.
+    """
+    benchmark_name = None
+    benchmark_repeat = 3
+
+    @classmethod
+    def setUpClass(cls):
+        super(BenchmarkMixin, cls).setUpClass()
+        cls.benchmark_results = {}
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.report_benchmark()
+        super(BenchmarkMixin, cls).tearDownClass()
+
+    @classmethod
+    def get_baseline_path(cls):
+        return os.path.join(settings.VAR_DIR, 'benchmarks', '{}.json'.format(cls.benchmark_name))
+
+    def measure(self, key, func, points=1):
+        """Run func several times, keep best duration, then once more to measure peak of python memory
+        (tracing memory slows allocations down, it would skew durations).
+        points is the number of processed points, or a function computing it from the result.
+        Returns the result of the last call.
+        """
+        durations = []
+        for i in range(self.benchmark_repeat):
+            start = time.perf_counter()
+            func()
+            durations.append(time.perf_counter() - start)
+        tracemalloc.start()
+        try:
+            result = func()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        duration = min(durations)
+        if callable(points):
+            points = points(result)
+        self.benchmark_results[key] = {
+            'seconds': duration,
+            'points': points,
+            'points_per_second': points / duration if duration else None,
+            'peak_memory': peak,
+        }
+        return result
+
+    @classmethod
+    def report_benchmark(cls):
+        path = cls.get_baseline_path()
+        baseline = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                baseline = json.load(f)
+        print("\n{:<50} {:>10} {:>14} {:>12} {:>10}".format('stage', 'seconds', 'points/s', 'peak KiB', 'baseline'))
+        for key, result in sorted(cls.benchmark_results.items()):
+            ratio = ''
+            if baseline.get(key, {}).get('seconds'):
+                ratio = 'x{:.2f}'.format(result['seconds'] / baseline[key]['seconds'])
+            print("{:<50} {:>10.4f} {:>14.0f} {:>12.0f} {:>10}".format(
+                key, result['seconds'], result['points_per_second'] or 0, result['peak_memory'] / 1024, ratio))
+        if os.environ.get('BENCHMARK_SAVE') or not baseline:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            baseline.update(cls.benchmark_results)
+            with open(path, 'w') as f:
+                json.dump(baseline, f, indent=2, sort_keys=True)
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class TileServerMixin(object):
+    """
+    Local stand-in of a tiles server, to test tiles downloads offline.
+    Serves ``/{z}/{x}/{y}.png`` tiles at ``tiles_url``, whose content only depends on ``z``
+    (``tile_content()``). Requests are counted by tile in ``tile_requests``, and the first
+    ``tile_failures[tile]`` requests of a tile fail with HTTP 503.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super(TileServerMixin, cls).setUpClass()
+
+        class TileHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                m = re.match(r'^/(\d+)/(\d+)/(\d+)\.png$', self.path)
+                if not m:
+                    self.send_error(404)
+                    return
+                tile = tuple(int(i) for i in m.groups())
+                cls.tile_requests[tile] += 1
+                if cls.tile_requests[tile] <= cls.tile_failures.get(tile, 0):
+                    self.send_error(503)
+                    return
+                content = cls.tile_content(tile)
+                self.send_response(200)
+                self.send_header('Content-Type', 'image/png')
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, *args):
+                pass
+
+        cls.tile_server = ThreadingHTTPServer(('127.0.0.1', 0), TileHandler)
+        cls.tiles_url = 'http://127.0.0.1:{}/{{z}}/{{x}}/{{y}}.png'.format(cls.tile_server.server_port)
+        threading.Thread(target=cls.tile_server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tile_server.shutdown()
+        cls.tile_server.server_close()
+        super(TileServerMixin, cls).tearDownClass()
+
+    def setUp(self):
+        super(TileServerMixin, self).setUp()
+        type(self).tile_requests = Counter()
+        type(self).tile_failures = {}
+
+    @staticmethod
+    def tile_content(tile):
+        return 'tile of zoom {}'.format(tile[0]).encode('ascii')
+
+
 class CommonTest(AuthentFixturesTest, TranslationResetMixin, MapEntityTest):
     api_prefix = '/api/en/'
 
@@ -0,0 +1,95 @@
+import os
+import shutil
+import time
+from tempfile import mkdtemp
+from unittest import mock
+from zipfile import ZipFile
+
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from geotrek.common.helpers_sync import TileStore, ZipTilesBuilder
+from geotrek.common.tests import TileServerMixin
+
+
+class ZipTilesBuilderTest(TileServerMixin, TestCase):
+    tiles = [(0, 0, 0), (1, 0, 0), (1, 0, 1), (1, 1, 0), (1, 1, 1)]
+
+    def setUp(self):
+        super(ZipTilesBuilderTest, self).setUp()
+        self.root = mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        super(ZipTilesBuilderTest, self).tearDown()
+
+    def build(self, tiles):
+        zipname = os.path.join(self.root, 'tiles.zip')
+        with ZipFile(zipname, 'w') as zipfile:
+            builder = ZipTilesBuilder(zipfile, prefix='tiles/', tiles_url=self.tiles_url, tiles_headers={},
+                                      ignore_errors=True, tiles_dir=os.path.join(self.root, 'store'))
+            builder.tiles = set(tiles)
+            builder.run()
+        with ZipFile(zipname, 'r') as zipfile:
+            return {name: zipfile.read(name) for name in zipfile.namelist()}
+
+    def test_tiles_downloaded(self):
+        files = self.build(self.tiles)
+        self.assertEqual(files, {'tiles/{}/{}/{}.png'.format(*tile): self.tile_content(tile) for tile in self.tiles})
+        self.assertEqual(self.tile_requests, {tile: 1 for tile in self.tiles})
+
+    def test_tiles_reused_from_store(self):
+        self.build(self.tiles)
+        files = self.build(self.tiles[:3])
+        self.assertEqual(len(files), 3)
+        self.assertEqual(self.tile_requests, {tile: 1 for tile in self.tiles})
+        # Tiles of same zoom have the same content, stored once
+        contents = [name for path, dirs, names in os.walk(os.path.join(self.root, 'store', 'contents'))
+                    for name in names]
+        self.assertEqual(len(contents), 2)
+
+    @override_settings(MOBILE_TILES_TTL=0)
+    def test_tiles_expired(self):
+        self.build(self.tiles)
+        self.build(self.tiles)
+        self.assertEqual(self.tile_requests, {tile: 2 for tile in self.tiles})
+
+    def store_files(self, subfolder):
+        return sorted(os.path.join(path, name) for path, dirs, names in os.walk(os.path.join(self.root, 'store', subfolder))
+                      for name in names)
+
+    @override_settings(MOBILE_TILES_TTL=3600)
+    def test_store_purged(self):
+        self.build(self.tiles)
+        # Make all stored tiles expired, then refresh zoom 0 only
+        expired = time.time() - 7200
+        for path in self.store_files('layers') + self.store_files('contents'):
+            os.utime(path, (expired, expired))
+        self.build(self.tiles[:1])
+        self.assertEqual(TileStore.purge(os.path.join(self.root, 'store'), 3600), 5)
+        self.assertEqual(len(self.store_files('layers')), 1)
+        self.assertEqual(len(self.store_files('contents')), 1)
+        files = self.build(self.tiles)
+        self.assertEqual(files, {'tiles/{}/{}/{}.png'.format(*tile): self.tile_content(tile) for tile in self.tiles})
+        self.assertEqual(self.tile_requests, {tile: 2 for tile in self.tiles})
+
+    @override_settings(MOBILE_TILES_RETRIES=2, MOBILE_TILES_RETRY_DELAY=1)
+    @mock.patch('geotrek.common.helpers_sync.time.sleep')
+    def test_download_retried(self, mock_sleep):
+        self.tile_failures[(1, 0, 1)] = 2
+        files = self.build([(1, 0, 1)])
+        self.assertEqual(files, {'tiles/1/0/1.png': self.tile_content((1, 0, 1))})
+        self.assertEqual(self.tile_requests[(1, 0, 1)], 3)
+        self.assertEqual(mock_sleep.call_args_list, [mock.call(1), mock.call(2)])
+
+    @override_settings(MOBILE_TILES_RETRIES=2)
+    def test_download_failed(self):
+        self.tile_failures[(1, 0, 1)] = 3
+        with self.assertLogs('geotrek.common.helpers_sync', 'WARNING'):
+            files = self.build(self.tiles)
+        self.assertEqual(len(files), len(self.tiles) - 1)
+        self.assertNotIn('tiles/1/0/1.png', files)
+        self.assertEqual(self.tile_requests[(1, 0, 1)], 3)
+        # Failed tile is downloaded again next time
+        self.build([(1, 0, 1)])
+        self.assertEqual(self.tile_requests[(1, 0, 1)], 4)
@@ -1,3 +1,4 @@
+import copy
 import errno
 import os
 import json
@@ -15,6 +16,8 @@ from django.core.management.base import CommandError
 from django.http import HttpResponse, StreamingHttpResponse
 from django.test.utils import override_settings
 
+from geotrek.common.management.commands import sync_rando
+from geotrek.common.views import ParametersView
 from geotrek.common.factories import FileTypeFactory, RecordSourceFactory, TargetPortalFactory, AttachmentFactory, ThemeFactory
 from geotrek.common.utils.testdata import get_dummy_uploaded_image
 from geotrek.core.factories import PathFactory
@@ -26,6 +29,23 @@ from geotrek.trekking.factories import TrekFactory, TrekWithPublishedPOIsFactory
 from geotrek.trekking import models as trekking_models
 
 
+class InProcessPool:
+    """Run tasks of pool in the test process, with a copy of the command as if it was forked:
+    test data is not visible from other database connections"""
+
+    def __init__(self, processes, initializer=None, initargs=()):
+        sync_rando.worker_command = copy.copy(initargs[0])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def imap(self, func, iterable):
+        return map(func, iterable)
+
+
 class VarTmpTestCase(TestCase):
     def setUp(self):
         if os.path.exists(os.path.join('var', 'tmp_sync_rando')):
@@ -288,6 +308,90 @@ class SyncTest(VarTmpTestCase):
                 # \u2028 is translated to \n
                 self.assertEqual(treks['features'][0]['properties']['description'], 'toto\ntata')
 
+    @mock.patch('geotrek.trekking.models.Trek.prepare_map_image')
+    def test_sync_incremental(self, mock_prepare):
+        management.call_command('sync_rando', 'var/tmp', url='http://localhost:8000', skip_tiles=True, skip_pdf=True,
+                                languages='en', verbosity=0)
+        name = os.path.join('api', 'en', 'treks', str(self.trek.pk))
+        with open(os.path.join('var', 'tmp', 'manifest.json')) as f:
+            entry = json.load(f)[name]
+        self.assertEqual(entry['source'], 'trekking.trek.{}'.format(self.trek.pk))
+        self.assertIn(os.path.join(name, 'pois.geojson'), entry['paths'])
+        self.assertIn(os.path.join(name, 'pois.geojson'), entry['output'])
+        self.assertIn(os.path.join(name, 'pois.geojson'), entry['zip'])
+
+        output = StringIO()
+        management.call_command('sync_rando', 'var/tmp', url='http://localhost:8000', skip_tiles=True, skip_pdf=True,
+                                languages='en', verbosity=2, stdout=output)
+        self.assertIn('{} unchanged'.format(name), output.getvalue())
+        self.assertNotIn(os.path.join(name, 'pois.geojson'), output.getvalue())
+        self.assertTrue(os.path.exists(os.path.join('var', 'tmp', name, 'pois.geojson')))
+
+        self.trek.published_pois.first().save()
+        output = StringIO()
+        management.call_command('sync_rando', 'var/tmp', url='http://localhost:8000', skip_tiles=True, skip_pdf=True,
+                                languages='en', verbosity=2, stdout=output)
+        self.assertNotIn('{} unchanged'.format(name), output.getvalue())
+        self.assertIn(os.path.join(name, 'pois.geojson'), output.getvalue())
+
+    @mock.patch('geotrek.trekking.models.Trek.prepare_map_image')
+    def test_sync_incremental_species_changed(self, mock_prepare):
+        area = SensitiveAreaFactory.create(published=True)
+        management.call_command('sync_rando', 'var/tmp', url='http://localhost:8000', skip_tiles=True, skip_pdf=True,
+                                languages='en', verbosity=0)
+        # Changes of species do not update sensitive areas
+        area.species.name = 'Changed species'
+        area.species.save()
+        output = StringIO()
+        management.call_command('sync_rando', 'var/tmp', url='http://localhost:8000', skip_tiles=True, skip_pdf=True,
+                                languages='en', verbosity=2, stdout=output)
+        name = os.path.join('api', 'en', 'treks', str(self.trek.pk))
+        self.assertNotIn('{} unchanged'.format(name), output.getvalue())
+        self.assertIn(os.path.join(name, 'sensitiveareas.geojson'), output.getvalue())
+
+    @mock.patch('geotrek.trekking.models.Trek.prepare_map_image')
+    def test_sync_full(self, mock_prepare):
+        management.call_command('sync_rando', 'var/tmp', url='http://localhost:8000', skip_tiles=True, skip_pdf=True,
+                                languages='en', verbosity=0)
+        output = StringIO()
+        management.call_command('sync_rando', 'var/tmp', url='http://localhost:8000', skip_tiles=True, skip_pdf=True,
+                                languages='en', full=True, verbosity=2, stdout=output)
+        name = os.path.join('api', 'en', 'treks', str(self.trek.pk))
+        self.assertNotIn('{} unchanged'.format(name), output.getvalue())
+        self.assertIn(os.path.join(name, 'pois.geojson'), output.getvalue())
+
+    @mock.patch('geotrek.trekking.models.Trek.prepare_map_image')
+    def test_sync_views_rendered_once(self, mock_prepare):
+        trek_2 = TrekWithPublishedPOIsFactory.create(published=True)
+        output = StringIO()
+        with mock.patch.object(ParametersView, 'get', side_effect=ParametersView.get, autospec=True) as mock_get:
+            management.call_command('sync_rando', 'var/tmp', url='http://localhost:8000', skip_tiles=True,
+                                    skip_pdf=True, languages='en', verbosity=2, stdout=output)
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertIn('already rendered', output.getvalue())
+        self.assertRegex(output.getvalue(), r'\n[1-9][0-9]* identical renders saved')
+        self.assertTrue(os.path.exists(os.path.join('var', 'tmp', 'api', 'en', 'parameters.json')))
+        for trek in (self.trek, trek_2):
+            self.assertTrue(os.path.exists(os.path.join('var', 'tmp', 'api', 'en', 'treks', str(trek.pk),
+                                                        'pois.geojson')))
+
+    @mock.patch('geotrek.common.management.commands.sync_rando.close_connections')
+    @mock.patch('geotrek.common.management.commands.sync_rando.Pool', InProcessPool)
+    @mock.patch('landez.TilesManager.tile', return_value=b'I am a png')
+    @mock.patch('geotrek.trekking.models.Trek.prepare_map_image')
+    def test_sync_jobs(self, mock_prepare, mock_tile, mock_close):
+        output = StringIO()
+        management.call_command('sync_rando', 'var/tmp', url='http://localhost:8000', skip_pdf=True, skip_dem=True,
+                                languages='en', jobs=2, verbosity=2, stdout=output)
+        mock_close.assert_called_once_with()
+        self.assertIn('Done', output.getvalue())
+        self.assertTrue(os.path.exists(os.path.join('var', 'tmp', 'zip', 'tiles', 'global.zip')))
+        self.assertTrue(os.path.exists(os.path.join('var', 'tmp', 'zip', 'tiles', '{}.zip'.format(self.trek.pk))))
+        self.assertTrue(os.path.exists(os.path.join('var', 'tmp', 'zip', 'treks', 'en', '{}.zip'.format(self.trek.pk))))
+        self.assertTrue(os.path.exists(os.path.join('var', 'tmp', 'api', 'en', 'treks', str(self.trek.pk),
+                                                    'pois.geojson')))
+        self.assertTrue(os.path.exists(os.path.join('var', 'tmp', 'api', 'en', 'parameters.json')))
+
     @mock.patch('geotrek.trekking.models.Trek.prepare_map_image')
     @override_settings(ONLY_EXTERNAL_PUBLIC_PDF=True)
     def test_only_external_public_pdf(self, trek):
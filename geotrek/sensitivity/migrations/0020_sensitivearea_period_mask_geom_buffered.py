@@ -0,0 +1,36 @@
+from django.conf import settings
+import django.contrib.gis.db.models.fields
+from django.db import migrations, models
+
+PERIOD_MASK = ' | '.join('(s.period{:02}::integer << {})'.format(month, month - 1) for month in range(1, 13))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sensitivity', '0019_auto_20200406_1411'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sensitivearea',
+            name='period_mask',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='sensitivearea',
+            name='geom_buffered',
+            field=django.contrib.gis.db.models.fields.GeometryField(editable=False, null=True, spatial_index=False, srid=settings.SRID),
+        ),
+        # Existing areas, next ones are maintained by triggers
+        migrations.RunSQL("""
+            UPDATE sensitivity_sensitivearea a SET
+                period_mask = {mask},
+                geom_buffered = CASE GeometryType(a.geom)
+                    WHEN 'POINT' THEN ST_Buffer(a.geom, COALESCE(s.radius, {radius}), 4)
+                    WHEN 'POLYGON' THEN a.geom
+                    WHEN 'MULTIPOLYGON' THEN a.geom
+                END
+            FROM sensitivity_species s WHERE s.id = a.species_id;
+        """.format(mask=PERIOD_MASK, radius=settings.SENSITIVITY_DEFAULT_RADIUS), reverse_sql=migrations.RunSQL.noop),
+    ]
@@ -80,6 +80,9 @@ class SensitiveArea(MapEntityMixin, StructureRelated, TimeStampedModelMixin, NoD
     description = models.TextField(verbose_name=_("Description"), blank=True)
     contact = models.TextField(verbose_name=_("Contact"), blank=True)
     eid = models.CharField(verbose_name=_("External id"), max_length=1024, blank=True, null=True)
+    # Computed by database triggers from species (see sql/post_10_sensitivity.sql)
+    period_mask = models.IntegerField(default=0, editable=False)  # bit 0 is january, bit 11 is december
+    geom_buffered = models.GeometryField(srid=settings.SRID, null=True, editable=False, spatial_index=False)
 
     class Meta:
         verbose_name = _("Sensitive area")
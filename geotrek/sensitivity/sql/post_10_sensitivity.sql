@@ -0,0 +1,71 @@
+-------------------------------------------------------------------------------
+-- Add spatial indexes on stored buffered geometry and on its area
+-- (areas are listed from the biggest to the smallest)
+-------------------------------------------------------------------------------
+
+CREATE INDEX sensitivity_sensitivearea_geom_buffered_idx ON sensitivity_sensitivearea USING gist(geom_buffered);
+CREATE INDEX sensitivity_sensitivearea_area_idx ON sensitivity_sensitivearea (ST_Area(geom_buffered) DESC, id);
+
+
+-------------------------------------------------------------------------------
+-- Occupancy months of species, as a mask (bit 0 is january, bit 11 is december)
+-------------------------------------------------------------------------------
+
+CREATE FUNCTION {# geotrek.sensitivity #}.species_period_mask(integer) RETURNS integer AS $$
+    SELECT (period01::integer) | (period02::integer << 1) | (period03::integer << 2) | (period04::integer << 3)
+         | (period05::integer << 4) | (period06::integer << 5) | (period07::integer << 6) | (period08::integer << 7)
+         | (period09::integer << 8) | (period10::integer << 9) | (period11::integer << 10) | (period12::integer << 11)
+    FROM sensitivity_species WHERE id = $1;
+$$ LANGUAGE sql STABLE;
+
+
+-------------------------------------------------------------------------------
+-- Geometry of area shown on maps: points are buffered by radius of species
+-------------------------------------------------------------------------------
+
+CREATE FUNCTION {# geotrek.sensitivity #}.sensitive_area_buffered(geometry, integer) RETURNS geometry AS $$
+    SELECT CASE GeometryType($1)
+        WHEN 'POINT' THEN ST_Buffer($1, COALESCE(radius, {{ SENSITIVITY_DEFAULT_RADIUS }}), 4)
+        WHEN 'POLYGON' THEN $1
+        WHEN 'MULTIPOLYGON' THEN $1
+    END
+    FROM sensitivity_species WHERE id = $2;
+$$ LANGUAGE sql STABLE;
+
+
+-------------------------------------------------------------------------------
+-- Keep period mask and buffered geometry up-to-date
+-------------------------------------------------------------------------------
+
+CREATE FUNCTION {# geotrek.sensitivity #}.sensitivearea_species_iu() RETURNS trigger SECURITY DEFINER AS $$
+DECLARE
+BEGIN
+    NEW.period_mask := species_period_mask(NEW.species_id);
+    NEW.geom_buffered := sensitive_area_buffered(NEW.geom, NEW.species_id);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER sensitivity_sensitivearea_10_species_iu_tgr
+BEFORE INSERT OR UPDATE ON sensitivity_sensitivearea
+FOR EACH ROW EXECUTE PROCEDURE sensitivearea_species_iu();
+
+
+CREATE FUNCTION {# geotrek.sensitivity #}.species_sensitiveareas_u() RETURNS trigger SECURITY DEFINER AS $$
+DECLARE
+BEGIN
+    -- Areas are computed again by their own trigger
+    UPDATE sensitivity_sensitivearea SET species_id = species_id WHERE species_id = NEW.id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER sensitivity_species_10_sensitiveareas_u_tgr
+AFTER UPDATE ON sensitivity_species
+FOR EACH ROW
+WHEN (OLD.radius IS DISTINCT FROM NEW.radius
+      OR OLD.period01 != NEW.period01 OR OLD.period02 != NEW.period02 OR OLD.period03 != NEW.period03
+      OR OLD.period04 != NEW.period04 OR OLD.period05 != NEW.period05 OR OLD.period06 != NEW.period06
+      OR OLD.period07 != NEW.period07 OR OLD.period08 != NEW.period08 OR OLD.period09 != NEW.period09
+      OR OLD.period10 != NEW.period10 OR OLD.period11 != NEW.period11 OR OLD.period12 != NEW.period12)
+EXECUTE PROCEDURE species_sensitiveareas_u();
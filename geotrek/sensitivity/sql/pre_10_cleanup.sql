@@ -0,0 +1,9 @@
+-- 10
+
+DROP INDEX IF EXISTS sensitivity_sensitivearea_geom_buffered_idx;
+DROP INDEX IF EXISTS sensitivity_sensitivearea_area_idx;
+
+DROP FUNCTION IF EXISTS species_period_mask(integer) CASCADE;
+DROP FUNCTION IF EXISTS sensitive_area_buffered(geometry, integer) CASCADE;
+DROP FUNCTION IF EXISTS sensitivearea_species_iu() CASCADE;
+DROP FUNCTION IF EXISTS species_sensitiveareas_u() CASCADE;
@@ -0,0 +1,65 @@
+"""
+Benchmarks of sensitive areas API v2 on many areas.
+
+Run with ``./manage.py test geotrek.sensitivity.tests.benchmarks``.
+"""
+from django.conf import settings
+from django.contrib.gis.geos import Point, Polygon
+from django.test import TestCase
+from django.urls import reverse
+
+from geotrek.authent.models import default_structure
+from geotrek.common.tests import BenchmarkMixin
+from geotrek.sensitivity.factories import SpeciesFactory, SportPracticeFactory
+from geotrek.sensitivity.models import SensitiveArea
+
+# Lower left corner and size (in meters) of the grid of areas
+GRID_ORIGIN = (700000, 6600000)
+GRID_SIZE = 50000
+
+
+class SensitiveAreaBenchmark(BenchmarkMixin, TestCase):
+    benchmark_name = 'sensitivity'
+    nb_areas = 50000
+    page_size = 1000
+
+    @classmethod
+    def setUpTestData(cls):
+        practices = SportPracticeFactory.create_batch(4)
+        species = []
+        for month in range(1, 13):
+            species.append(SpeciesFactory.create(radius=month * 10, **{'period{:02}'.format(month): True}))
+            species[-1].practices.set([practices[month % 4]])
+        structure = default_structure()
+        columns = int(cls.nb_areas ** 0.5) + 1
+        step = GRID_SIZE / columns
+        areas = []
+        for i in range(cls.nb_areas):
+            x, y = GRID_ORIGIN[0] + (i % columns) * step, GRID_ORIGIN[1] + (i // columns) * step
+            if i % 2:
+                geom = Point(x, y, srid=settings.SRID)
+            else:
+                geom = Polygon.from_bbox((x, y, x + step / 2, y + step / 2))
+                geom.srid = settings.SRID
+            areas.append(SensitiveArea(species=species[i % 12], geom=geom, structure=structure, published=True))
+        SensitiveArea.objects.bulk_create(areas, batch_size=5000)
+        cls.practice = practices[0]
+
+    def test_list(self):
+        bbox = '{},{},{},{}'.format(2.99, 46.49, 3.1, 46.6)
+        for label, params in (('current_month', {}),
+                              ('any_period', {'period': 'any'}),
+                              ('months', {'period': '1,2,3'}),
+                              ('ignore_period', {'period': 'ignore'}),
+                              ('practices', {'period': 'ignore', 'practices': str(self.practice.pk)}),
+                              ('in_bbox', {'period': 'ignore', 'in_bbox': bbox}),
+                              ('bubble', {'period': 'ignore', 'bubble': 'true'})):
+            params.update({'page_size': self.page_size, 'fields': 'id,geometry'})
+            self.measure('list/{}/{}areas'.format(label, self.nb_areas),
+                         lambda: self.client.get(reverse('apiv2:sensitivearea-list'), params),
+                         lambda response: len(response.json()['results']))
+
+    def test_tiles(self):
+        for z, x, y in ((8, 130, 90), (12, 2082, 1451)):
+            self.measure('tile/{}/{}areas'.format(z, self.nb_areas),
+                         lambda: self.client.get(reverse('apiv2:sensitivearea-tile', args=(z, x, y)), {'period': 'ignore'}))
@@ -78,3 +78,37 @@ class SensitiveAreaModelTest(TestCase):
                  "700100 6600000, 700000 6600000))")
         trek = TrekFactory.create()
         self.assertEqual(trek.published_sensitive_areas.count(), 2)
+
+    def test_period_mask(self):
+        # Species of factory are present in june and july
+        sensitive_area = SensitiveAreaFactory.create()
+        sensitive_area.refresh_from_db()
+        self.assertEqual(sensitive_area.period_mask, 0b000001100000)
+
+    def test_geom_buffered_polygon(self):
+        sensitive_area = SensitiveAreaFactory.create()
+        sensitive_area.refresh_from_db()
+        self.assertTrue(sensitive_area.geom_buffered.equals(sensitive_area.geom))
+
+    def test_geom_buffered_point(self):
+        species = SpeciesFactory.create(radius=50)
+        sensitive_area = SensitiveAreaFactory.create(species=species, geom='POINT(700000 6600000)')
+        sensitive_area.refresh_from_db()
+        self.assertTrue(sensitive_area.geom_buffered.equals_exact(sensitive_area.geom.buffer(50, 4), 0.01))
+
+    def test_geom_buffered_point_no_radius(self):
+        sensitive_area = SensitiveAreaFactory.create(geom='POINT(700000 6600000)')
+        sensitive_area.refresh_from_db()
+        self.assertTrue(sensitive_area.geom_buffered.equals_exact(
+            sensitive_area.geom.buffer(settings.SENSITIVITY_DEFAULT_RADIUS, 4), 0.01))
+
+    def test_species_change_updates_areas(self):
+        species = SpeciesFactory.create(radius=50)
+        sensitive_area = SensitiveAreaFactory.create(species=species, geom='POINT(700000 6600000)')
+        species.period01 = True
+        species.period06 = False
+        species.radius = 10
+        species.save()
+        sensitive_area.refresh_from_db()
+        self.assertEqual(sensitive_area.period_mask, 0b000001000001)
+        self.assertTrue(sensitive_area.geom_buffered.equals_exact(sensitive_area.geom.buffer(10, 4), 0.01))
@@ -246,6 +246,11 @@ class APIv2Test(TranslationResetMixin, TrekkingManagerTest):
         self.assertEqual(response.json()['count'], 1)
         self.assertEqual(response.json()['results'][0]['name'], sensitive_area_jf.species.name)
 
+    def test_filters_invalid_period(self):
+        for period in ('0', '13', '1,13', 'a', '1,'):
+            response = self.client.get('/api/v2/sensitivearea/?format=json&language=en&period={}'.format(period))
+            self.assertEqual(response.status_code, 400)
+
     def test_filters_no_period_get_month(self):
         sensitive_area_month = SensitiveAreaFactory.create(**{'species__period01': True})
         SensitiveAreaFactory.create(**{'species__period02': True})
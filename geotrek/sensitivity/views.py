@@ -1,7 +1,7 @@
 import json
 import logging
 from django.conf import settings
-from django.db.models import F, Case, When
+from django.db.models import F
 from django.http import Http404, HttpResponse
 from django.shortcuts import get_object_or_404
 from django.views.generic.detail import BaseDetailView
@@ -9,7 +9,7 @@ from mapentity.views import (MapEntityCreate, MapEntityUpdate, MapEntityLayer, M
                              MapEntityDelete, MapEntityViewSet, MapEntityFormat, LastModifiedMixin)
 from rest_framework import permissions as rest_permissions, viewsets
 
-from geotrek.api.v2.functions import Transform, Buffer, GeometryType, Area
+from geotrek.api.v2.functions import Transform, Area
 from geotrek.authent.decorators import same_structure_required
 
 from geotrek.common.views import PublicOrReadPermMixin
@@ -103,14 +103,11 @@ class SensitiveAreaViewSet(MapEntityViewSet):
         qs = SensitiveArea.objects.existing()
         qs = qs.filter(published=True)
         qs = qs.prefetch_related('species')
-        qs = qs.annotate(geom_type=GeometryType(F('geom')))
-        qs = qs.annotate(geom2d_transformed=Case(
-            When(geom_type='POINT', then=Transform(Buffer(F('geom'), F('species__radius'), 4), settings.API_SRID)),
-            When(geom_type__in=('POLYGON', 'MULTIPOLYGON'), then=Transform(F('geom'), settings.API_SRID))
-        ))
+        # Points buffered by radius of species, maintained by database triggers
+        qs = qs.annotate(geom2d_transformed=Transform(F('geom_buffered'), settings.API_SRID))
         # Ensure smaller areas are at the end of the list, ie above bigger areas on the map
         # to ensure we can select every area in case of overlapping
-        qs = qs.annotate(area=Area('geom2d_transformed')).order_by('-area')
+        qs = qs.annotate(area=Area('geom_buffered')).order_by('-area')
 
         if 'practices' in self.request.GET:
             qs = qs.filter(species__practices__name__in=self.request.GET['practices'].split(','))
@@ -131,14 +128,11 @@ if 'geotrek.trekking' in settings.INSTALLED_APPS:
                 raise Http404
             qs = trek.published_sensitive_areas
             qs = qs.prefetch_related('species')
-            qs = qs.annotate(geom_type=GeometryType(F('geom')))
-            qs = qs.annotate(geom2d_transformed=Case(
-                When(geom_type='POINT', then=Transform(Buffer(F('geom'), F('species__radius'), 4), settings.API_SRID)),
-                When(geom_type='POLYGON', then=Transform(F('geom'), settings.API_SRID))
-            ))
+            # Points buffered by radius of species, maintained by database triggers
+            qs = qs.annotate(geom2d_transformed=Transform(F('geom_buffered'), settings.API_SRID))
             # Ensure smaller areas are at the end of the list, ie above bigger areas on the map
             # to ensure we can select every area in case of overlapping
-            qs = qs.annotate(area=Area('geom2d_transformed')).order_by('-area')
+            qs = qs.annotate(area=Area('geom_buffered')).order_by('-area')
 
             if 'practices' in self.request.GET:
                 qs = qs.filter(species__practices__name__in=self.request.GET['practices'].split(','))
@@ -158,14 +152,11 @@ if 'geotrek.diving' in settings.INSTALLED_APPS:
                 raise Http404
             qs = dive.published_sensitive_areas
             qs = qs.prefetch_related('species')
-            qs = qs.annotate(geom_type=GeometryType(F('geom')))
-            qs = qs.annotate(geom2d_transformed=Case(
-                When(geom_type='POINT', then=Transform(Buffer(F('geom'), F('species__radius'), 4), settings.API_SRID)),
-                When(geom_type='POLYGON', then=Transform(F('geom'), settings.API_SRID))
-            ))
+            # Points buffered by radius of species, maintained by database triggers
+            qs = qs.annotate(geom2d_transformed=Transform(F('geom_buffered'), settings.API_SRID))
             # Ensure smaller areas are at the end of the list, ie above bigger areas on the map
             # to ensure we can select every area in case of overlapping
-            qs = qs.annotate(area=Area('geom2d_transformed')).order_by('-area')
+            qs = qs.annotate(area=Area('geom_buffered')).order_by('-area')
 
             if 'practices' in self.request.GET:
                 qs = qs.filter(species__practices__name__in=self.request.GET['practices'].split(','))
@@ -327,9 +327,28 @@ CACHES = {
         'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
         'LOCATION': CACHE_ROOT,
         'TIMEOUT': 28800,  # 8 hours
+    },
+    # The api backend is used to store API v2 responses
+    'api': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(VAR_DIR, 'cache-api'),
+        'TIMEOUT': 28800,  # 8 hours
     }
 }
 
+API_CACHE = 'api'  # Cache backend used to store API v2 responses
+API_CACHE_TIMEOUT = 3600  # Lifetime of cached API v2 responses in seconds (0 to disable)
+API_CACHE_TIMEOUTS = {}  # Lifetime by endpoint, ex: {'trek': 86400, 'sensitivearea': 0}
+API_STREAMING_PAGE_SIZE = 500  # API v2 pages of this size or more are streamed one element at a time
+API_BATCH_MAX_SIZE = 100  # Maximum number of elements requested at once on API batch routes
+# Attributes of API v2 vector tiles features by endpoint (scalar fields, translated ones in requested language)
+API_VECTOR_TILES_ATTRIBUTES = {
+    'trek': ('id', 'name', 'practice', 'difficulty'),
+    'poi': ('id', 'name', 'type'),
+    'path': ('id', 'name'),
+    'sensitivearea': ('id', 'species__name', 'species__radius'),
+}
+
 SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
 
 THUMBNAIL_ALIASES = {
@@ -406,8 +425,11 @@ ALTIMETRIC_PROFILE_WIDTH = 800
 ALTIMETRIC_PROFILE_FONTSIZE = 25
 ALTIMETRIC_PROFILE_FONT = 'ubuntu'
 ALTIMETRIC_PROFILE_MIN_YSCALE = 1200  # Minimum y scale (in meters)
+# PNG rendering of elevation charts: 'convertit' (conversion server) or 'local' (in-process)
+ALTIMETRIC_PROFILE_RENDERER = 'convertit'
 ALTIMETRIC_AREA_MAX_RESOLUTION = 150  # Maximum number of points (by width/height)
 ALTIMETRIC_AREA_MARGIN = 0.15
+ALTIMETRIC_AREA_ROOT = os.path.join(VAR_DIR, 'dem')  # Storage of computed elevation areas
 
 # Let this be defined at instance-level
 LEAFLET_CONFIG = {
@@ -599,6 +621,10 @@ MOBILE_TILES_RADIUS_SMALL = 0.005  # ~500 m
 MOBILE_TILES_GLOBAL_ZOOMS = list(range(13))
 MOBILE_TILES_LOW_ZOOMS = list(range(13, 15))
 MOBILE_TILES_HIGH_ZOOMS = list(range(15, 17))
+MOBILE_TILES_WORKERS = 4  # Tiles downloaded at the same time
+MOBILE_TILES_RETRIES = 2
+MOBILE_TILES_RETRY_DELAY = 1  # seconds, doubled at each retry
+MOBILE_TILES_TTL = 30 * 24 * 3600  # Downloaded tiles are reused during 30 days
 MOBILE_CATEGORY_PICTO_SIZE = 32
 MOBILE_POI_PICTO_SIZE = 32
 MOBILE_INFORMATIONDESKTYPE_PICTO_SIZE = 32
@@ -21,6 +21,10 @@ MODELTRANSLATION_LANGUAGES = ('en', 'es', 'fr', 'it')
 
 LAND_BBOX_AREAS_ENABLED = True
 
+API_CACHE_TIMEOUT = 0
+
+MOBILE_TILES_RETRY_DELAY = 0
+
 
 class DisableMigrations():
     def __contains__(self, item):
@@ -41,8 +41,8 @@ class SyncRando:
         if self.global_sync.portal:
             treks = treks.filter(Q(portal__name=self.global_sync.portal) | Q(portal=None))
 
-        for trek in treks:
-            self.sync_detail(lang, trek)
+        self.global_sync.run_tasks([('sync_trek_detail', (lang, pk))
+                                    for pk in treks.values_list('pk', flat=True).distinct()])
 
     def sync_detail(self, lang, trek):
         zipname = os.path.join('zip', 'treks', lang, '{pk}.zip'.format(pk=trek.pk))